@@ -0,0 +1,78 @@
+__all__ = [
+    "ADMIN_ROUTER",
+]
+
+import asyncio
+import os
+import secrets
+import tempfile
+import fastapi
+from . import archive
+from ..utils.loop_lag import LoopLagMonitor
+
+# configs
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN', '')
+"""Token in `X-Admin-Token` header to call admin APIs, which are disabled if empty.
+"""
+ARCHIVE_SPOOL_SIZE = int(os.getenv('ARCHIVE_SPOOL_SIZE', str(64 * 1024 * 1024)))
+"""Uploaded archives larger than this are spooled to disk.
+"""
+
+
+def verify_admin_token(x_admin_token: str = fastapi.Header("")):
+    if not ADMIN_TOKEN or not secrets.compare_digest(ADMIN_TOKEN, x_admin_token):
+        raise fastapi.HTTPException(
+            status_code=fastapi.status.HTTP_403_FORBIDDEN,
+            detail="Invalid admin token."
+        )
+
+
+ADMIN_ROUTER = fastapi.APIRouter(
+    prefix="/admin",
+    tags=["admin"],
+    dependencies=[fastapi.Depends(verify_admin_token)],
+)
+
+
+@ADMIN_ROUTER.get("/export")
+def export_graph() -> fastapi.responses.StreamingResponse:
+    """Stream an archive of blocks, relations and their embeddings.
+
+    See `app.business.archive` for the format.
+    """
+    return fastapi.responses.StreamingResponse(
+        archive.export_graph(),
+        media_type="application/octet-stream",
+        headers={"Content-Disposition": 'attachment; filename="inkcre.graph"'},
+    )
+
+
+@ADMIN_ROUTER.post("/import")
+async def import_graph(request: fastapi.Request) -> dict[str, int]:
+    """Import an archive sent as the request body into an empty instance.
+
+    :returns: Number of rows imported by table.
+    """
+    with tempfile.SpooledTemporaryFile(max_size=ARCHIVE_SPOOL_SIZE) as spool:
+        async for chunk in request.stream():
+            spool.write(chunk)
+        spool.seek(0)
+        try:
+            return await asyncio.to_thread(archive.import_graph, spool)  # type: ignore[arg-type]
+        except archive.ArchiveConflict as e:
+            raise fastapi.HTTPException(
+                status_code=fastapi.status.HTTP_409_CONFLICT, detail=str(e)
+            )
+        except ValueError as e:
+            raise fastapi.HTTPException(
+                status_code=fastapi.status.HTTP_400_BAD_REQUEST, detail=str(e)
+            )
+
+
+@ADMIN_ROUTER.get("/loop_lag")
+def get_loop_lag() -> dict:
+    """Lag of the event loop and recent blocks of it with stacks.
+
+    Enable the monitor with `LOOP_LAG_MONITOR=1`.
+    """
+    return LoopLagMonitor.report()
@@ -0,0 +1,301 @@
+"""Export and import of the block graph.
+
+An archive is a stream of frames, each an Arrow IPC stream of one
+record batch of a table, so it can be written and read batch by batch.
+Vectors are Arrow fixed size lists of float32, kept as contiguous buffers
+from end to end.
+
+    archive := MAGIC frame* END
+    frame   := name_length:u16le name:utf8 payload_length:u64le payload:arrow_ipc_stream
+    END     := u16le 0
+
+Requires `pyarrow`, install the `archive` extra.
+"""
+
+__all__ = [
+    "ARCHIVE_TABLES",
+    "ArchiveConflict",
+    "export_graph",
+    "import_graph",
+]
+
+import datetime
+import io
+import logging
+import os
+import struct
+import typing
+import numpy
+import pgvector.sqlalchemy
+import sqlalchemy
+from ..engine import SQLDB_ENGINE
+from ..schemas.block import BlockEmbeddingModel, BlockModel
+from ..schemas.relation import RelationEmbeddingModel, RelationModel
+from ..schemas.storage import StorageTable
+
+if typing.TYPE_CHECKING:
+    import pyarrow
+
+# configs
+BATCH_SIZE = int(os.getenv('ARCHIVE_BATCH_SIZE', '10000'))
+
+ARCHIVE_TABLES: tuple[sqlalchemy.Table, ...] = (
+    StorageTable.__table__,  # type: ignore[attr-defined]
+    BlockModel.__table__,  # type: ignore[attr-defined]
+    RelationModel.__table__,  # type: ignore[attr-defined]
+    BlockEmbeddingModel.__table__,  # type: ignore[attr-defined]
+    RelationEmbeddingModel.__table__,  # type: ignore[attr-defined]
+)
+"""Tables in an archive, in order of foreign keys.
+"""
+
+MAGIC = b"INKCRE-GRAPH\x001\n"
+_NAME_LENGTH = struct.Struct("<H")
+_PAYLOAD_LENGTH = struct.Struct("<Q")
+_PGCOPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack(">ii", 0, 0)
+_PGCOPY_TRAILER = struct.pack(">h", -1)
+
+logger = logging.getLogger(__name__)
+
+
+class ArchiveConflict(Exception):
+    """Tables to import into are not empty.
+    """
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.ipc
+    except ImportError as e:
+        raise RuntimeError("pyarrow is required to archive, install the `archive` extra.") from e
+    return pyarrow
+
+
+def _arrow_type(column: sqlalchemy.Column) -> "pyarrow.DataType":
+    pa = _import_pyarrow()
+    if isinstance(column.type, pgvector.sqlalchemy.VECTOR):
+        return pa.list_(pa.float32(), column.type.dim)
+    if isinstance(column.type, sqlalchemy.Integer):
+        return pa.int64()
+    if isinstance(column.type, sqlalchemy.Float):
+        return pa.float64()
+    if isinstance(column.type, sqlalchemy.DateTime):
+        return pa.timestamp("us", tz="UTC")
+    return pa.string()
+
+
+def _to_batch(table: sqlalchemy.Table, rows: typing.Sequence[typing.Sequence]) -> "pyarrow.RecordBatch":
+    pa = _import_pyarrow()
+    arrays = []
+    for column, values in zip(table.columns, zip(*rows)):
+        type_ = _arrow_type(column)
+        if isinstance(type_, pa.FixedSizeListType):
+            vectors = numpy.asarray(numpy.stack(values), dtype=numpy.float32)
+            arrays.append(pa.FixedSizeListArray.from_arrays(
+                pa.array(vectors.reshape(-1), type=pa.float32()), type_.list_size
+            ))
+        else:
+            arrays.append(pa.array(values, type=type_))
+    return pa.RecordBatch.from_arrays(arrays, names=[column.name for column in table.columns])
+
+
+def _encode_frame(name: str, batch: "pyarrow.RecordBatch") -> bytes:
+    pa = _import_pyarrow()
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, batch.schema) as writer:
+        writer.write_batch(batch)
+    payload = sink.getvalue()
+    encoded_name = name.encode("utf-8")
+    return b"".join((
+        _NAME_LENGTH.pack(len(encoded_name)), encoded_name,
+        _PAYLOAD_LENGTH.pack(payload.size), payload.to_pybytes(),
+    ))
+
+
+def _read_exactly(read: typing.BinaryIO, size: int) -> bytes:
+    data = read.read(size)
+    if len(data) != size:
+        raise ValueError("Archive is truncated.")
+    return data
+
+
+def _decode_frames(read: typing.BinaryIO) -> typing.Iterator[tuple[str, "pyarrow.RecordBatch"]]:
+    pa = _import_pyarrow()
+    if _read_exactly(read, len(MAGIC)) != MAGIC:
+        raise ValueError("Not an InKCre graph archive.")
+    while True:
+        (name_length,) = _NAME_LENGTH.unpack(_read_exactly(read, _NAME_LENGTH.size))
+        if name_length == 0:
+            return
+        name = _read_exactly(read, name_length).decode("utf-8")
+        (payload_length,) = _PAYLOAD_LENGTH.unpack(_read_exactly(read, _PAYLOAD_LENGTH.size))
+        with pa.ipc.open_stream(_read_exactly(read, payload_length)) as reader:
+            for batch in reader:
+                yield name, batch
+
+
+def export_graph(batch_size: int = BATCH_SIZE) -> typing.Iterator[bytes]:
+    """Stream an archive of all tables in `ARCHIVE_TABLES`.
+
+    Tables are read in one repeatable read transaction, so the archive
+    is a consistent snapshot.
+    """
+    _import_pyarrow()
+    yield MAGIC
+    with SQLDB_ENGINE.connect() as conn:
+        conn = conn.execution_options(
+            isolation_level="REPEATABLE READ", stream_results=True, yield_per=batch_size
+        )
+        for table in ARCHIVE_TABLES:
+            columns = [
+                sqlalchemy.cast(column, sqlalchemy.Text) if isinstance(column.type, sqlalchemy.Enum)
+                else column
+                for column in table.columns
+            ]
+            result = conn.execute(sqlalchemy.select(*columns).order_by(*table.primary_key.columns))
+            for rows in result.partitions(batch_size):
+                yield _encode_frame(table.name, _to_batch(table, rows))
+    yield _NAME_LENGTH.pack(0)
+
+
+def _is_binary_copyable(table: sqlalchemy.Table) -> bool:
+    """Whether the table only has integer and vector columns, which are copied in binary.
+    """
+    return all(
+        isinstance(column.type, (sqlalchemy.Integer, pgvector.sqlalchemy.VECTOR))
+        for column in table.columns
+    )
+
+
+def _encode_binary_copy(batch: "pyarrow.RecordBatch") -> bytes:
+    """Encode a batch of integer and vector columns in `COPY ... (FORMAT binary)`.
+
+    Rows are of fixed size, so they are packed by a numpy structured array
+    without a loop over rows.
+    """
+    pa = _import_pyarrow()
+    fields: list[tuple] = [("num_fields", ">i2")]
+    for i, field in enumerate(batch.schema):
+        if isinstance(field.type, pa.FixedSizeListType):
+            dim = field.type.list_size
+            fields += [
+                (f"length_{i}", ">i4"), (f"dim_{i}", ">u2"), (f"unused_{i}", ">u2"),
+                (f"value_{i}", ">f4", (dim,)),
+            ]
+        else:
+            fields += [(f"length_{i}", ">i4"), (f"value_{i}", ">i4")]
+
+    rows = numpy.zeros(batch.num_rows, dtype=numpy.dtype(fields))
+    rows["num_fields"] = batch.num_columns
+    for i, (field, column) in enumerate(zip(batch.schema, batch.columns)):
+        if isinstance(field.type, pa.FixedSizeListType):
+            dim = field.type.list_size
+            rows[f"length_{i}"] = 4 + 4 * dim
+            rows[f"dim_{i}"] = dim
+            rows[f"value_{i}"] = column.values.to_numpy(zero_copy_only=False).reshape(-1, dim)
+        else:
+            rows[f"length_{i}"] = 4
+            rows[f"value_{i}"] = column.to_numpy(zero_copy_only=False)
+    return _PGCOPY_HEADER + rows.tobytes() + _PGCOPY_TRAILER
+
+
+def _copy_text_value(value: typing.Any) -> str:
+    if value is None:
+        return "\\N"
+    if isinstance(value, datetime.datetime):
+        value = value.isoformat()
+    return (
+        str(value).replace("\\", "\\\\").replace("\t", "\\t")
+        .replace("\n", "\\n").replace("\r", "\\r")
+    )
+
+
+def _encode_text_copy(batch: "pyarrow.RecordBatch") -> bytes:
+    """Encode a batch in the text format of `COPY`.
+    """
+    columns = [column.to_pylist() for column in batch.columns]
+    return "".join(
+        "\t".join(_copy_text_value(value) for value in row) + "\n"
+        for row in zip(*columns)
+    ).encode("utf-8")
+
+
+def _copy_columns(table: sqlalchemy.Table, batch: "pyarrow.RecordBatch") -> str:
+    """Column list of `COPY` into the table for the batch.
+
+    :raise ValueError: If the batch has a column not of the table.
+    """
+    for field in batch.schema:
+        if field.name not in table.columns:
+            raise ValueError(f"Unknown column {field.name!r} of table {table.name}")
+    return ", ".join(f'"{field.name}"' for field in batch.schema)
+
+
+def import_graph(read: typing.BinaryIO) -> dict[str, int]:
+    """Import an archive into empty tables, all or nothing.
+
+    Secondary indexes are dropped before `COPY` and built again after it,
+    which is much faster than updating them row by row.
+
+    :returns: Number of rows imported by table.
+    :raise ArchiveConflict: If any table to import into is not empty.
+    :raise ValueError: If the archive has a table or a column not to import.
+    """
+    tables = {table.name: table for table in ARCHIVE_TABLES}
+    counts = dict.fromkeys(tables, 0)
+
+    with SQLDB_ENGINE.begin() as conn:
+        for table in ARCHIVE_TABLES:
+            if conn.execute(sqlalchemy.select(sqlalchemy.literal(1)).select_from(table).limit(1)).first():
+                raise ArchiveConflict(f"Table {table.name} is not empty.")
+
+        indexes = conn.execute(
+            sqlalchemy.text(
+                "SELECT i.relname, pg_get_indexdef(i.oid) FROM pg_index x"
+                " JOIN pg_class i ON i.oid = x.indexrelid"
+                " JOIN pg_class t ON t.oid = x.indrelid"
+                " WHERE t.relname = ANY(:tables)"
+                " AND t.relnamespace = current_schema()::regnamespace"
+                " AND NOT EXISTS (SELECT 1 FROM pg_constraint c WHERE c.conindid = x.indexrelid)"
+            ),
+            {"tables": list(tables)},
+        ).all()
+        for name, _ in indexes:
+            conn.execute(sqlalchemy.text(f'DROP INDEX "{name}"'))
+
+        cursor = conn.connection.cursor()
+        for name, batch in _decode_frames(read):
+            table = tables.get(name)
+            if table is None:
+                raise ValueError(f"Unknown table {name}")
+            columns = _copy_columns(table, batch)
+            if _is_binary_copyable(table):
+                cursor.copy_expert(
+                    f'COPY "{name}" ({columns}) FROM STDIN WITH (FORMAT binary)',
+                    io.BytesIO(_encode_binary_copy(batch)),
+                )
+            else:
+                cursor.copy_expert(
+                    f'COPY "{name}" ({columns}) FROM STDIN',
+                    io.BytesIO(_encode_text_copy(batch)),
+                )
+            counts[name] += batch.num_rows
+
+        for name, definition in indexes:
+            logger.info("Rebuilding index %s", name)
+            conn.execute(sqlalchemy.text(definition))
+
+        for table in ARCHIVE_TABLES:
+            for column in table.primary_key.columns:
+                if not isinstance(column.type, sqlalchemy.Integer):
+                    continue
+                # ids are copied as is, so move the sequence past them
+                conn.execute(sqlalchemy.text(
+                    f'SELECT setval(seq, COALESCE((SELECT max("{column.name}") FROM "{table.name}"), 0) + 1, false)'
+                    f" FROM pg_get_serial_sequence('{table.name}', '{column.name}') AS seq"
+                    " WHERE seq IS NOT NULL"
+                ))
+            conn.execute(sqlalchemy.text(f'ANALYZE "{table.name}"'))
+
+    return counts
@@ -2,31 +2,71 @@ __all__ = [
     "BLOCK_ROUTER",
 ]
 
+import asyncio
+import datetime
+import hashlib
 import json
+import logging
+import os
 import typing
 import pydantic
 import fastapi
 import sqlalchemy.orm
 import sqlmodel
 from typing import Optional as Opt
+from .embedding import search_nearest
+from .organize import OrganizeManager
 from .resolver import Resolver
-from ..engine import get_db_session, SessionLocal
-from ..llm import one_chat, multi_chat
-from ..schemas.block import BlockModel, ResolverType
-from ..schemas.relation import RelationModel
+from ..engine import get_db_session, get_read_db_session, SessionLocal
+from ..llm import (
+    call_in_slot, estimate_tokens, get_embeddings, interactive_priority, multi_chat, one_chat, truncate_to_tokens
+)
+from ..schemas.block import BlockEmbeddingModel, BlockID, BlockModel, ResolverType
+from ..schemas.relation import RelationEmbeddingModel, RelationModel
+from ..utils import deadline
+
+# configs
+SEARCH_RRF_K = int(os.getenv('SEARCH_RRF_K', '60'))
+"""Larger k weakens the lead of top ranked results in fusion.
+"""
+SEARCH_MIN_CANDIDATES = int(os.getenv('SEARCH_MIN_CANDIDATES', '50'))
+"""Min number of candidates taken from each ranking before fusion.
+"""
+QUERY_RERANK_SIZE = int(os.getenv('BLOCK_QUERY_RERANK_SIZE', '12'))
+"""Number of candidates found by beam search that LLM reranks.
+"""
+PICK_CHUNK_TOKENS = int(os.getenv('BLOCK_PICK_CHUNK_TOKENS', '6000'))
+"""Token budget of blocks in one picking prompt.
+"""
+PICK_CONTENT_TOKENS = int(os.getenv('BLOCK_PICK_CONTENT_TOKENS', '300'))
+"""Longer block contents are truncated to this when shown to LLM.
+"""
+BULK_CHUNK_SIZE = int(os.getenv('BLOCK_BULK_CHUNK_SIZE', '500'))
+"""Blocks inserted and committed together by bulk creation.
+"""
+ITERATION_DEADLINE = float(os.getenv('BLOCK_ITERATION_DEADLINE', '10'))
+"""Seconds an iteration may take before it is answered with 504.
+"""
+PICK_DEADLINE = float(os.getenv('BLOCK_PICK_DEADLINE', '120'))
+QUERY_DEADLINE = float(os.getenv('BLOCK_QUERY_DEADLINE', '60'))
+"""Seconds of the LLM driven query, which are spent mostly on LLM calls like picking.
+"""
+
+logger = logging.getLogger(__name__)
 
 BLOCK_ROUTER = fastapi.APIRouter(
-    prefix="/blocks"
+    prefix="/blocks",
+    dependencies=[fastapi.Depends(interactive_priority)],
 )
 
 @BLOCK_ROUTER.get("/recent")
 def get_recent_blocks(
     num: int = 10,
-    db_session: sqlalchemy.orm.Session = fastapi.Depends(get_db_session),
+    db_session: sqlalchemy.orm.Session = fastapi.Depends(get_read_db_session),
 ) -> list[BlockModel]:
     """获取最新的块
     """
-    return _get_recent_blocks(num=num, db_session=db_session)
+    return _get_recent_blocks(num=num)
 
 def _get_recent_blocks(
     num: int,
@@ -49,9 +89,177 @@ def _get_recent_blocks(
 
         return tuple(blocks)
 
+class BlockSearchHit(pydantic.BaseModel):
+    block: BlockModel
+    score: float
+    """Reciprocal rank fusion score.
+    """
+    ranks: dict[str, int]
+    """Rank, from 1, in each ranking the block appears.
+    """
+
+
+@BLOCK_ROUTER.get("/search")
+async def search_blocks(
+    q: str = fastapi.Query(min_length=1),
+    offset: int = fastapi.Query(0, ge=0),
+    limit: int = fastapi.Query(10, ge=1, le=100),
+    vector: bool = True,
+    db_session: sqlalchemy.orm.Session = fastapi.Depends(get_read_db_session),
+) -> list[BlockSearchHit]:
+    """Search blocks by keywords and meaning.
+
+    Full-text, trigram and vector rankings are fused by reciprocal rank.
+
+    :param vector: Whether to rank by embedding of `q` as well, which costs an embedding call.
+    """
+    num = max(offset + limit, SEARCH_MIN_CANDIDATES)
+    embedding_task = asyncio.create_task(call_in_slot(get_embeddings, q)) if vector else None
+    rankings = await asyncio.to_thread(_search_by_keywords, q, num)
+
+    if embedding_task is not None:
+        try:
+            embedding = await embedding_task
+        except Exception:
+            logger.warning("Failed to embed search query, fall back to keywords", exc_info=True)
+        else:
+            rankings["vector"] = await asyncio.to_thread(_search_by_embedding, embedding, num)
+
+    fused = _reciprocal_rank_fusion(rankings)[offset:offset + limit]
+    if not fused:
+        return []
+
+    with SessionLocal() as db_session:
+        blocks = {
+            block.id: block
+            for block in db_session.exec(
+                sqlmodel.select(BlockModel).where(
+                    BlockModel.id.in_([block_id for block_id, _ in fused])  # type: ignore[union-attr]
+                )
+            ).all()
+        }
+    return [
+        BlockSearchHit(
+            block=blocks[block_id],
+            score=score,
+            ranks={
+                name: ranking.index(block_id) + 1
+                for name, ranking in rankings.items() if block_id in ranking
+            },
+        )
+        for block_id, score in fused if block_id in blocks
+    ]
+
+
+_TS_CONFIG = sqlalchemy.literal_column("'simple'::regconfig")
+"""Must match the expression of index `ix_blocks_content_fts`.
+"""
+
+
+def _search_by_keywords(q: str, num: int) -> dict[str, list[BlockID]]:
+    """Rank blocks by full-text match and by trigram match.
+
+    Full-text works for words separated by spaces, trigram for
+    languages like Chinese, both are backed by GIN indexes.
+    """
+    tsvector = sqlalchemy.func.to_tsvector(_TS_CONFIG, BlockModel.content)
+    tsquery = sqlalchemy.func.websearch_to_tsquery(_TS_CONFIG, q)
+    escaped = q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    word_similarity = sqlalchemy.func.word_similarity(q, BlockModel.content)
+
+    with SessionLocal() as db_session:
+        fts = db_session.exec(
+            sqlmodel.select(BlockModel.id)
+            .where(tsvector.op("@@")(tsquery))
+            .order_by(sqlalchemy.func.ts_rank_cd(tsvector, tsquery).desc(), BlockModel.id)
+            .limit(num)
+        ).all()
+        trigram = db_session.exec(
+            sqlmodel.select(BlockModel.id)
+            .where(sqlalchemy.or_(
+                BlockModel.content.ilike(f"%{escaped}%", escape="\\"),  # type: ignore[attr-defined]
+                sqlalchemy.literal(q).op("<%")(BlockModel.content),
+            ))
+            .order_by(word_similarity.desc(), BlockModel.id)
+            .limit(num)
+        ).all()
+    return {"fts": list(fts), "trigram": list(trigram)}
+
+
+def _search_by_embedding(embedding: typing.Sequence[float], num: int) -> list[BlockID]:
+    with SessionLocal() as db_session:
+        return [
+            block_id for block_id, _ in search_nearest(db_session, BlockEmbeddingModel, embedding, num)
+        ]
+
+
+def _reciprocal_rank_fusion(
+    rankings: typing.Mapping[str, typing.Sequence[BlockID]],
+    k: int = SEARCH_RRF_K,
+) -> list[tuple[BlockID, float]]:
+    """Fuse rankings by sum of `1 / (k + rank)`, best first.
+
+    Ties are broken by id to keep pages stable.
+    """
+    scores: dict[BlockID, float] = {}
+    for ranking in rankings.values():
+        for rank, block_id in enumerate(ranking, start=1):
+            scores[block_id] = scores.get(block_id, 0.0) + 1 / (k + rank)
+    return sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+
+
+@BLOCK_ROUTER.get("/embedding")
+def query_from_block_by_embedding_h(
+    block_id: int,
+    num: int = 10,
+    min_similarity: float = 0.5,
+    type: typing.Literal['block', 'relation'] = 'block',
+    db_session: sqlalchemy.orm.Session = fastapi.Depends(get_read_db_session),
+):
+    return _query_from_block_by_embedding(
+        block_id=block_id,
+        db_session=db_session,
+        num=num,
+        min_similarity=min_similarity,
+        type=type
+    )
+
+def _query_from_block_by_embedding(
+    block_id: int,
+    db_session: sqlalchemy.orm.Session,
+    num: int = 10,
+    min_similarity: float = 0.5,
+    type: typing.Literal['block', 'relation'] = 'block',
+) -> tuple[BlockModel | RelationModel, ...]:
+    """Query similar blocks or relations by embedding, query is a block.
+    """
+    query_embedding = db_session.exec(
+        sqlmodel.select(BlockEmbeddingModel.embedding).where(BlockEmbeddingModel.id == block_id)
+    ).one_or_none()
+    if query_embedding is None:
+        block = _get_block(block_id)
+        query_embedding = block.get_embedding() if block is not None else None
+    if query_embedding is None:
+        return ()
+
+    Model = BlockModel if type == 'block' else RelationModel
+    EmbeddingModel = BlockEmbeddingModel if type == 'block' else RelationEmbeddingModel
+    nearest = search_nearest(
+        db_session, EmbeddingModel, query_embedding, num,
+        *((EmbeddingModel.id != block_id,) if type == 'block' else ()),
+    )
+    ids = [id_ for id_, distance in nearest if distance <= 1 - min_similarity]
+    models = {
+        model.id: model
+        for model in db_session.exec(sqlmodel.select(Model).where(Model.id.in_(ids))).all()  # type: ignore[union-attr]
+    }
+    return tuple(models[id_] for id_ in ids if id_ in models)
+
+
 @BLOCK_ROUTER.get("/{block_id}")
 def get_block(
     block_id: int,
+    db_session: sqlalchemy.orm.Session = fastapi.Depends(get_read_db_session),
 ) -> BlockModel:
     block = _get_block(block_id)
     if block is None:
@@ -75,6 +283,7 @@ def create_block(
     response: fastapi.Response,
     background_tasks: fastapi.BackgroundTasks,
     organize: bool = True,
+    db_session: sqlalchemy.orm.Session = fastapi.Depends(get_db_session),
 ):
     """创建块
     """
@@ -96,86 +305,201 @@ def _create_block(block: BlockModel) -> BlockModel:
     return block
 
 
-async def organize_block(block: BlockModel):
-    """整理块
+class BulkBlockResult(pydantic.BaseModel):
+    index: int
+    """Position of the block in the request.
     """
-    with SessionLocal() as db_session:
-        # if block.storage is not None:
-        #     storage = db_session.query(StorageTable).filter(StorageTable.name == block.storage).one()
-        #     storage_model = StorageModel.model_validate(storage)
-        #     content = await storage_model.get_content(block.content)
-        # else:
-        #     content = block.content
-
-        resolver = Resolver.new(block)
-        generator = (await resolver.extract_blocks_and_relations())()
-        try:
-            i = generator.send(None)
-            while True:
-                table_i = i.to_table()
-                db_session.add(table_i)
-                db_session.flush()
-                db_session.refresh(table_i)
-                i = generator.send(i.__class__.model_validate(table_i))
-        except StopIteration:
-            pass
+    id: Opt[BlockID] = None
+    duplicate: bool = False
+    """Whether the block is skipped as the same as a stored one, whose ID is given.
+    """
+    error: Opt[str] = None
 
-        db_session.commit()
 
+@BLOCK_ROUTER.post("/bulk")
+async def create_blocks_in_bulk(
+    request: fastapi.Request,
+    organize: bool = True,
+    dedupe: bool = False,
+) -> fastapi.Response:
+    """批量创建块
 
-@BLOCK_ROUTER.get("/embedding")
-def query_from_block_by_embedding_h(
-    block_id: int,
-    num: int = 10,
-    min_similarity: float = 0.5,
-    type: typing.Literal['block', 'relation'] = 'block',
-    db_session: sqlalchemy.orm.Session = fastapi.Depends(get_db_session),
-):
-    return _query_from_block_by_embedding(
-        block_id=block_id,
-        db_session=db_session,
-        num=num,
-        min_similarity=min_similarity,
-        type=type
+    Body is a JSON array of blocks, or blocks a line if the content type is
+    `application/x-ndjson`. NDJSON is inserted while it is received, in chunks
+    of `BULK_CHUNK_SIZE`, each committed with its organize jobs.
+
+    The response is sent once the whole body is inserted, not streamed:
+    uvicorn gives the body to the disconnect listener of a streaming
+    response, and a client sending its body before reading would block
+    on a streamed response filling up.
+
+    :param dedupe: Skip blocks of the same resolver and content as a stored one.
+    :returns: NDJSON of `BulkBlockResult`, a line per block in order.
+    """
+    results: list[BulkBlockResult] = []
+    chunk: list[tuple[int, BlockModel]] = []
+    async for index, block in _read_bulk_blocks(request):
+        if isinstance(block, str):
+            results.append(BulkBlockResult(index=index, error=block))
+            continue
+        chunk.append((index, block))
+        if len(chunk) >= BULK_CHUNK_SIZE:
+            results.extend(await asyncio.to_thread(_insert_blocks, chunk, organize, dedupe))
+            chunk = []
+    if chunk:
+        results.extend(await asyncio.to_thread(_insert_blocks, chunk, organize, dedupe))
+    # invalid blocks are told before the chunks they are in
+    results.sort(key=lambda result: result.index)
+
+    return fastapi.Response(
+        "".join(result.model_dump_json(exclude_defaults=True) + "\n" for result in results),
+        media_type="application/x-ndjson",
     )
 
-def _query_from_block_by_embedding(
-    block_id: int,
-    db_session: sqlalchemy.orm.Session,
-    num: int = 10,
-    min_similarity: float = 0.5,
-    type: typing.Literal['block', 'relation'] = 'block',
-) -> tuple[BlockModel | RelationModel, ...]:
-    """Query similar blocks or relations by embedding, query is a block.
+
+def _parse_bulk_block(raw: typing.Any) -> BlockModel | str:
+    """Validate a block of a bulk request, or describe why it is invalid.
+    """
+    try:
+        block = BlockModel.model_validate(json.loads(raw) if isinstance(raw, bytes) else raw)
+    except (ValueError, pydantic.ValidationError) as e:
+        return str(e)
+    block.id = None
+    return block
+
+
+async def _read_bulk_blocks(
+    request: fastapi.Request,
+) -> typing.AsyncIterator[tuple[int, BlockModel | str]]:
+    """Blocks of a bulk request by position, as they are received if NDJSON.
     """
-    block_table = db_session.query(BlockTable).filter(BlockTable.id == block_id).one()
-    block = BlockTable.to_model(block_table)
-    query_embedding = block.get_embedding()  # TODO what if None
-
-    TypeTable = BlockTable if type == 'block' else RelationTable
-
-    similars = db_session.execute(
-        sqlalchemy
-        .select(TypeTable)
-        .where(TypeTable.embedding != None)
-        .where(TypeTable.id != block.id)
-        .filter()
-        .order_by(TypeTable.embedding.cosine_distance(query_embedding))
-        .limit(num)
-    ).scalars().all()
-
-    return tuple(
-        TypeTable.to_model(i)
-        for i in similars
+    if request.headers.get("content-type", "").startswith("application/x-ndjson"):
+        index = 0
+        buffer = b""
+        async for data in request.stream():
+            *lines, buffer = (buffer + data).split(b"\n")
+            for line in lines:
+                if line.strip():
+                    yield index, _parse_bulk_block(line)
+                    index += 1
+        if buffer.strip():
+            yield index, _parse_bulk_block(buffer)
+        return
+
+    try:
+        items = json.loads(await request.body())
+    except ValueError:
+        items = None
+    if not isinstance(items, list):
+        raise fastapi.HTTPException(
+            status_code=fastapi.status.HTTP_400_BAD_REQUEST,
+            detail="Body must be a JSON array of blocks or NDJSON."
+        )
+    for index, item in enumerate(items):
+        yield index, _parse_bulk_block(item)
+
+
+def _insert_blocks(
+    chunk: typing.Sequence[tuple[int, BlockModel]], organize: bool, dedupe: bool
+) -> list[BulkBlockResult]:
+    """Insert blocks in one multi-row statement and queue organize jobs of them.
+
+    With `dedupe`, blocks whose resolver and md5 of content match a stored
+    block, or an earlier block of the chunk, are not inserted. The index on
+    them is not unique, as organize stores the same content many times,
+    e.g. a type of info. So bulk inserts with dedupe take turns by an advisory
+    lock, then none of them inserts a block another is inserting.
+    """
+    results: list[BulkBlockResult] = []
+    to_insert: list[tuple[int, BlockModel]] = []
+    with SessionLocal() as db_session:
+        existing: dict[tuple[str, str], BlockID] = {}
+        if dedupe:
+            db_session.execute(
+                sqlalchemy.text("SELECT pg_advisory_xact_lock(hashtext('inkcre.blocks.bulk'))")
+            )
+            keys = {
+                (block.resolver, hashlib.md5(block.content.encode("utf-8")).hexdigest())
+                for _, block in chunk
+            }
+            content_md5 = sqlalchemy.func.md5(BlockModel.content)
+            existing = {
+                (resolver, md5): block_id
+                for resolver, md5, block_id in db_session.execute(
+                    sqlalchemy.select(
+                        BlockModel.resolver, content_md5, sqlalchemy.func.min(BlockModel.id)
+                    )
+                    .where(sqlalchemy.tuple_(BlockModel.resolver, content_md5).in_(keys))
+                    .group_by(BlockModel.resolver, content_md5)
+                ).all()
+            }
+
+        # position in `to_insert` of the first block of each key
+        firsts: dict[tuple[str, str], int] = {}
+        duplicates: list[tuple[int, int]] = []
+        for index, block in chunk:
+            if dedupe:
+                key = (block.resolver, hashlib.md5(block.content.encode("utf-8")).hexdigest())
+                if key in existing:
+                    results.append(BulkBlockResult(index=index, id=existing[key], duplicate=True))
+                    continue
+                if key in firsts:
+                    duplicates.append((index, firsts[key]))
+                    continue
+                firsts[key] = len(to_insert)
+            to_insert.append((index, block))
+
+        ids: list[BlockID] = []
+        if to_insert:
+            now = datetime.datetime.now()
+            ids = list(db_session.execute(
+                sqlalchemy.insert(BlockModel).returning(BlockModel.id, sort_by_parameter_order=True),
+                [
+                    {
+                        "resolver": block.resolver, "content": block.content, "storage": block.storage,
+                        "created_at": now, "updated_at": now,
+                    }
+                    for _, block in to_insert
+                ],
+            ).scalars())
+            if organize:
+                OrganizeManager.enqueue(db_session, "block", ids)
+        db_session.commit()
+
+    results.extend(BulkBlockResult(index=index, id=id_) for (index, _), id_ in zip(to_insert, ids))
+    results.extend(
+        BulkBlockResult(index=index, id=ids[first], duplicate=True) for index, first in duplicates
     )
+    return results
 
 
-@BLOCK_ROUTER.get("/{block_id}/iteration")
+async def organize_block(block: BlockModel):
+    """整理块
+
+    解析出的块和关系分两条语句批量插入。
+    """
+    # if block.storage is not None:
+    #     storage = db_session.query(StorageTable).filter(StorageTable.name == block.storage).one()
+    #     storage_model = StorageModel.model_validate(storage)
+    #     content = await storage_model.get_content(block.content)
+    # else:
+    #     content = block.content
+
+    subgraph = await Resolver.extract(block)
+
+    with SessionLocal() as db_session:
+        subgraph.save(db_session)
+        db_session.commit()
+
+
+@BLOCK_ROUTER.get(
+    "/{block_id}/iteration", dependencies=[fastapi.Depends(deadline.deadline(ITERATION_DEADLINE))]
+)
 async def iterate_from_block(
     block_id: int,
     max_depth: int = 2,
     exclude_start_block: bool = True,
-    db_session: sqlalchemy.orm.Session = fastapi.Depends(get_db_session)
+    db_session: sqlalchemy.orm.Session = fastapi.Depends(get_read_db_session)
 ):
     return await _iterate_from_block(
         block_id=block_id,
@@ -190,35 +514,38 @@ async def _iterate_from_block(
     max_depth: int = 2,
     exclude_start_block: bool = True,
 ):
+    """Blocks and relations reachable from the block by outgoing relations.
 
-    depth = 0
+    Walks level by level, one query a level, and goes along no block twice,
+    so cycles end the walk.
+
+    :param max_depth: Relations are gone along from blocks up to `max_depth + 1`
+        relations away, the start block being 0 away.
+    """
     r_blocks: set[int] = set()
     r_relations: set[int] = set()
 
     if not exclude_start_block:
         r_blocks.add(block_id)
 
-    def iterate_one(inner_block_id: int):
-        nonlocal depth
-
-        relations = db_session.query(RelationTable).filter(
-            RelationTable.from_ == inner_block_id
+    visited = {block_id}
+    frontier = {block_id}
+    depth = 0
+    while frontier:
+        deadline.check()
+        relations = db_session.exec(
+            sqlmodel.select(RelationModel.id, RelationModel.to_)  # type: ignore[call-overload]
+            .where(RelationModel.from_.in_(frontier))  # type: ignore[attr-defined]
         ).all()
-
-        r_relations.update(relation.id for relation in relations)
-
-        for relation in relations:
-            block = db_session.query(BlockTable).filter(
-                BlockTable.id == relation.to_
-            ).one()
-            r_blocks.add(block.id)
-
-            if depth <= max_depth:
-                iterate_one(block.id)
-
+        r_relations.update(relation_id for relation_id, _ in relations)
+        r_blocks.update(to_ for _, to_ in relations)
+        if depth > max_depth:
+            break
+        frontier = {to_ for _, to_ in relations} - visited
+        visited |= frontier
         depth += 1
-
-    iterate_one(block_id)
+    if exclude_start_block:
+        r_blocks.discard(block_id)
 
     return {
         "relations": r_relations,
@@ -226,77 +553,216 @@ async def _iterate_from_block(
     }
 
 
-
 class PickBaRBody(pydantic.BaseModel):
     blocks: set[int]
     relations: set[int]
     requirements: list[str] | None = None
 
 
-@BLOCK_ROUTER.put("/pick")
-def pick_blocks(
+class _PickedBlocks(pydantic.BaseModel):
+    blocks: list[BlockID]
+
+
+_PICKED_BLOCKS_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "picked_blocks",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {"blocks": {"type": "array", "items": {"type": "integer"}}},
+            "required": ["blocks"],
+            "additionalProperties": False,
+        },
+    },
+}
+
+
+async def _ask_picked_blocks(prompt: str) -> list[BlockID]:
+    """Chat and parse the reply as `_PickedBlocks`.
+
+    :raise pydantic.ValidationError: If the reply does not match the schema.
+    """
+    res = await call_in_slot(
+        one_chat, prompt, response_format=_PICKED_BLOCKS_FORMAT,
+        cacheable=True, validate=_PickedBlocks.model_validate_json,
+    )
+    return _PickedBlocks.model_validate_json(res).blocks
+
+
+@BLOCK_ROUTER.put("/pick", dependencies=[fastapi.Depends(deadline.deadline(PICK_DEADLINE))])
+async def pick_blocks(
     body: PickBaRBody,
     method: typing.Literal['llm'] = 'llm',
     db_session: sqlalchemy.orm.Session = fastapi.Depends(get_db_session)
-):
-    if method == "llm":
-        block_tables = db_session.query(BlockTable).filter(
-            BlockTable.id.in_(body.blocks)
-        ).all()
-        blocks = tuple(
-            BlockTable.to_model(block_table)
-            for block_table in block_tables
+) -> list[BlockID]:
+    """选出最满足要求的块
+
+    块按 token 预算分片，各片并行让 LLM 初选，入围的块再合并终选；
+    入围的块仍超出预算则继续分片，直到一次能放下。
+    LLM 不再收窄入围的块时，不再终选，返回全部入围的块。
+    """
+    if method != "llm":
+        raise NotImplementedError
+    if not body.requirements:
+        raise fastapi.HTTPException(
+            status_code=fastapi.status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail="Requirements are needed to pick blocks."
         )
 
-        relation_tables = db_session.query(RelationTable).filter(
-            RelationTable.id.in_(body.relations)
-        ).all()
-        relations = tuple(
-            RelationTable.to_model(relation_table)
-            for relation_table in relation_tables
+    blocks = db_session.exec(
+        sqlmodel.select(BlockModel).where(BlockModel.id.in_(body.blocks))  # type: ignore[union-attr]
+    ).all()
+    relations = db_session.exec(
+        sqlmodel.select(RelationModel).where(RelationModel.id.in_(body.relations))  # type: ignore[union-attr]
+    ).all()
+    # text projection of non-text blocks, e.g. alt:text of images, is cached as relations
+    texts = await asyncio.gather(*(block.get_context_as_text() for block in blocks))
+    lines = {
+        typing.cast(BlockID, block.id): f"{block.id},{json.dumps(truncate_to_tokens(text, PICK_CONTENT_TOKENS), ensure_ascii=False)}\n"
+        for block, text in zip(blocks, texts)
+    }
+
+    try:
+        return await _pick_by_chunks(lines, relations, body.requirements)
+    except pydantic.ValidationError as e:
+        raise fastapi.HTTPException(
+            status_code=fastapi.status.HTTP_502_BAD_GATEWAY,
+            detail=f"Unexpected reply from LLM: {e}"
         )
 
-        prompt = "下面有一组块和一组关系，根据关系对块的注释，选出最满足要求的几个块。"
-        prompt += "块的内容即信息。关系描述块和块之间的联系，是块的动态属性。"
-        prompt += "关系可以解读为：<to.content>是<from.content>的<relation.content>。"
-        # prompt += "务必只返回JSON，格式如下：```json\n"
-        # prompt += json.dumps({
-        #     "relations": [1, 2],
-        #     "blocks": [1, 2]
-        # })
-        # prompt += "```\n"
-        prompt += "务必只返回JSON，格式为整数数组。"
-
-        prompt += "## 块\n```csv\n"
-        prompt += "id,content\n"
-        for block in blocks:
-            prompt += f"{block.id},{block.content}\n"
-
-        prompt += "```\n## 关系\n```csv\n"
-        prompt += "id,from,to,content\n"
-        for relation in relations:
-            prompt += f"{relation.id},{relation.from_},{relation.to_},{relation.content}\n"
-
-        prompt += "```\n## 要求"
-        if body.requirements:
-            prompt += "\n- ".join(body.requirements)
-        else:
-            raise ValueError
 
-        llm_res = one_chat(prompt)
+async def _pick_by_chunks(
+    lines: dict[BlockID, str],
+    relations: typing.Sequence[RelationModel],
+    requirements: list[str],
+) -> list[BlockID]:
+    """Pick from chunks of blocks, then from the finalists, until they fit in a chunk.
 
-        return json.loads(llm_res.strip("```")[4:])
-    else:
-        raise NotImplementedError
+    If the LLM does not narrow the finalists down any more, all of them
+    are returned without a final pick.
+    """
+    candidates = list(lines)
+    while True:
+        deadline.check()
+        chunks = _chunk_by_tokens(candidates, lines, PICK_CHUNK_TOKENS)
+        if len(chunks) == 1:
+            return await _pick_from_chunk(chunks[0], lines, relations, requirements)
+        picked = await asyncio.gather(*(
+            _pick_from_chunk(chunk, lines, relations, requirements) for chunk in chunks
+        ))
+        finalists = [block_id for chunk_picked in picked for block_id in chunk_picked]
+        # each is picked already, and a final pick could only see some of them
+        if len(finalists) >= len(candidates):
+            return finalists
+        candidates = finalists
+
+
+def _chunk_by_tokens(
+    block_ids: typing.Sequence[BlockID], lines: dict[BlockID, str], max_tokens: int
+) -> list[list[BlockID]]:
+    """Split blocks into chunks whose lines take at most `max_tokens`.
+
+    A block exceeds the budget alone is still in a chunk by itself.
+    """
+    chunks: list[list[BlockID]] = [[]]
+    tokens = 0
+    for block_id in block_ids:
+        line_tokens = estimate_tokens(lines[block_id])
+        if chunks[-1] and tokens + line_tokens > max_tokens:
+            chunks.append([])
+            tokens = 0
+        chunks[-1].append(block_id)
+        tokens += line_tokens
+    return chunks
+
+
+async def _pick_from_chunk(
+    chunk: list[BlockID],
+    lines: dict[BlockID, str],
+    relations: typing.Sequence[RelationModel],
+    requirements: list[str],
+) -> list[BlockID]:
+    if not chunk:
+        return []
+    in_chunk = set(chunk)
+
+    prompt = [
+        "下面有一组块和一组关系，根据关系对块的注释，选出最满足要求的几个块。",
+        "块的内容即信息。关系描述块和块之间的联系，是块的动态属性。",
+        "关系可以解读为：<to.content>是<from.content>的<relation.content>。",
+        "只从下列块中选择，返回所选块的 id。",
+        "## 块\n```csv\nid,content\n",
+        *(lines[block_id] for block_id in chunk),
+        "```\n## 关系\n```csv\nid,from,to,content\n",
+        *(
+            f"{relation.id},{relation.from_},{relation.to_},{json.dumps(relation.content, ensure_ascii=False)}\n"
+            for relation in relations
+            if relation.from_ in in_chunk or relation.to_ in in_chunk
+        ),
+        "```\n## 要求\n- ",
+        "\n- ".join(requirements),
+    ]
+    picked = await _ask_picked_blocks("".join(prompt))
+    return [block_id for block_id in picked if block_id in in_chunk]
+
+
+class BlockQueryResult(pydantic.BaseModel):
+    blocks: list[BlockID]
+    llm_calls: int
+    """Chat completions spent.
+    """
+    hops: int
 
 
-@BLOCK_ROUTER.get("/query/llm_driven")
+@BLOCK_ROUTER.get(
+    "/query/llm_driven", dependencies=[fastapi.Depends(deadline.deadline(QUERY_DEADLINE))]
+)
 async def llm_driven_block_query(
     block_id: int,
     prompt: str = "",
     scope: int = 1,  # 视野范围
-    db_session: sqlalchemy.orm.Session = fastapi.Depends(get_db_session)
-):
+    strategy: typing.Literal['llm', 'beam'] = 'llm',
+    max_hops: int = fastapi.Query(5, ge=0, le=20),
+    max_llm_calls: int = fastapi.Query(6, ge=0),
+    beam_width: int = fastapi.Query(4, ge=1, le=32),
+    db_session: sqlalchemy.orm.Session = fastapi.Depends(get_read_db_session)
+) -> BlockQueryResult:
+    """找出满足查询要求的块
+
+    - `llm`: LLM 每一跳选择沿哪个关系走，每跳一次对话。
+    - `beam`: 用向量相似度在本地给邻居打分并保留前 `beam_width` 个，
+      多跳扩展后只在最后调用一次 LLM 对候选重排。
+
+    :param max_hops: 最多沿关系走几跳
+    :param max_llm_calls: 最多调用几次 LLM，beam 为 0 时直接按相似度返回
+    """
+    query_block = _get_block(block_id)
+    if query_block is None:
+        raise fastapi.HTTPException(
+            status_code=fastapi.status.HTTP_404_NOT_FOUND,
+            detail=f"Block with id {block_id} not found."
+        )
+    query_text = f"{prompt}\n{await query_block.get_context_as_text()}".strip()
+
+    if strategy == "beam":
+        return await _beam_search_query(
+            block_id, query_text,
+            max_hops=max_hops, max_llm_calls=max_llm_calls, beam_width=beam_width,
+        )
+    return await _llm_walk_query(
+        block_id, query_text, db_session,
+        max_hops=max_hops, max_llm_calls=max_llm_calls,
+    )
+
+
+async def _llm_walk_query(
+    block_id: BlockID,
+    query_text: str,
+    db_session: sqlalchemy.orm.Session,
+    max_hops: int,
+    max_llm_calls: int,
+) -> BlockQueryResult:
     meta_prompt = "沿着<块与关系局部视野>，找出信息库中满足<查询要求>的块。\n"
     # meta_prompt += "- 无效假设：默认推定这些信息都不符合要求。\n"
     meta_prompt += "每次回复都严格地只返回下列内容：\n"
@@ -305,66 +771,167 @@ async def llm_driven_block_query(
     meta_prompt += "  - **最**表示你确定没有更符合要求的块了\n"
     meta_prompt += "- `NOTFOUND:<reason>.` 表明尽了所有努力，在整个信息库中的确找不到符合要求的块。\n"
 
-    query_block = _get_block(block_id, db_session)
     # use embed to find a start block (see query block as external)
-    start_block = _query_from_block_by_embedding(
+    start_blocks = _query_from_block_by_embedding(
         block_id=block_id, db_session=db_session,
-        type="block", num=3
-    )[0]
+        type="block", num=3, min_similarity=0,
+    )
+    if not start_blocks:
+        return BlockQueryResult(blocks=[], llm_calls=0, hops=0)
 
     query_prompt = "<查询要求>\n"
-    query_prompt += f"- {prompt}\n"
-    query_prompt += f"- {await query_block.get_context_as_text()}\n"
+    query_prompt += f"- {query_text}\n"
     query_prompt += "</查询要求>\n"
 
     chat = multi_chat(meta_prompt+query_prompt)
 
-    async def llm_driven_query(current_block_id: int) -> typing.Iterable[int]:
-        current_block = _get_block(current_block_id, db_session)
-
-        raw_outgoing_relations = db_session.query(RelationTable).filter(
-            RelationTable.from_ == current_block_id,
+    async def local_view_prompt(current_block_id: int) -> str:
+        outgoing_relations = db_session.exec(
+            sqlmodel.select(RelationModel).where(RelationModel.from_ == current_block_id)
         ).all()
-        outgoing_relations = tuple(
-            RelationTable.to_model(relation)
-            for relation in raw_outgoing_relations
-        )
 
         context_prompt = "<块与关系局部视野>\n"
-        # context_prompt += f"当前块内容：{await current_block.get_context_as_text()}\n"
         context_prompt += "当前块的外向关系：\n```csv\n关系ID,目标块是当前块的,目标块ID,目标块内容\n"
         for outgoing_relation in outgoing_relations:
-            to_block = _get_block(outgoing_relation.to_, db_session)
+            to_block = typing.cast(BlockModel, _get_block(outgoing_relation.to_))
             context_prompt += f"{outgoing_relation.id},{outgoing_relation.content},{to_block.id},{await to_block.get_context_as_text()}\n"
         context_prompt += "```\n"
 
         if not outgoing_relations:
-            raw_incoming_relations = db_session.query(RelationTable).filter(
-                RelationTable.to_ == current_block_id,
+            incoming_relations = db_session.exec(
+                sqlmodel.select(RelationModel).where(RelationModel.to_ == current_block_id)
             ).all()
-            incoming_relations = tuple(
-                RelationTable.to_model(relation)
-                for relation in raw_incoming_relations
-            )
             context_prompt += "当前块的内向关系：\n```csv\n关系ID,当前块是来源块的,来源块ID,来源块内容\n"
             for incoming_relation in incoming_relations:
-                from_block = _get_block(incoming_relation.from_, db_session)
+                from_block = typing.cast(BlockModel, _get_block(incoming_relation.from_))
                 context_prompt += f"{incoming_relation.id},{incoming_relation.content},{incoming_relation.from_},{await from_block.get_context_as_text()}\n"
             context_prompt += "```\n"
         context_prompt += "</块与关系局部视野>\n不要忘记<查询要求>！"
-
-        res = chat(context_prompt)
+        return context_prompt
+
+    llm_calls = hops = 0
+    current_block_id = typing.cast(BlockID, start_blocks[0].id)
+    while llm_calls < max_llm_calls:
+        deadline.check()
+        res = await call_in_slot(chat, await local_view_prompt(current_block_id))
+        llm_calls += 1
         command, params = res.split(":", 1)
 
         params = params.split(".", 1)[0]
         if command == "FOLLOW":
-            return await llm_driven_query(int(params))
+            if hops >= max_hops:
+                break
+            hops += 1
+            current_block_id = int(params)
         elif command == "FOUND":
-            return json.loads(params)
+            return BlockQueryResult(blocks=json.loads(params), llm_calls=llm_calls, hops=hops)
         elif command == "NOTFOUND":
-            return []
+            break
         else:
             raise ValueError(f"unknown command from LLM, {command}")
 
-    return await llm_driven_query(start_block.id)
+    return BlockQueryResult(blocks=[], llm_calls=llm_calls, hops=hops)
+
+
+async def _beam_search_query(
+    block_id: BlockID,
+    query_text: str,
+    max_hops: int,
+    max_llm_calls: int,
+    beam_width: int,
+) -> BlockQueryResult:
+    embedding = await call_in_slot(get_embeddings, query_text)
+
+    scores = await asyncio.to_thread(_nearest_blocks, embedding, beam_width + 1)
+    scores.pop(block_id, None)
+    beam = sorted(scores, key=scores.__getitem__, reverse=True)[:beam_width]
+    visited = {block_id, *scores}
+
+    hops = 0
+    while beam and hops < max_hops:
+        deadline.check()
+        neighbours = {
+            neighbour: score
+            for neighbour, score in (await asyncio.to_thread(_score_neighbours, beam, embedding)).items()
+            if neighbour not in visited
+        }
+        if not neighbours:
+            break
+        hops += 1
+        visited.update(neighbours)
+        scores.update(neighbours)
+        beam = sorted(neighbours, key=neighbours.__getitem__, reverse=True)[:beam_width]
+
+    candidates = sorted(scores, key=scores.__getitem__, reverse=True)[:QUERY_RERANK_SIZE]
+    if not candidates or max_llm_calls < 1:
+        return BlockQueryResult(blocks=candidates, llm_calls=0, hops=hops)
+    return BlockQueryResult(
+        blocks=await _rerank_by_llm(query_text, candidates), llm_calls=1, hops=hops
+    )
+
+
+def _nearest_blocks(embedding: typing.Sequence[float], num: int) -> dict[BlockID, float]:
+    """Blocks most similar to the embedding, with cosine similarity.
+    """
+    with SessionLocal() as db_session:
+        nearest = search_nearest(db_session, BlockEmbeddingModel, embedding, num)
+    return {block_id: 1 - distance for block_id, distance in nearest}
+
+
+def _score_neighbours(
+    block_ids: typing.Collection[BlockID], embedding: typing.Sequence[float]
+) -> dict[BlockID, float]:
+    """Score blocks related to `block_ids` in either direction by similarity to the embedding.
+
+    A neighbour without embedding is scored by the relation to it.
+    """
+    neighbour = sqlalchemy.case(
+        (RelationModel.from_.in_(block_ids), RelationModel.to_),  # type: ignore[attr-defined]
+        else_=RelationModel.from_,
+    )
+    score = sqlalchemy.func.coalesce(
+        1 - BlockEmbeddingModel.embedding.cosine_distance(embedding),  # type: ignore[attr-defined]
+        1 - RelationEmbeddingModel.embedding.cosine_distance(embedding),  # type: ignore[attr-defined]
+        0,
+    )
+    with SessionLocal() as db_session:
+        rows = db_session.exec(
+            sqlmodel.select(neighbour, sqlalchemy.func.max(score))
+            .select_from(RelationModel)
+            .outerjoin(BlockEmbeddingModel, BlockEmbeddingModel.id == neighbour)
+            .outerjoin(RelationEmbeddingModel, RelationEmbeddingModel.id == RelationModel.id)
+            .where(sqlalchemy.or_(
+                RelationModel.from_.in_(block_ids),  # type: ignore[attr-defined]
+                RelationModel.to_.in_(block_ids),  # type: ignore[attr-defined]
+            ))
+            .group_by(neighbour)
+        ).all()
+    return {block_id: score for block_id, score in rows}
+
 
+async def _rerank_by_llm(query_text: str, candidates: list[BlockID]) -> list[BlockID]:
+    """Ask LLM to pick and order candidates satisfying the query, in one call.
+
+    Falls back to the given order if the reply does not match the schema.
+    """
+    with SessionLocal() as db_session:
+        blocks = db_session.exec(
+            sqlmodel.select(BlockModel).where(BlockModel.id.in_(candidates))  # type: ignore[union-attr]
+        ).all()
+    texts = await asyncio.gather(*(block.get_context_as_text() for block in blocks))
+
+    prompt = "从下列候选块中选出满足<查询要求>的块，按符合程度从高到低排列。\n"
+    prompt += f"<查询要求>\n{query_text}\n</查询要求>\n"
+    prompt += "## 候选块\n```csv\nid,content\n"
+    prompt += "".join(
+        f"{block.id},{json.dumps(truncate_to_tokens(text, PICK_CONTENT_TOKENS), ensure_ascii=False)}\n"
+        for block, text in zip(blocks, texts)
+    )
+    prompt += "```"
+
+    try:
+        picked = await _ask_picked_blocks(prompt)
+    except pydantic.ValidationError:
+        logger.warning("Unexpected rerank reply from LLM", exc_info=True)
+        return candidates
+    return [block_id for block_id in picked if block_id in candidates]
@@ -0,0 +1,130 @@
+"""Nearest neighbour search over embeddings.
+
+Embeddings are always stored in full precision. `EMBEDDING_INDEX`
+picks the HNSW index searched:
+
+- `full`: index on the vectors themselves, 4 KB a vector.
+- `halfvec`: index on vectors cast to half precision, half the size.
+- `binary`: index on sign bits of vectors, 1/32 the size.
+
+Compact indexes find `EMBEDDING_RERANK_FACTOR` times the candidates,
+which are re-ranked by full precision distance.
+Switch with `python -m app.cli index-embeddings <mode>`.
+"""
+
+__all__ = [
+    "EMBEDDING_INDEX",
+    "IndexMode",
+    "search_nearest",
+    "rebuild_indexes",
+]
+
+import logging
+import os
+import typing
+import pgvector.sqlalchemy
+import sqlalchemy
+import sqlalchemy.orm
+from ..engine import SQLDB_DIRECT_ENGINE
+from ..schemas.block import BlockEmbeddingModel
+from ..schemas.relation import RelationEmbeddingModel
+
+IndexMode: typing.TypeAlias = typing.Literal["full", "halfvec", "binary"]
+
+# configs
+EMBEDDING_INDEX = typing.cast(IndexMode, os.getenv('EMBEDDING_INDEX', 'full'))
+RERANK_FACTOR = int(os.getenv('EMBEDDING_RERANK_FACTOR', '4'))
+
+DIM = 1024
+EMBEDDING_MODELS = (BlockEmbeddingModel, RelationEmbeddingModel)
+EmbeddingModelT: typing.TypeAlias = type[BlockEmbeddingModel] | type[RelationEmbeddingModel]
+
+_INDEX_EXPRESSIONS: dict[IndexMode, str] = {
+    "full": "embedding vector_cosine_ops",
+    "halfvec": f"(embedding::halfvec({DIM})) halfvec_cosine_ops",
+    "binary": f"(binary_quantize(embedding)::bit({DIM})) bit_hamming_ops",
+}
+"""Indexed expressions, which must match those of `_approximate_distance`.
+"""
+
+logger = logging.getLogger(__name__)
+
+
+def _index_name(table_name: str, mode: IndexMode) -> str:
+    # full indexes are created by migrations
+    return f"ix_{table_name}_embedding" if mode == "full" else f"ix_{table_name}_embedding_{mode}"
+
+
+def _approximate_distance(
+    column: sqlalchemy.ColumnElement, embedding: typing.Sequence[float], mode: IndexMode
+) -> sqlalchemy.ColumnElement[float]:
+    if mode == "halfvec":
+        return sqlalchemy.cast(column, pgvector.sqlalchemy.HALFVEC(DIM)).cosine_distance(  # type: ignore[attr-defined]
+            sqlalchemy.cast(embedding, pgvector.sqlalchemy.HALFVEC(DIM))
+        )
+    if mode == "binary":
+        return sqlalchemy.cast(
+            sqlalchemy.func.binary_quantize(column), pgvector.sqlalchemy.BIT(DIM)
+        ).hamming_distance(  # type: ignore[attr-defined]
+            sqlalchemy.func.binary_quantize(sqlalchemy.cast(embedding, pgvector.sqlalchemy.VECTOR(DIM)))
+        )
+    return column.cosine_distance(embedding)  # type: ignore[attr-defined]
+
+
+def search_nearest(
+    db_session: sqlalchemy.orm.Session,
+    model: EmbeddingModelT,
+    embedding: typing.Sequence[float],
+    num: int,
+    *where: sqlalchemy.ColumnElement[bool],
+    mode: IndexMode | None = None,
+) -> list[tuple[int, float]]:
+    """Find ids of `num` embeddings nearest to `embedding`.
+
+    :param where: Filters on `model`.
+    :param mode: Index to search, defaults to `EMBEDDING_INDEX`.
+    :returns: Ids with full precision cosine distance, nearest first.
+    """
+    mode = mode or EMBEDDING_INDEX
+    num_candidates = num if mode == "full" else num * RERANK_FACTOR
+    # HNSW finds at most ef_search candidates, 40 by default
+    db_session.execute(sqlalchemy.text(f"SET LOCAL hnsw.ef_search = {max(40, num_candidates)}"))
+
+    candidates = (
+        sqlalchemy.select(model.id, model.embedding)  # type: ignore[call-overload]
+        .where(*where)
+        .order_by(_approximate_distance(model.embedding, embedding, mode))  # type: ignore[arg-type]
+        .limit(num_candidates)
+        .subquery()
+    )
+    distance = candidates.c.embedding.cosine_distance(embedding)
+    rows = db_session.execute(
+        sqlalchemy.select(candidates.c.id, distance).order_by(distance).limit(num)
+    ).all()
+    return [(id_, value) for id_, value in rows]
+
+
+def rebuild_indexes(mode: IndexMode):
+    """Build the index of `mode` for every embedding table and drop others.
+
+    Indexes are built and dropped concurrently, so search keeps working
+    with the old index until the new one is ready. Vectors are not touched.
+    """
+    with SQLDB_DIRECT_ENGINE.connect() as conn:
+        conn = conn.execution_options(isolation_level="AUTOCOMMIT")
+        if mode != "full":
+            # halfvec and binary_quantize are available since pgvector 0.7
+            conn.execute(sqlalchemy.text("ALTER EXTENSION vector UPDATE"))
+        for model in EMBEDDING_MODELS:
+            table_name = model.__tablename__
+            name = _index_name(table_name, mode)
+            logger.info("Building index %s", name)
+            conn.execute(sqlalchemy.text(
+                f'CREATE INDEX CONCURRENTLY IF NOT EXISTS "{name}" ON "{table_name}"'
+                f" USING hnsw ({_INDEX_EXPRESSIONS[mode]})"
+            ))
+            for other in _INDEX_EXPRESSIONS:
+                if other != mode:
+                    conn.execute(sqlalchemy.text(
+                        f'DROP INDEX CONCURRENTLY IF EXISTS "{_index_name(table_name, other)}"'
+                    ))
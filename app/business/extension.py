@@ -1,6 +1,10 @@
 
 
 import abc
+import concurrent.futures
+import logging
+import time
+import types
 import typing
 import fastapi
 import sqlmodel
@@ -8,6 +12,10 @@ import importlib
 from typing import Optional as Opt
 from app.engine import SessionLocal
 from app.schemas.extension import ExtensionModel, ExtensionID
+from app.utils.profile import STARTUP_PROFILE
+
+
+logger = logging.getLogger(__name__)
 
 
 ConfigTV = typing.TypeVar("ConfigTV", bound=sqlmodel.SQLModel)
@@ -75,23 +83,51 @@ class ExtensionManager:
         
     @classmethod
     def start_all(cls, app: fastapi.FastAPI):
-        """Start enabled entensions."""
-        for extension in cls.get_extensions():
-            extension_module = importlib.import_module(f"extensions.{extension.id}")
+        """Start enabled entensions.
+
+        Extensions are imported concurrently, as importing their
+        dependencies takes most of the startup time.
+        """
+        extensions = cls.get_extensions()
+        with concurrent.futures.ThreadPoolExecutor() as executor:
+            imports = {
+                extension.id: executor.submit(cls._import_extension, extension.id)
+                for extension in extensions
+            }
+
+        for extension in extensions:
+            try:
+                extension_module = imports[extension.id].result()
+            except Exception:
+                logger.exception("Failed to import extension %s", extension.id)
+                continue
             extension_class = typing.cast(type[ExtensionBase], extension_module.Extension)
             cls.extention_classes.append(extension_class)
 
             # Start the extension
-            extension_router = fastapi.APIRouter(prefix=f"/{extension.id}")
-            extension_class.on_start(
-                router=extension_router,
-                config=extension.config or {},
-                state=extension.state or {}
-            )
-            app.include_router(extension_router, tags=["extension", extension.id])
+            with STARTUP_PROFILE.span(f"start extension {extension.id}"):
+                started_at = time.perf_counter()
+                extension_router = fastapi.APIRouter(prefix=f"/{extension.id}")
+                extension_class.on_start(
+                    router=extension_router,
+                    config=extension.config or {},
+                    state=extension.state or {}
+                )
+                app.include_router(extension_router, tags=["extension", extension.id])
+                logger.info(
+                    "Started extension %s in %.3fs",
+                    extension.id, time.perf_counter() - started_at
+                )
 
-            # Register resolver
-            extension_class._register_resolver()
+    @staticmethod
+    def _import_extension(ext_id: ExtensionID) -> types.ModuleType:
+        with STARTUP_PROFILE.span(f"import extension {ext_id}"):
+            started_at = time.perf_counter()
+            module = importlib.import_module(f"extensions.{ext_id}")
+            logger.info(
+                "Imported extension %s in %.3fs", ext_id, time.perf_counter() - started_at
+            )
+        return module
 
     @classmethod
     async def close_all(cls):
@@ -0,0 +1,199 @@
+__all__ = [
+    "OrganizeManager",
+]
+
+import asyncio
+import datetime
+import logging
+import os
+import socket
+import typing
+import sqlalchemy
+import sqlalchemy.orm
+from typing import Optional as Opt
+from app.engine import SessionLocal
+from app.schemas.block import BlockID
+from app.schemas.organize import OrganizeJobKind, OrganizeJobModel, OrganizeJobStatus
+from app.schemas.source import SourceID
+from app.utils.breaker import CircuitOpen
+from app.utils.metrics import Counter
+
+
+# configs
+POLL_INTERVAL = float(os.getenv('ORGANIZE_POLL_INTERVAL', '2'))
+BATCH_SIZE = int(os.getenv('ORGANIZE_BATCH_SIZE', '8'))
+MAX_ATTEMPTS = int(os.getenv('ORGANIZE_MAX_ATTEMPTS', '3'))
+CLAIM_TIMEOUT = float(os.getenv('ORGANIZE_CLAIM_TIMEOUT', '600'))
+"""Seconds after which a running job is seen as abandoned by a dead worker.
+"""
+
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+logger = logging.getLogger(__name__)
+
+ORGANIZE_JOBS = Counter(
+    "inkcre_organize_jobs_total", "Finished organize jobs by kind and status."
+)
+
+
+class OrganizeManager:
+    """Queue of organize work shared by all workers.
+
+    Jobs are rows of `organize_jobs`. Every worker polls and claims
+    pending jobs with `SELECT ... FOR UPDATE SKIP LOCKED`, so a job
+    is run by only one of them.
+    """
+
+    _worker: Opt[asyncio.Task] = None
+
+    @classmethod
+    def enqueue(
+        cls,
+        db: sqlalchemy.orm.Session,
+        kind: OrganizeJobKind,
+        block_ids: typing.Iterable[BlockID],
+        source_id: Opt[SourceID] = None,
+        delay: float = 0,
+    ):
+        """Add organize jobs of blocks in one statement.
+
+        Jobs are added in the given session, so they are committed
+        together with the blocks.
+
+        :param delay: Seconds to wait before the jobs can be claimed.
+        """
+        rows = [
+            {"kind": kind, "block_id": block_id, "source_id": source_id, "attempts": 0}
+            for block_id in block_ids
+        ]
+        if not rows:
+            return
+        db.execute(
+            sqlalchemy.insert(OrganizeJobModel).values(
+                run_after=sqlalchemy.func.now() + datetime.timedelta(seconds=delay)
+            ),
+            rows,
+        )
+
+    @classmethod
+    def claim(cls, num: int) -> tuple[OrganizeJobModel, ...]:
+        """Claim at most `num` claimable jobs for this worker.
+        """
+        claimable = (
+            sqlalchemy.select(OrganizeJobModel.id)
+            .where(OrganizeJobModel.run_after <= sqlalchemy.func.now())
+            .where(sqlalchemy.or_(
+                OrganizeJobModel.status == "pending",
+                sqlalchemy.and_(
+                    OrganizeJobModel.status == "running",
+                    OrganizeJobModel.claimed_at < (
+                        sqlalchemy.func.now() - datetime.timedelta(seconds=CLAIM_TIMEOUT)
+                    ),
+                ),
+            ))
+            .order_by(OrganizeJobModel.id)
+            .limit(num)
+            .with_for_update(skip_locked=True)
+        )
+        with SessionLocal() as db:
+            rows = db.execute(
+                sqlalchemy.update(OrganizeJobModel)
+                .where(OrganizeJobModel.id.in_(claimable))
+                .values(
+                    status="running",
+                    claimed_by=WORKER_ID,
+                    claimed_at=sqlalchemy.func.now(),
+                    attempts=OrganizeJobModel.attempts + 1,
+                )
+                .returning(*OrganizeJobModel.__table__.columns)
+            ).all()
+            db.commit()
+
+        return tuple(OrganizeJobModel.model_validate(dict(row._mapping)) for row in rows)
+
+    @classmethod
+    def _finish(
+        cls,
+        job: OrganizeJobModel,
+        status: OrganizeJobStatus | typing.Literal["done"],
+        error: Opt[str] = None,
+        retry_in: float = 0,
+        attempted: bool = True,
+    ):
+        """Delete the job if done, otherwise update its status.
+
+        :param attempted: False to give back the attempt counted by claiming.
+        """
+        with SessionLocal() as db:
+            if status == "done":
+                db.execute(
+                    sqlalchemy.delete(OrganizeJobModel).where(OrganizeJobModel.id == job.id)
+                )
+            else:
+                db.execute(
+                    sqlalchemy.update(OrganizeJobModel)
+                    .where(OrganizeJobModel.id == job.id)
+                    .values(
+                        status=status, error=error, claimed_by=None,
+                        run_after=sqlalchemy.func.now() + datetime.timedelta(seconds=retry_in),
+                        **({} if attempted else {"attempts": OrganizeJobModel.attempts - 1}),
+                    )
+                )
+            db.commit()
+        ORGANIZE_JOBS.inc(kind=job.kind, status=status)
+
+    @classmethod
+    async def _execute(cls, job: OrganizeJobModel):
+        if job.kind == "source":
+            from app.business.source import SourceManager
+            await SourceManager.organize(typing.cast(SourceID, job.source_id), job.block_id)
+        else:
+            from app.business.block import _get_block, organize_block
+            block = _get_block(job.block_id)
+            if block is None:
+                return
+            await organize_block(block)
+
+    @classmethod
+    async def _run(cls, job: OrganizeJobModel):
+        try:
+            await cls._execute(job)
+        except CircuitOpen as e:
+            # parked until the provider may be back, not a failure of the job
+            logger.warning("Organize job %s parked for %.0fs, %s", job.id, e.retry_in, e.detail)
+            cls._finish(job, "pending", repr(e), retry_in=e.retry_in, attempted=False)
+        except Exception as e:
+            logger.exception("Organize job %s failed", job.id)
+            if job.attempts < MAX_ATTEMPTS:
+                cls._finish(job, "pending", repr(e), retry_in=30 * 2 ** job.attempts)
+            else:
+                cls._finish(job, "failed", repr(e))
+        else:
+            cls._finish(job, "done")
+
+    @classmethod
+    async def _work(cls):
+        while True:
+            try:
+                jobs = await asyncio.to_thread(cls.claim, BATCH_SIZE)
+            except Exception:
+                logger.exception("Failed to claim organize jobs")
+                jobs = ()
+
+            if not jobs:
+                await asyncio.sleep(POLL_INTERVAL)
+                continue
+            await asyncio.gather(*(cls._run(job) for job in jobs))
+
+    @classmethod
+    def start_worker(cls):
+        """Start claiming and running jobs in this worker.
+        """
+        if cls._worker is None:
+            cls._worker = asyncio.create_task(cls._work())
+
+    @classmethod
+    async def stop_worker(cls):
+        if cls._worker is not None:
+            cls._worker.cancel()
+            cls._worker = None
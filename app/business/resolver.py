@@ -1,25 +1,201 @@
 import abc
 import asyncio
 import base64
+import binascii
+import concurrent.futures
+import enum
+import functools
+import hashlib
+import logging
+import os
+import time
 import typing
 import json
+import urllib.parse
+from typing import Optional as Opt
 # import requests
 import aiohttp
-import tencentcloud.common.credential
-import tencentcloud.lke.v20231130.lke_client
-import tencentcloud.lke.v20231130.models
+import sqlalchemy
+import sqlalchemy.dialects.postgresql
+import sqlalchemy.orm
+import sqlmodel
 
 from ..engine import SessionLocal
-from ..schemas.block import ResolverType, BlockModel
+from ..schemas.block import BlockID, ResolverType, BlockModel
+from ..schemas.image import Img2TextModel, phash_to_int
 from ..schemas.relation import RelationModel
 from ..schemas.storage import StorageType
+from ..utils import tracing
 from ..utils.base import AIOHTTP_CONNECTOR_GETTER
+from ..utils.breaker import CircuitBreaker
+from ..utils.image import PreprocessedImage, preprocess_image
 
+# configs
+CPU_WORKERS = int(os.getenv('RESOLVER_CPU_WORKERS', '0')) or None
+"""Size of the process pool for CPU-bound resolvers, defaults to CPU count.
+"""
+IMAGE_MAX_EDGE = int(os.getenv('IMAGE_MAX_EDGE', '1024'))
+"""Images are downscaled to this length of the longer edge before img2text.
+"""
+IMAGE_JPEG_QUALITY = int(os.getenv('IMAGE_JPEG_QUALITY', '85'))
+IMAGE_PHASH_MAX_DISTANCE = int(os.getenv('IMAGE_PHASH_MAX_DISTANCE', '4'))
+"""Max different bits of perceptual hashes of two images seen as the same.
+"""
 
-TENCENT_LKE_CLIENT = tencentcloud.lke.v20231130.lke_client.LkeClient(
-    tencentcloud.common.credential.EnvironmentVariableCredential().get_credential(),
-    "ap-guangzhou",
-)
+LKE_ENDPOINT = os.getenv('LKE_ENDPOINT', '')
+"""Base URL of the LKE API, e.g. `http://127.0.0.1:8000`, defaults to that of the SDK.
+"""
+LKE_WORKFLOW_TIMEOUT = float(os.getenv('LKE_WORKFLOW_TIMEOUT', '300'))
+"""Seconds a workflow run is polled before it is seen as failed.
+"""
+
+IMG2TEXT_WORKFLOW_ID = "1948959057036216384"
+
+logger = logging.getLogger(__name__)
+
+LKE_BREAKER = CircuitBreaker("lke")
+
+if typing.TYPE_CHECKING:
+    import tencentcloud.lke.v20231130.lke_client
+
+
+@functools.cache
+def get_lke_client() -> "tencentcloud.lke.v20231130.lke_client.LkeClient":
+    """Create the client on first use, so importing needs no credentials.
+    """
+    import tencentcloud.common.credential
+    import tencentcloud.common.profile.client_profile
+    import tencentcloud.common.profile.http_profile
+    import tencentcloud.lke.v20231130.lke_client
+
+    profile = None
+    if LKE_ENDPOINT:
+        url = urllib.parse.urlsplit(LKE_ENDPOINT)
+        profile = tencentcloud.common.profile.client_profile.ClientProfile(
+            httpProfile=tencentcloud.common.profile.http_profile.HttpProfile(
+                protocol=url.scheme, endpoint=url.netloc
+            )
+        )
+    return tencentcloud.lke.v20231130.lke_client.LkeClient(
+        tencentcloud.common.credential.EnvironmentVariableCredential().get_credential(),
+        "ap-guangzhou",
+        profile,
+    )
+
+
+class TempBlockID(int):
+    """Index of a block in a `SubGraph`, before it gets its ID.
+    """
+
+
+BlockRef: typing.TypeAlias = BlockID | TempBlockID
+
+
+class SubGraph:
+    """Blocks and relations a resolver extracted, to be inserted at once.
+
+    Relations refer to blocks of the subgraph by `TempBlockID`,
+    and to existing blocks by `BlockID`.
+    """
+
+    def __init__(self):
+        self.blocks: list[BlockModel] = []
+        self.relations: list[tuple[BlockRef, BlockRef, str]] = []
+
+    def add_block(self, block: BlockModel) -> TempBlockID:
+        self.blocks.append(block)
+        return TempBlockID(len(self.blocks) - 1)
+
+    def add_relation(self, from_: BlockRef, to_: BlockRef, content: str):
+        self.relations.append((from_, to_, content))
+
+    def save(self, db: sqlalchemy.orm.Session) -> tuple[RelationModel, ...]:
+        """Insert all blocks in a statement, then all relations in another.
+
+        IDs of inserted blocks are set to blocks of the subgraph.
+
+        :returns: Inserted relations.
+        """
+        if self.blocks:
+            block_ids = db.execute(
+                sqlalchemy.insert(BlockModel).returning(
+                    BlockModel.id, sort_by_parameter_order=True
+                ),
+                [block.model_dump(exclude={"id"}) for block in self.blocks],
+            ).scalars().all()
+            for block, block_id in zip(self.blocks, block_ids):
+                block.id = block_id
+
+        if not self.relations:
+            return ()
+
+        def resolve(ref: BlockRef) -> BlockID:
+            if isinstance(ref, TempBlockID):
+                return typing.cast(BlockID, self.blocks[ref].id)
+            return ref
+
+        relations = tuple(
+            RelationModel(from_=resolve(from_), to_=resolve(to_), content=content)
+            for from_, to_, content in self.relations
+        )
+        relation_ids = db.execute(
+            sqlalchemy.insert(RelationModel).returning(
+                RelationModel.id, sort_by_parameter_order=True
+            ),
+            [relation.model_dump(exclude={"id"}) for relation in relations],
+        ).scalars().all()
+        for relation, relation_id in zip(relations, relation_ids):
+            relation.id = relation_id
+        return relations
+
+
+class ResolverCost(enum.Enum):
+    """What limits throughput of a resolver.
+    """
+    CPU = "cpu"
+    """Run in a process pool, not to block the event loop.
+    """
+    IO = "io"
+    """Run on the event loop.
+    """
+    REMOTE = "remote"
+    """Run on the event loop, rate-limited not to exceed quota of the remote service.
+    """
+
+
+class ResolverLimiter:
+    """Limit concurrent runs, and starts per second if rate given.
+    """
+
+    def __init__(self, concurrency: int, rate: Opt[float] = None):
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._interval = 1 / rate if rate else 0
+        self._next_start_at = 0.0
+
+    async def __aenter__(self):
+        await self._semaphore.acquire()
+        if self._interval:
+            now = asyncio.get_running_loop().time()
+            start_at = max(now, self._next_start_at)
+            self._next_start_at = start_at + self._interval
+            if start_at > now:
+                await asyncio.sleep(start_at - now)
+
+    async def __aexit__(self, *exc_info):
+        self._semaphore.release()
+
+
+@functools.cache
+def _get_process_pool() -> concurrent.futures.ProcessPoolExecutor:
+    return concurrent.futures.ProcessPoolExecutor(max_workers=CPU_WORKERS)
+
+
+def _extract_in_process(
+    resolver_cls: type["Resolver"], block: dict
+) -> "SubGraph":
+    return asyncio.run(
+        resolver_cls(BlockModel.model_validate(block)).extract_blocks_and_relations()
+    )
 
 
 class Resolver(abc.ABC):
@@ -27,10 +203,18 @@ class Resolver(abc.ABC):
     __rsotype__: str
     """Resolver type
     """
+    __rsocost__: ResolverCost = ResolverCost.IO
+    __rsoconcurrency__: int = 16
+    """Max concurrent extractions of this resolver.
+    """
+    __rsorate__: Opt[float] = None
+    """Max extractions started per second, only for remote cost.
+    """
 
     TypeToClass: dict[ResolverType, typing.Type["Resolver"]] = {}
     """Map ResolverType to Resolver class
     """
+    _limiters: dict[ResolverType, ResolverLimiter] = {}
 
     @classmethod
     def register_resolver(
@@ -39,13 +223,45 @@ class Resolver(abc.ABC):
         cls.TypeToClass[resolver_cls.__rsotype__] = resolver_cls
 
     @classmethod
-    def new(cls, block: BlockModel) -> typing.Self:
-        if block.resolver == ResolverType.IMAGE:
-            return ImageResolver(block)
-        elif block.resolver == ResolverType.TEXT:
-            return TextResolver(block)
-        else:
-            raise NotImplementedError
+    def get_class(cls, resolver_type: ResolverType) -> typing.Type["Resolver"]:
+        resolver_cls = cls.TypeToClass.get(resolver_type)
+        if resolver_cls is None:
+            raise NotImplementedError(f"No resolver registered for {resolver_type}")
+        return resolver_cls
+
+    @classmethod
+    def new(cls, block: BlockModel) -> "Resolver":
+        return cls.get_class(block.resolver)(block)
+
+    @classmethod
+    async def extract(cls, block: BlockModel) -> "SubGraph":
+        """Extract blocks and relations from the block in the way its resolver costs.
+
+        Each resolver has its own limiter, so a slow remote resolver
+        never holds back others.
+        """
+        resolver_cls = cls.get_class(block.resolver)
+        limiter = cls._limiters.get(resolver_cls.__rsotype__)
+        if limiter is None:
+            limiter = cls._limiters[resolver_cls.__rsotype__] = ResolverLimiter(
+                resolver_cls.__rsoconcurrency__,
+                resolver_cls.__rsorate__ if resolver_cls.__rsocost__ == ResolverCost.REMOTE else None,
+            )
+
+        with tracing.span("resolver.extract", resolver=resolver_cls.__rsotype__):
+            async with limiter:
+                if resolver_cls.__rsocost__ == ResolverCost.CPU:
+                    return await asyncio.get_running_loop().run_in_executor(
+                        _get_process_pool(), _extract_in_process,
+                        resolver_cls, block.model_dump(),
+                    )
+                return await resolver_cls(block).extract_blocks_and_relations()
+
+    @staticmethod
+    def close_pools():
+        if _get_process_pool.cache_info().currsize:
+            _get_process_pool().shutdown(cancel_futures=True)
+            _get_process_pool.cache_clear()
 
     # TODO 拿整个 block，不只是 content，要不要用 storage 来获取真实数据也由 resolver 来判断
     def __init__(self, block: BlockModel):
@@ -55,14 +271,11 @@ class Resolver(abc.ABC):
         """
         self._block = block
 
-    B_or_R_TV = typing.TypeVar('B_or_R_TV', BlockModel, RelationModel)
     @abc.abstractmethod
-    async def extract_blocks_and_relations(self) -> \
-            typing.Callable[[], typing.Generator[B_or_R_TV, B_or_R_TV, None]]:
+    async def extract_blocks_and_relations(self) -> SubGraph:
         """Break down the block into smaller blocks and relations.
 
-        :param block_id: The block the content to resolve belongs to.
-        :return:
+        Relations to the block being resolved refer to it by its ID.
         """
         ...
 
@@ -74,10 +287,13 @@ class Resolver(abc.ABC):
 
 class TextResolver(Resolver):
 
-    async def extract_blocks_and_relations(self) -> \
-            typing.Callable[[], typing.Generator[Resolver.B_or_R_TV, Resolver.B_or_R_TV, None]]:
+    __rsotype__ = "text"
 
-        return lambda : None
+    async def extract_blocks_and_relations(self) -> SubGraph:
+        return SubGraph()
+
+    async def to_text(self) -> str:
+        return self._block.content
 
 
 class Detail(typing.TypedDict):
@@ -91,11 +307,16 @@ class Img2TextResult(typing.TypedDict):
 class ImageResolver(Resolver):
 
     __rsotype__ = "image"
+    __rsocost__ = ResolverCost.REMOTE
+    __rsoconcurrency__ = 4
+    __rsorate__ = 1
 
-    async def extract_blocks_and_relations(self) -> \
-            typing.Callable[[], typing.Generator[Resolver.B_or_R_TV, Resolver.B_or_R_TV, None]]:
-        img2text_result = await self.__img2text()
-        return lambda: self.__interactively_extract_BaR(img2text_result)
+    _img2text_flights: typing.ClassVar[dict[tuple[str, str], asyncio.Future[Img2TextResult]]] = {}
+    """Running img2text by image digest and workflow id.
+    """
+
+    async def extract_blocks_and_relations(self) -> SubGraph:
+        return self.__extract_subgraph(await self.__img2text())
 
     def __get_custom_variables(self) -> dict:
         if self._block.storage is None:
@@ -115,93 +336,231 @@ class ImageResolver(Resolver):
         - summary of image
         - key infos image provided
           - actions that needs the info
+
+        Results are stored by image digest and workflow id, concurrent
+        calls for the same image share one workflow run.
         """
-        return Img2TextResult(**(await self.__run_lke_workflow(
-            "1948959057036216384",
-            **self.__get_custom_variables()
+        digest, image = await self.__load()
+        key = (digest, IMG2TEXT_WORKFLOW_ID)
+        flight = self._img2text_flights.get(key)
+        if flight is None:
+            flight = asyncio.ensure_future(self.__img2text_once(digest, image))
+            self._img2text_flights[key] = flight
+            flight.add_done_callback(lambda _: self._img2text_flights.pop(key, None))
+        # one caller being cancelled must not cancel the run shared by others
+        return await asyncio.shield(flight)
+
+    async def __img2text_once(self, digest: str, image: Opt[PreprocessedImage]) -> Img2TextResult:
+        phash = phash_to_int(image.phash) if image is not None else None
+        stored = await asyncio.to_thread(self.__find_img2text_result, digest, phash)
+        if stored is not None:
+            return stored
+
+        if image is None:
+            variables = self.__get_custom_variables()
+        else:
+            variables = {"ImgSource": base64.b64encode(image.data).decode("utf-8")}
+        result = Img2TextResult(**(await self.__run_lke_workflow(
+            IMG2TEXT_WORKFLOW_ID,
+            **variables
         ))["result"])
 
+        await asyncio.to_thread(self.__save_img2text_result, digest, phash, result)
+        return result
+
+    async def __load(self) -> tuple[str, Opt[PreprocessedImage]]:
+        """Get the digest of the image, downscale and hash it in the process pool.
+
+        The image is None if it can not be fetched or decoded,
+        then it goes to the workflow as is.
+        """
+        try:
+            content = await self._block.get_real_content()
+            if isinstance(content, str):
+                content = self.__decode_inline_image(content)
+        except Exception:
+            logger.warning("Failed to fetch image of block %s", self._block.id, exc_info=True)
+            return hashlib.sha256(self._block.content.encode("utf-8")).hexdigest(), None
+
+        digest = hashlib.sha256(content).hexdigest()
+        try:
+            return digest, await asyncio.get_running_loop().run_in_executor(
+                _get_process_pool(), preprocess_image,
+                content, IMAGE_MAX_EDGE, IMAGE_JPEG_QUALITY,
+            )
+        except Exception:
+            logger.warning("Failed to preprocess image of block %s", self._block.id, exc_info=True)
+            return digest, None
+
+    @staticmethod
+    def __decode_inline_image(content: str) -> bytes:
+        """Get bytes of an image stored in the block, as data URL, base64 or raw.
+        """
+        if content.startswith("data:"):
+            content = content.split(",", 1)[1]
+        try:
+            return base64.b64decode(content, validate=True)
+        except binascii.Error:
+            return content.encode("utf-8")
+
+    @classmethod
+    def __find_img2text_result(cls, digest: str, phash: Opt[int]) -> Opt[Img2TextResult]:
+        """Find the stored result of the same image, or of an image looks the same.
+
+        A result found by phash is stored for the digest as well.
+        """
+        with SessionLocal() as db_session:
+            result = db_session.exec(
+                sqlmodel.select(Img2TextModel.result)
+                .where(Img2TextModel.digest == digest)
+                .where(Img2TextModel.workflow_id == IMG2TEXT_WORKFLOW_ID)
+            ).first()
+            if result is not None or phash is None:
+                return Img2TextResult(**result) if result is not None else None
+
+            similar = (
+                sqlmodel.select(Img2TextModel.result)
+                .where(Img2TextModel.workflow_id == IMG2TEXT_WORKFLOW_ID)
+                .limit(1)
+            )
+            result = db_session.exec(similar.where(Img2TextModel.phash == phash)).first()
+            if result is None and IMAGE_PHASH_MAX_DISTANCE:
+                distance = sqlalchemy.func.bit_count(sqlalchemy.cast(
+                    Img2TextModel.phash.op("#")(phash),
+                    sqlalchemy.dialects.postgresql.BIT(64),
+                ))
+                result = db_session.exec(
+                    similar.where(distance <= IMAGE_PHASH_MAX_DISTANCE).order_by(distance)
+                ).first()
+        if result is None:
+            return None
+
+        cls.__save_img2text_result(digest, phash, result)
+        return Img2TextResult(**result)
+
+    @staticmethod
+    def __save_img2text_result(digest: str, phash: Opt[int], result: Img2TextResult):
+        with SessionLocal(shared=False) as db_session:
+            # another worker may have stored the same image meanwhile
+            db_session.execute(
+                sqlalchemy.dialects.postgresql.insert(Img2TextModel)
+                .values(
+                    digest=digest, workflow_id=IMG2TEXT_WORKFLOW_ID,
+                    phash=phash, result=dict(result),
+                    created_at=sqlalchemy.func.now(),
+                )
+                .on_conflict_do_nothing(index_elements=("digest", "workflow_id"))
+            )
+            db_session.commit()
+
+    @tracing.traced("lke.workflow", "workflow")
     async def __run_lke_workflow(self, workflow_id: str, **kwargs) -> dict:
-        req = tencentcloud.lke.v20231130.models.CreateWorkflowRunRequest()
-        req.AppBizId = workflow_id
-        req.CustomVariables = tuple(
-            {"Name": k, "Value": v}
-            for k, v in kwargs.items()
-        )
-        workflow_run_id = TENCENT_LKE_CLIENT.CreateWorkflowRun(req).WorkflowRunId
-
-        workflow_finish = False
-        req = tencentcloud.lke.v20231130.models.DescribeWorkflowRunRequest()
-        req.WorkflowRunId = workflow_run_id
-        resp = None
-        while not workflow_finish:
-            resp = TENCENT_LKE_CLIENT.DescribeWorkflowRun(req)
-            if resp.WorkflowRun.State in (2, 3, 4):
-                workflow_finish = True
-            await asyncio.sleep(1)
-
-        for node in resp.NodeRuns:
-            if node.NodeType == 16:
-                end_node_run_id = node.NodeRunId
-                req = tencentcloud.lke.v20231130.models.DescribeNodeRunRequest()
-                req.NodeRunId = end_node_run_id
-                resp = TENCENT_LKE_CLIENT.DescribeNodeRun(req)
-                if not resp.NodeRun.OutputRef:
-                    return json.loads(resp.NodeRun.Output)
-                else:
-                    # TODO extract to download()
-                    async with aiohttp.ClientSession(connector=AIOHTTP_CONNECTOR_GETTER()) as session:
-                        async with session.get(resp.NodeRun.OutputRef) as response:
-                            response.raise_for_status()
-                            raw_res = await response.json()
-                            return raw_res
-                # else:
-                    # return requests.get(url=resp.NodeRun.OutputRef).json()
-
-        raise RuntimeError("Workflow did not complete successfully.")
-
-    def __interactively_extract_BaR(self, img2text_result: Img2TextResult) -> \
-            typing.Generator[Resolver.B_or_R_TV, Resolver.B_or_R_TV, None]:
+        import tencentcloud.lke.v20231130.models
+
+        with LKE_BREAKER.call():
+            req = tencentcloud.lke.v20231130.models.CreateWorkflowRunRequest()
+            req.AppBizId = workflow_id
+            req.CustomVariables = tuple(
+                {"Name": k, "Value": v}
+                for k, v in kwargs.items()
+            )
+            # the SDK blocks, keep it off the event loop
+            workflow_run_id = (await asyncio.to_thread(get_lke_client().CreateWorkflowRun, req)).WorkflowRunId
+
+            req = tencentcloud.lke.v20231130.models.DescribeWorkflowRunRequest()
+            req.WorkflowRunId = workflow_run_id
+            timeout_at = time.monotonic() + LKE_WORKFLOW_TIMEOUT
+            while True:
+                resp = await asyncio.to_thread(get_lke_client().DescribeWorkflowRun, req)
+                if resp.WorkflowRun.State in (2, 3, 4):
+                    break
+                if time.monotonic() >= timeout_at:
+                    raise TimeoutError(
+                        f"Workflow run {workflow_run_id} did not finish in {LKE_WORKFLOW_TIMEOUT}s."
+                    )
+                await asyncio.sleep(1)
+
+            for node in resp.NodeRuns:
+                if node.NodeType == 16:
+                    end_node_run_id = node.NodeRunId
+                    req = tencentcloud.lke.v20231130.models.DescribeNodeRunRequest()
+                    req.NodeRunId = end_node_run_id
+                    resp = await asyncio.to_thread(get_lke_client().DescribeNodeRun, req)
+                    if not resp.NodeRun.OutputRef:
+                        return json.loads(resp.NodeRun.Output)
+                    else:
+                        # TODO extract to download()
+                        async with aiohttp.ClientSession(
+                            connector=AIOHTTP_CONNECTOR_GETTER(), trace_configs=tracing.AIOHTTP_TRACE_CONFIGS
+                        ) as session:
+                            async with session.get(resp.NodeRun.OutputRef) as response:
+                                response.raise_for_status()
+                                raw_res = await response.json()
+                                return raw_res
+                    # else:
+                        # return requests.get(url=resp.NodeRun.OutputRef).json()
+
+            raise RuntimeError("Workflow did not complete successfully.")
+
+    def __extract_subgraph(self, img2text_result: Img2TextResult) -> SubGraph:
+        block_id = typing.cast(BlockID, self._block.id)
+        subgraph = SubGraph()
+
         # alt:text
-        alt_text_block = yield BlockModel(resolver=ResolverType.TEXT, content=img2text_result["summary"])
-        yield RelationModel(from_=self._block.id, to_=alt_text_block.id, content="alt:text")
+        alt_text_block = subgraph.add_block(
+            BlockModel(resolver=TextResolver.__rsotype__, content=img2text_result["summary"])
+        )
+        subgraph.add_relation(block_id, alt_text_block, "alt:text")
 
         # info (key information)
         for item in img2text_result["details"]:
-            info_block = yield BlockModel(resolver=ResolverType.TEXT, content=item["content"])
-            yield  RelationModel(from_=self._block.id, to_=info_block.id, content="has content")
-            info_type_block = yield BlockModel(resolver=ResolverType.TEXT, content=item["type"])
-            yield RelationModel(from_=info_block.id, to_=info_type_block.id, content="is")
+            info_block = subgraph.add_block(
+                BlockModel(resolver=TextResolver.__rsotype__, content=item["content"])
+            )
+            subgraph.add_relation(block_id, info_block, "has content")
+            info_type_block = subgraph.add_block(
+                BlockModel(resolver=TextResolver.__rsotype__, content=item["type"])
+            )
+            subgraph.add_relation(info_block, info_type_block, "is")
             for action in item["actions"]:
-                action_block = yield BlockModel(resolver=ResolverType.TEXT, content=action)
-                yield RelationModel(from_=action_block.id, to_=info_type_block.id, content="needs")
+                action_block = subgraph.add_block(
+                    BlockModel(resolver=TextResolver.__rsotype__, content=action)
+                )
+                subgraph.add_relation(action_block, info_type_block, "needs")
+
+        return subgraph
 
     async def to_text(self):
         """find relation "alt:text" and return the to block content
         """
         with SessionLocal() as db_session:
-            alt_text_relation = db_session.query(RelationTable).filter(
-                RelationTable.content == "alt:text",
-                RelationTable.from_ == self._block.id
-            ).one_or_none()
-            if alt_text_relation:
-                alt_text_to_block = db_session.query(BlockTable).filter(
-                    BlockTable.id == alt_text_relation.to_
-                ).one()
-                return alt_text_to_block.content
-
-            img2text_result = await self.__img2text()
-            alt_text_block_table = BlockModel(
-                resolver=ResolverType.TEXT, content=img2text_result["summary"]
-            ).to_table()
-            db_session.add(alt_text_block_table)
-            db_session.flush()
-            alt_text_relation_table = RelationModel(
-                content="alt:text", to_=alt_text_block_table.id, from_=self._block.id
-            ).to_table()
-            db_session.add(alt_text_relation_table)
+            alt_text = db_session.exec(
+                sqlmodel.select(BlockModel.content)
+                .join(RelationModel, RelationModel.to_ == BlockModel.id)
+                .where(
+                    RelationModel.content == "alt:text",
+                    RelationModel.from_ == self._block.id,
+                )
+            ).first()
+        if alt_text is not None:
+            return alt_text
 
+        img2text_result = await self.__img2text()
+        subgraph = SubGraph()
+        subgraph.add_relation(
+            typing.cast(BlockID, self._block.id),
+            subgraph.add_block(BlockModel(
+                resolver=TextResolver.__rsotype__, content=img2text_result["summary"]
+            )),
+            "alt:text",
+        )
+        # the request may be reading from a replica
+        with SessionLocal(shared=False) as db_session:
+            subgraph.save(db_session)
             db_session.commit()
 
-            return img2text_result["summary"]
+        return img2text_result["summary"]
+
 
+Resolver.register_resolver(TextResolver)
+Resolver.register_resolver(ImageResolver)
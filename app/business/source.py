@@ -1,18 +1,60 @@
 import abc
 import asyncio
 import datetime
+import hashlib
 import importlib
+import logging
+import os
+import secrets
+import time
 import fastapi
-from numpy import tri
+import pydantic
 import sqlmodel
 import typing
 from typing import Optional as Opt
 from app.engine import SessionLocal
+from app.business.admin import verify_admin_token
+from app.business.organize import OrganizeManager
 from app.schemas.block import BlockID, BlockModel
 from app.schemas.relation import RelationModel
-from app.schemas.source import SourceModel, SourceID
-from app.task import scheduler
+from app.schemas.source import (
+    CollectAt, RunStatus, RunTrigger, SourceModel, SourceID, SourceRunModel
+)
+from app.task import async_distributed_lock, run_as_leader, scheduler
+from app.utils.breaker import CircuitOpen
 from app.utils.datetime_ import get_datetime
+from app.utils.metrics import Counter, Histogram
+
+
+# configs
+INGEST_QUEUE_SIZE = int(os.getenv('SOURCE_INGEST_QUEUE_SIZE', '1024'))
+INGEST_RETRY_INTERVAL = float(os.getenv('SOURCE_INGEST_RETRY_INTERVAL', '5'))
+"""Seconds before a push is retried when another worker is ingesting to its source.
+"""
+
+logger = logging.getLogger(__name__)
+
+SOURCE_RUNS = Counter(
+    "inkcre_source_runs_total", "Runs of sources by trigger and status."
+)
+SOURCE_RUN_DURATION = Histogram(
+    "inkcre_source_run_duration_seconds", "Wall time of runs of sources.",
+    buckets=(0.5, 1, 5, 10, 30, 60, 120, 300, 600, 1800),
+)
+SOURCE_RUN_STAGE_SECONDS = Counter(
+    "inkcre_source_run_stage_seconds_total", "Time spent by runs of sources in each stage."
+)
+SOURCE_COLLECTED = Counter(
+    "inkcre_source_collected_total", "Blocks collected from sources."
+)
+SOURCE_API_CALLS = Counter(
+    "inkcre_source_api_calls_total", "Calls made to APIs of sources during runs."
+)
+
+
+class SourceRunInFlight(Exception):
+    """Another run of the source is in flight, in this or another worker.
+    """
 
 
 ConfigTV = typing.TypeVar("ConfigTV", bound=dict)
@@ -21,36 +63,95 @@ class SourceBase(abc.ABC, typing.Generic[ConfigTV]):
 
     def __init__(self, _id: SourceID) -> None:
         self._id = _id
+        self._run = SourceRunModel(source_id=_id, started_at=get_datetime())
+        """Record of the current run, to fill stats in.
+        """
+
+    async def start(self) -> None:
+        """Called by the leader of workers once it leads, not by every worker.
 
-    async def collect(self, full: bool = False):
+        Override to set up passive gathering, e.g. register a webhook
+        pointing to `/source/{source_id}/ingest` at the remote service.
+        """
+
+    async def collect(
+        self, full: bool = False, run: Opt[SourceRunModel] = None
+    ) -> tuple[BlockModel, ...]:
         """Collect new data from the source.
 
         :param full: 
             If True, collect all data, otherwise only new data.
             If True, collected data blocks will be inserted in reverse order.
+        :param run: Record of this run to fill stats in.
 
         The order of collected blocks inserted into the database is the same
         as the order of blocks yielded by the generator.
         """
+        self._run = run or SourceRunModel(source_id=self._id, started_at=get_datetime())
+
+        fetch_started_at = time.perf_counter()
         collected: list[BlockModel] = []
         generator = self._collect(full=full)
         async for item in generator:  # type: ignore[assignment] pyright bug
             collected.append(item)
-        
+        self._run.fetch_seconds = time.perf_counter() - fetch_started_at
+
+        return self._save(reversed(collected) if full else collected)
+
+    async def ingest(
+        self, payload: typing.Any, run: Opt[SourceRunModel] = None
+    ) -> tuple[BlockModel, ...]:
+        """Turn data pushed to the source into blocks and save them.
+
+        :param payload: Decoded JSON body of the push.
+        :param run: Record of this run to fill stats in.
+        """
+        self._run = run or SourceRunModel(source_id=self._id, started_at=get_datetime())
+
+        fetch_started_at = time.perf_counter()
+        received: list[BlockModel] = []
+        async for item in self._receive(payload):  # type: ignore[assignment]
+            received.append(item)
+        self._run.fetch_seconds = time.perf_counter() - fetch_started_at
+
+        return self._save(received)
+
+    def _save(self, blocks: typing.Iterable[BlockModel]) -> tuple[BlockModel, ...]:
+        """Insert blocks in order and queue organization of them.
+        """
+        blocks = tuple(blocks)
         with SessionLocal() as db:
-            for i, block in enumerate((reversed(collected) if full else collected)):
+            persist_started_at = time.perf_counter()
+            for block in blocks:
                 db.add(block)
                 db.flush()
                 db.refresh(block)
-                # therotically, self._organize will be run after all committed
-                scheduler.add_job(
-                    func=self._organize,
-                    kwargs={"block_id": block.id},
-                    trigger="date",
-                    run_date=get_datetime() + datetime.timedelta(seconds=i+1+6),
-                )
+            schedule_started_at = time.perf_counter()
+            # committed together with blocks, so organize always sees them
+            OrganizeManager.enqueue(
+                db, "source", (typing.cast(BlockID, block.id) for block in blocks),
+                source_id=self._id,
+            )
+            schedule_finished_at = time.perf_counter()
             db.commit()
 
+        self._run.collected = len(blocks)
+        self._run.persist_seconds = (
+            schedule_started_at - persist_started_at
+            + time.perf_counter() - schedule_finished_at
+        )
+        self._run.schedule_seconds = schedule_finished_at - schedule_started_at
+        return blocks
+
+    def _count_api_call(self, num: int = 1):
+        """Count calls made to the API of the source in the current run.
+        """
+        self._run.api_calls += num
+
+    @classmethod
+    def accepts_push(cls) -> bool:
+        return cls._receive is not SourceBase._receive
+
     @abc.abstractmethod
     async def _collect(
         self, full: bool = False
@@ -58,6 +159,16 @@ class SourceBase(abc.ABC, typing.Generic[ConfigTV]):
         """The real collect implementation.
         """
 
+    async def _receive(
+        self, payload: typing.Any
+    ) -> typing.AsyncGenerator[BlockModel, None]:
+        """Extract blocks from a pushed payload.
+
+        Only sources able to receive pushes override this.
+        """
+        raise NotImplementedError
+        yield
+
     @abc.abstractmethod
     async def _organize(self, block_id: BlockID) -> None:
         """Organize the collected block.
@@ -71,15 +182,109 @@ class SourceBase(abc.ABC, typing.Generic[ConfigTV]):
         # TODO
 
 
+class SourceSchedule(sqlmodel.SQLModel):
+    next_run_at: Opt[datetime.datetime] = None
+    interval: Opt[float] = None
+    """Current adaptive interval in minutes, None if not adaptive.
+    """
+    runs: tuple[SourceRunModel, ...] = ()
+
+
 class SourceManager:
     """
     
     - Run collect method of all configured sources
     - Add, remove and configure source instances
     - Add, remove sources
+    - Receive pushes to sources and ingest them in background
     """
 
     SOURCES: dict[SourceID, SourceBase] = {}
+    _LOCKS: dict[SourceID, asyncio.Lock] = {}
+    """Guard against overlapping runs of a source.
+    """
+
+    INGEST_QUEUE: asyncio.Queue[tuple[SourceID, typing.Any]] = asyncio.Queue(
+        maxsize=INGEST_QUEUE_SIZE
+    )
+    """Pushes waiting to be ingested, shared by all sources.
+    """
+    _ingest_consumer: Opt[asyncio.Task] = None
+    _ingest_retries: set[asyncio.Task] = set()
+    """Pushes waiting to be put back to the queue.
+    """
+
+    @classmethod
+    def register_apis(cls, router: fastapi.APIRouter):
+        router.get("/{source_id}/collect")(cls.run_a_collect)
+        router.get("/{source_id}/schedule")(cls.get_schedule)
+        router.get("/{source_id}/runs")(cls.list_runs)
+        router.post("/{source_id}/ingest", status_code=202)(cls.receive_a_push)
+        router.post(
+            "/{source_id}/ingest/token",
+            dependencies=[fastapi.Depends(verify_admin_token)],
+        )(cls.reset_ingest_token)
+
+    @classmethod
+    async def start_all(cls):
+        """Start the ingest consumer, and all sources if this worker leads.
+        """
+        cls._ingest_consumer = asyncio.create_task(cls._consume_ingest_queue())
+        await run_as_leader(cls._start_sources)
+
+    @classmethod
+    async def _start_sources(cls):
+        with SessionLocal() as db:
+            sources = db.exec(sqlmodel.select(SourceModel)).all()
+
+        for source in sources:
+            try:
+                await cls._get_source_ins(
+                    typing.cast(SourceID, source.id), source.type
+                ).start()
+            except Exception:
+                logger.exception("Failed to start source %s", source.id)
+
+    @classmethod
+    async def close_all(cls):
+        if cls._ingest_consumer is not None:
+            cls._ingest_consumer.cancel()
+            cls._ingest_consumer = None
+        for task in tuple(cls._ingest_retries):
+            task.cancel()
+
+    @classmethod
+    async def _consume_ingest_queue(cls):
+        while True:
+            source_id, payload = await cls.INGEST_QUEUE.get()
+            try:
+                await cls._run(
+                    source_id, "push",
+                    lambda source, run: source.ingest(payload, run=run),
+                )
+            except SourceRunInFlight:
+                cls._retry_push(source_id, payload, INGEST_RETRY_INTERVAL)
+            except CircuitOpen as e:
+                logger.warning("Push to source %s put back, %s", source_id, e.detail)
+                cls._retry_push(source_id, payload, e.retry_in)
+            except Exception:
+                logger.exception("Failed to ingest push to source %s", source_id)
+            finally:
+                cls.INGEST_QUEUE.task_done()
+
+    @classmethod
+    def _retry_push(cls, source_id: SourceID, payload: typing.Any, delay: float):
+        """Put a push back to the queue after `delay` seconds.
+
+        Without blocking pushes to other sources in the meantime.
+        """
+        async def requeue():
+            await asyncio.sleep(delay)
+            await cls.INGEST_QUEUE.put((source_id, payload))
+
+        task = asyncio.create_task(requeue())
+        cls._ingest_retries.add(task)
+        task.add_done_callback(cls._ingest_retries.discard)
 
     @classmethod
     def set_up_collect_jobs(cls):
@@ -87,17 +292,196 @@ class SourceManager:
             sources = db.exec(
                 sqlmodel.select(SourceModel).where(SourceModel.collect_at is not None)
             ).all()
+            # resume adaptive intervals from the last scheduled run
+            last_intervals = dict(db.exec(
+                sqlmodel.select(SourceRunModel.source_id, SourceRunModel.next_interval)
+                .where(SourceRunModel.next_interval != None)  # noqa: E711
+                .distinct(SourceRunModel.source_id)
+                .order_by(SourceRunModel.source_id, sqlmodel.desc(SourceRunModel.started_at))
+            ).all())
 
         for source in sources:
             if source.collect_at is None:
                 continue
+            try:
+                collect_at = CollectAt.model_validate(source.collect_at)
+            except pydantic.ValidationError:
+                logger.exception("Collect of source %s not scheduled, invalid collect_at", source.id)
+                continue
             scheduler.add_job(
-                func=cls._get_source_ins(typing.cast(SourceID, source.id), source.type).collect,
-                trigger=source.collect_at.to_trigger(),
-                id=f"source.{source.id}.collect",
+                func=cls.run_scheduled_collect,
+                args=(source.id,),
+                trigger=collect_at.to_trigger(
+                    last_intervals.get(typing.cast(SourceID, source.id))
+                ),
+                id=cls._get_collect_job_id(typing.cast(SourceID, source.id)),
                 replace_existing=True,
             )
 
+    @staticmethod
+    def _get_collect_job_id(source_id: SourceID) -> str:
+        return f"source.{source_id}.collect"
+
+    @classmethod
+    async def run_scheduled_collect(cls, source_id: SourceID):
+        """Run a scheduled collect and adapt the interval if configured so.
+
+        Skipped if a run of the source is in flight.
+        """
+        with SessionLocal() as db:
+            source_model = db.exec(
+                sqlmodel.select(SourceModel).where(SourceModel.id == source_id)
+            ).one()
+        collect_at = CollectAt.model_validate(source_model.collect_at)
+
+        try:
+            run = await cls._run(
+                source_id, "scheduled",
+                lambda source, run: source.collect(run=run),
+                source_model.type,
+            )
+        except SourceRunInFlight:
+            await asyncio.to_thread(cls._record_run, SourceRunModel(
+                source_id=source_id, started_at=get_datetime(),
+                finished_at=get_datetime(), status="skipped",
+            ))
+            return
+        except CircuitOpen as e:
+            # collect again once the provider may be back, instead of at the next interval
+            logger.warning("Scheduled collect of source %s rescheduled, %s", source_id, e.detail)
+            scheduler.modify_job(
+                cls._get_collect_job_id(source_id),
+                next_run_time=datetime.datetime.now(datetime.timezone.utc)
+                + datetime.timedelta(seconds=e.retry_in),
+            )
+            return
+        except Exception:
+            logger.exception("Scheduled collect of source %s failed", source_id)
+            return
+
+        if collect_at.adaptive is not None:
+            job_id = cls._get_collect_job_id(source_id)
+            job = scheduler.get_job(job_id)
+            interval = (
+                job.trigger.interval.total_seconds() / 60 if job
+                else collect_at.adaptive.min_interval
+            )
+            next_interval = collect_at.adaptive.next_interval(interval, run.collected)
+            run.next_interval = next_interval
+            await asyncio.to_thread(cls._record_run, run)
+            if job and next_interval != interval:
+                scheduler.reschedule_job(job_id, trigger=collect_at.to_trigger(next_interval))
+
+    @classmethod
+    def _get_lock(cls, source_id: SourceID) -> asyncio.Lock:
+        lock = cls._LOCKS.get(source_id)
+        if lock is None:
+            lock = cls._LOCKS[source_id] = asyncio.Lock()
+        return lock
+
+    @classmethod
+    async def _run(
+        cls,
+        source_id: SourceID,
+        trigger: RunTrigger,
+        action: typing.Callable[[SourceBase, SourceRunModel], typing.Awaitable],
+        source_type: Opt[str] = None,
+    ) -> SourceRunModel:
+        """Run an action of the source in its lock and record the run.
+
+        The run is recorded as running when it starts, and updated once finished.
+
+        Pushes to a source are ingested one by one. Collects of a source
+        never overlap, even across workers. Nothing waits for the lock, so
+        a push to a source being collected does not hold up other pushes.
+
+        :param action: Collect or ingest to run, filling stats in given run.
+        :raise SourceRunInFlight: If a run of the source is in flight in this
+            worker, or, for its kind of run, in another worker.
+        """
+        lock = cls._get_lock(source_id)
+        if lock.locked():
+            raise SourceRunInFlight
+
+        async with lock:
+            async with async_distributed_lock(
+                f"inkcre.source.{source_id}" if trigger != "push"
+                else f"inkcre.source.{source_id}.push"
+            ) as acquired:
+                if not acquired:
+                    raise SourceRunInFlight
+
+                run = SourceRunModel(
+                    source_id=source_id, started_at=get_datetime(), trigger=trigger
+                )
+                # seen as running until it is finished
+                await asyncio.to_thread(cls._record_run, run)
+                started_at = time.perf_counter()
+                try:
+                    await action(cls._get_source_ins(source_id, source_type), run)
+                except Exception as e:
+                    run.status = "failed"
+                    run.error = repr(e)
+                    raise
+                else:
+                    run.status = "succeeded"
+                finally:
+                    run.finished_at = get_datetime()
+                    await asyncio.to_thread(cls._record_run, run)
+                    cls._observe_run(run, time.perf_counter() - started_at)
+        return run
+
+    @staticmethod
+    def _record_run(run: SourceRunModel):
+        with SessionLocal() as db:
+            db.add(run)
+            db.commit()
+            db.refresh(run)
+
+    @staticmethod
+    def _observe_run(run: SourceRunModel, seconds: float):
+        source_id = str(run.source_id)
+        SOURCE_RUNS.inc(source_id=source_id, trigger=run.trigger, status=run.status)
+        SOURCE_RUN_DURATION.observe(seconds, source_id=source_id, trigger=run.trigger)
+        SOURCE_RUN_STAGE_SECONDS.inc(run.fetch_seconds, source_id=source_id, stage="fetch")
+        SOURCE_RUN_STAGE_SECONDS.inc(run.persist_seconds, source_id=source_id, stage="persist")
+        SOURCE_RUN_STAGE_SECONDS.inc(run.schedule_seconds, source_id=source_id, stage="schedule")
+        SOURCE_COLLECTED.inc(run.collected, source_id=source_id)
+        SOURCE_API_CALLS.inc(run.api_calls, source_id=source_id)
+
+    @classmethod
+    def list_runs(
+        cls, source_id: int, num: int = 20, status: Opt[RunStatus] = None
+    ) -> tuple[SourceRunModel, ...]:
+        """Get recent runs of the source.
+
+        :param num: Number of runs to get.
+        :param status: Limit to runs in this status, None for all.
+        """
+        with SessionLocal() as db:
+            return tuple(db.exec(
+                sqlmodel.select(SourceRunModel)
+                .where(SourceRunModel.source_id == source_id)
+                .where(SourceRunModel.status == status if status else True)
+                .order_by(sqlmodel.desc(SourceRunModel.started_at))
+                .limit(num)
+            ).all())
+
+    @classmethod
+    def get_schedule(cls, source_id: int, num: int = 20) -> "SourceSchedule":
+        """Get the next planned collect and recent runs of the source.
+
+        :param num: Number of recent runs to get.
+        """
+        runs = cls.list_runs(source_id, num=num)
+
+        job = scheduler.get_job(cls._get_collect_job_id(typing.cast(SourceID, source_id)))
+        return SourceSchedule(
+            next_run_at=job.next_run_time if job else None,
+            interval=next((run.next_interval for run in runs if run.next_interval), None),
+            runs=runs,
+        )
+
     @classmethod
     def _get_source_ins(cls, source_id: SourceID, source_type: Opt[str] = None) -> SourceBase:
         ins = cls.SOURCES.get(source_id, None)
@@ -111,16 +495,115 @@ class SourceManager:
         return ins
 
     @classmethod
-    async def run_a_collect(cls, source_id: int, full: bool = False):
+    async def run_a_collect(cls, source_id: int, full: bool = False) -> SourceRunModel:
+        """Run a collect of the source now.
+
+        Conflict if a run of the source is in flight.
+        """
         with SessionLocal() as db:
             source_model = db.exec(
                 sqlmodel.select(SourceModel).where(SourceModel.id == source_id)
             ).one()
 
-            await cls._get_source_ins(
-                typing.cast(SourceID, source_model.id), source_model.type
-            ).collect(full=full)
-        
+        try:
+            return await cls._run(
+                typing.cast(SourceID, source_model.id), "manual",
+                lambda source, run: source.collect(full=full, run=run),
+                source_model.type,
+            )
+        except SourceRunInFlight:
+            raise fastapi.HTTPException(
+                status_code=fastapi.status.HTTP_409_CONFLICT,
+                detail=f"A run of source {source_id} is in flight."
+            )
+
+    @classmethod
+    async def organize(cls, source_id: SourceID, block_id: BlockID):
+        """Organize a block collected by the source.
+        """
+        source_type = None
+        if source_id not in cls.SOURCES:
+            with SessionLocal() as db:
+                source_type = db.exec(
+                    sqlmodel.select(SourceModel.type).where(SourceModel.id == source_id)
+                ).one()
+
+        await cls._get_source_ins(source_id, source_type)._organize(block_id)
+
+    @classmethod
+    async def receive_a_push(
+        cls,
+        source_id: int,
+        request: fastapi.Request,
+        x_ingest_token: str = fastapi.Header(),
+    ):
+        """Accept data pushed to a source and queue it for ingestion.
+
+        The push must carry the token of the source in `X-Ingest-Token` header.
+        """
+        with SessionLocal() as db:
+            source_model = db.exec(
+                sqlmodel.select(SourceModel).where(SourceModel.id == source_id)
+            ).one_or_none()
+
+        if (
+            source_model is None or source_model.ingest_token is None
+            or not secrets.compare_digest(
+                source_model.ingest_token,
+                hashlib.sha256(x_ingest_token.encode()).hexdigest()
+            )
+        ):
+            raise fastapi.HTTPException(
+                status_code=fastapi.status.HTTP_401_UNAUTHORIZED,
+                detail="Invalid ingest token."
+            )
+
+        source = cls._get_source_ins(
+            typing.cast(SourceID, source_model.id), source_model.type
+        )
+        if not source.accepts_push():
+            raise fastapi.HTTPException(
+                status_code=fastapi.status.HTTP_405_METHOD_NOT_ALLOWED,
+                detail=f"Source {source_id} does not accept pushes."
+            )
+
+        try:
+            payload = await request.json()
+        except ValueError:
+            raise fastapi.HTTPException(
+                status_code=fastapi.status.HTTP_400_BAD_REQUEST,
+                detail="Body must be JSON."
+            )
+
+        try:
+            cls.INGEST_QUEUE.put_nowait((typing.cast(SourceID, source_model.id), payload))
+        except asyncio.QueueFull:
+            raise fastapi.HTTPException(
+                status_code=fastapi.status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Ingest queue is full.",
+                headers={"Retry-After": "10"},
+            )
+
+        return {"status": "queued"}
+
+    @classmethod
+    def reset_ingest_token(cls, source_id: int) -> str:
+        """Generate a new push token for the source, enabling push ingestion.
+
+        Only the digest is stored, so the token is shown only this once.
+        Needs the admin token in `X-Admin-Token` header.
+        """
+        token = secrets.token_urlsafe(32)
+        with SessionLocal() as db:
+            source_model = db.exec(
+                sqlmodel.select(SourceModel).where(SourceModel.id == source_id)
+            ).one()
+            source_model.ingest_token = hashlib.sha256(token.encode()).hexdigest()
+            db.add(source_model)
+            db.commit()
+
+        return token
+
     @classmethod
     def create(cls, type_: str, nickname: Opt[str] = None) -> SourceModel:
         """Add a new source.
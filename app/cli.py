@@ -0,0 +1,47 @@
+"""Admin commands.
+
+    python -m app.cli export inkcre.graph
+    python -m app.cli import inkcre.graph
+    python -m app.cli index-embeddings halfvec
+"""
+
+import argparse
+import logging
+import sys
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(prog="python -m app.cli")
+    commands = parser.add_subparsers(dest="command", required=True)
+    export_parser = commands.add_parser("export", help="export the block graph to an archive")
+    export_parser.add_argument("path", help="archive to write, `-` for stdout")
+    import_parser = commands.add_parser("import", help="import an archive into an empty instance")
+    import_parser.add_argument("path", help="archive to read, `-` for stdin")
+    index_parser = commands.add_parser(
+        "index-embeddings", help="switch the index searched for embeddings, see EMBEDDING_INDEX"
+    )
+    index_parser.add_argument("mode", choices=("full", "halfvec", "binary"))
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr)
+
+    if args.command == "index-embeddings":
+        from app.business.embedding import rebuild_indexes
+        rebuild_indexes(args.mode)
+        return
+
+    from app.business import archive
+    if args.command == "export":
+        out = sys.stdout.buffer if args.path == "-" else open(args.path, "wb")
+        with out:
+            for chunk in archive.export_graph():
+                out.write(chunk)
+    else:
+        in_ = sys.stdin.buffer if args.path == "-" else open(args.path, "rb")
+        with in_:
+            for table, count in archive.import_graph(in_).items():
+                logging.info("Imported %s rows into %s", count, table)
+
+
+if __name__ == "__main__":
+    main()
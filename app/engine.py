@@ -1,15 +1,30 @@
 __all__ = [
     'SQLDB_ENGINE',
+    'SQLDB_DIRECT_ENGINE',
+    'SQLDB_REPLICA_ENGINES',
+    'ReadYourWritesMiddleware',
     'get_db_session',
+    'get_read_db_session',
     'SessionLocal',
+    'unit_of_work',
 ]
 
+import asyncio
+import contextlib
+import contextvars
+import itertools
+import logging
 import os
+import re
+import threading
 import typing
+from typing import Optional as Opt
+import fastapi
 import sqlalchemy.orm
 import sqlalchemy.dialects.postgresql
 # from sqlalchemy import create_engine
 import sqlmodel
+from .utils import deadline, tracing
 
 
 # configs
@@ -19,21 +34,312 @@ HOST = os.getenv('DB_HOST', 'localhost')
 PORT = int(os.getenv('DB_PORT', '5432'))
 DATABASE = os.getenv('DB_DATABASE', 'public')
 SCHEMA = os.getenv('DB_SCHEMA', 'public')
+POOL_MODE = os.getenv('DB_POOL_MODE', 'session')
+"""`transaction` when `DB_HOST` is a PgBouncer in transaction pooling mode.
 
+No state is then left on server connections: the schema is set per
+transaction, and what needs a session, e.g. session level advisory locks,
+connects to `DB_DIRECT_HOST` instead.
+"""
+DIRECT_HOST = os.getenv('DB_DIRECT_HOST', HOST)
+DIRECT_PORT = int(os.getenv('DB_DIRECT_PORT', str(PORT)))
+"""Postgres itself, behind the pooler of `DB_HOST`.
+"""
+REPLICA_HOSTS = [host for host in os.getenv('DB_REPLICA_HOSTS', '').split(',') if host]
+"""Hot standbys serving read-only requests, `host` or `host:port`, comma separated.
+"""
+REPLICA_PIN_SECONDS = int(os.getenv('DB_REPLICA_PIN_SECONDS', '60'))
+"""How long a client reads only what has replayed its last write.
+"""
 
-SQLDB_ENGINE = sqlmodel.create_engine(
-    f'postgresql+psycopg2://{USERNAME}:{PASSWORD}@{HOST}:{PORT}/{DATABASE}',
-    connect_args={"options": f"-csearch_path={SCHEMA}"}
+logger = logging.getLogger(__name__)
+
+
+def _create_engine(
+    host: str, port: int, session_state: bool = POOL_MODE != 'transaction', **kwargs
+) -> sqlalchemy.Engine:
+    """
+    :param session_state: Whether server connections are kept by the client,
+        so settings can be made once for them.
+    """
+    if session_state:
+        kwargs["connect_args"] = {"options": f"-csearch_path={SCHEMA}"}
+    engine = sqlmodel.create_engine(
+        f'postgresql+psycopg2://{USERNAME}:{PASSWORD}@{host}:{port}/{DATABASE}', **kwargs
+    )
+    if not session_state and SCHEMA != 'public':
+        # PgBouncer rejects startup options, and psycopg2 never prepares
+        # statements on the server, so there is no statement cache to turn off.
+        sqlalchemy.event.listen(engine, "begin", _set_local_search_path)
+    sqlalchemy.event.listen(engine, "begin", _set_local_statement_timeout)
+    tracing.instrument_engine(engine)
+    return engine
+
+
+def _set_local_search_path(conn: sqlalchemy.Connection):
+    if conn.get_execution_options().get("isolation_level") != "AUTOCOMMIT":
+        conn.exec_driver_sql(f'SET LOCAL search_path TO "{SCHEMA}"')
+
+
+def _set_local_statement_timeout(conn: sqlalchemy.Connection):
+    """Limit statements of a request with a deadline to what remains of it.
+    """
+    token = deadline.current()
+    if token is None or conn.get_execution_options().get("isolation_level") == "AUTOCOMMIT":
+        return
+    token.check()
+    conn.exec_driver_sql(f"SET LOCAL statement_timeout = {max(1, int(token.remaining() * 1000))}")
+
+
+SQLDB_ENGINE = _create_engine(HOST, PORT)
+SQLDB_DIRECT_ENGINE = (
+    _create_engine(DIRECT_HOST, DIRECT_PORT, session_state=True, pool_size=2)
+    if POOL_MODE == 'transaction' else SQLDB_ENGINE
+)
+"""Connections to Postgres itself, which may keep session state.
+"""
+SQLDB_REPLICA_ENGINES = [
+    _create_engine(host, int(port or PORT))
+    for host, _, port in (host.partition(':') for host in REPLICA_HOSTS)
+]
+_replicas = itertools.cycle(SQLDB_REPLICA_ENGINES)
+
+LSN_HEADER = "X-InKCre-LSN"
+LSN_COOKIE = "inkcre_lsn"
+_LSN_PATTERN = re.compile(r"[0-9A-F]{1,8}/[0-9A-F]{1,8}")
+
+
+T = typing.TypeVar("T")
+
+
+class _UnitOfWork:
+
+    def __init__(self, bind: Opt[sqlalchemy.Engine] = None):
+        # loaded models stay usable after the commit, e.g. in background tasks
+        self.session = sqlmodel.Session(bind or SQLDB_ENGINE, expire_on_commit=False)
+        self.lock = threading.RLock()
+        """Held by the thread using the session through `SessionLocal`.
+        """
+
+    def end(self, func: typing.Callable[[sqlmodel.Session], T]) -> T:
+        """Run `func`, e.g. commit, once helpers give the session back.
+
+        A cancelled request may still have helpers running in threads.
+        """
+        with self.lock:
+            return func(self.session)
+
+
+_current_unit: contextvars.ContextVar[Opt[_UnitOfWork]] = contextvars.ContextVar(
+    "unit_of_work", default=None
 )
 
+
+class _SharedSession:
+    """The session of the unit of work, lent to a helper.
+
+    Commit only flushes, so ids are assigned and the changes are seen by
+    later queries, and close gives the session back. The unit of work commits.
+    """
+
+    def __init__(self, unit: _UnitOfWork):
+        self._unit = unit
+        self._released = False
+
+    def __getattr__(self, name: str):
+        return getattr(self._unit.session, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def commit(self):
+        self._unit.session.flush()
+
+    def close(self):
+        if not self._released:
+            self._released = True
+            self._unit.lock.release()
+
+
+_request_state: contextvars.ContextVar[Opt[dict]] = contextvars.ContextVar(
+    "request_state", default=None
+)
+"""State of the request, set when clients are pinned to their writes.
+"""
+
+
+class _PinningSession(sqlmodel.Session):
+    """A session of its own in a request, pinning the client to what it commits.
+    """
+
+    def commit(self):
+        super().commit()
+        state = _request_state.get()
+        if state is not None:
+            state["wal_lsn"] = _current_wal_lsn(self)
+
+
 # SessionLocal = sqlalchemy.orm.sessionmaker(autocommit=False, autoflush=False, bind=SQLDB_ENGINE)
-def SessionLocal():
+def SessionLocal(shared: bool = True) -> sqlmodel.Session:
+    """A session of the current unit of work, or a session of its own.
+
+    The session of the unit of work is not thread safe, so a helper run by
+    another thread while it is in use, e.g. by `asyncio.gather`, gets its own.
+
+    :param shared: False for a session of its own on the primary, for writes
+        apart from the request, e.g. to caches, which may be read from a replica.
+    """
+    unit = _current_unit.get() if shared else None
+    if unit is not None and unit.lock.acquire(blocking=False):
+        return typing.cast(sqlmodel.Session, _SharedSession(unit))
+    if shared and _request_state.get() is not None:
+        return _PinningSession(SQLDB_ENGINE)
     return sqlmodel.Session(SQLDB_ENGINE)
 
-def get_db_session() -> typing.Generator:
-    """A fastapi dependency to get a database session."""
-    db_session = SessionLocal()
+
+@contextlib.contextmanager
+def unit_of_work() -> typing.Iterator[sqlmodel.Session]:
+    """Run the block in one transaction on one connection.
+
+    `SessionLocal()` in the block, including in threads started by it,
+    shares the session, which is committed at the end, or rolled back if
+    the block raises. A nested unit of work joins the outer one.
+    """
+    if _current_unit.get() is not None:
+        with SessionLocal() as db_session:
+            yield db_session
+        return
+
+    unit = _UnitOfWork()
+    token = _current_unit.set(unit)
     try:
-        yield db_session
+        yield unit.session
+        unit.session.commit()
+    except BaseException:
+        unit.session.rollback()
+        raise
     finally:
-        db_session.close()
+        _current_unit.reset(token)
+        unit.session.close()
+
+
+async def get_db_session(request: fastapi.Request) -> typing.AsyncIterator[sqlmodel.Session]:
+    """A fastapi dependency, the unit of work of a request.
+
+    Helpers calling `SessionLocal()` for the endpoint share the session,
+    which is committed once when the endpoint is done. Async, so the unit
+    of work is seen by the endpoint, wherever it runs.
+    """
+    unit = _UnitOfWork()
+    token = _current_unit.set(unit)
+    try:
+        yield unit.session
+        lsn = await asyncio.to_thread(unit.end, _commit)
+    except BaseException:
+        await asyncio.to_thread(unit.end, sqlmodel.Session.rollback)
+        raise
+    finally:
+        _current_unit.reset(token)
+        await asyncio.to_thread(unit.end, sqlmodel.Session.close)
+    if lsn is not None:
+        request.state.wal_lsn = lsn
+
+
+def _commit(session: sqlmodel.Session) -> Opt[str]:
+    """Commit, and tell the WAL position clients should read from then on.
+
+    :returns: None if there is no replica.
+    """
+    session.commit()
+    if not SQLDB_REPLICA_ENGINES:
+        return None
+    return _current_wal_lsn(session)
+
+
+def _current_wal_lsn(session: sqlmodel.Session) -> str:
+    return session.execute(sqlalchemy.text("SELECT CAST(pg_current_wal_lsn() AS text)")).scalar_one()
+
+
+async def get_read_db_session(request: fastapi.Request) -> typing.AsyncIterator[sqlmodel.Session]:
+    """A fastapi dependency, the unit of work of a read-only request.
+
+    It is on a replica, unless there is none, or the last write of the
+    client, told by `LSN_HEADER` or `LSN_COOKIE`, is not replayed by it yet.
+    """
+    lsn = request.headers.get(LSN_HEADER) or request.cookies.get(LSN_COOKIE)
+    if lsn is not None and not _LSN_PATTERN.fullmatch(lsn):
+        lsn = None
+
+    unit = await asyncio.to_thread(_read_unit, lsn)
+    token = _current_unit.set(unit)
+    try:
+        yield unit.session
+        await asyncio.to_thread(unit.end, sqlmodel.Session.commit)
+    except BaseException:
+        await asyncio.to_thread(unit.end, sqlmodel.Session.rollback)
+        raise
+    finally:
+        _current_unit.reset(token)
+        await asyncio.to_thread(unit.end, sqlmodel.Session.close)
+
+
+def _read_unit(lsn: Opt[str]) -> _UnitOfWork:
+    for _ in SQLDB_REPLICA_ENGINES:
+        unit = _UnitOfWork(next(_replicas))
+        try:
+            if lsn is None:
+                unit.session.connection()
+                return unit
+            replayed = unit.session.execute(
+                sqlalchemy.text("SELECT pg_last_wal_replay_lsn() >= CAST(:lsn AS pg_lsn)"),
+                {"lsn": lsn},
+            ).scalar()
+        except Exception:
+            logger.warning("Replica is unavailable", exc_info=True)
+            replayed = False
+        if replayed:
+            return unit
+        unit.session.close()
+    return _UnitOfWork()
+
+
+class ReadYourWritesMiddleware:
+    """Pin clients to what has replayed their last write.
+
+    Responses of requests that wrote tell the WAL position of the write by
+    `LSN_HEADER`, and set it as `LSN_COOKIE` for `REPLICA_PIN_SECONDS`.
+    Writes are those of `get_db_session`, and those of `SessionLocal()`
+    out of it, e.g. by endpoints committing in chunks.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        state = scope.setdefault("state", {})
+        context_token = _request_state.set(state)
+
+        async def send_with_lsn(message):
+            lsn = state.get("wal_lsn")
+            if message["type"] == "http.response.start" and lsn is not None:
+                cookie = (
+                    f"{LSN_COOKIE}={lsn}; Max-Age={REPLICA_PIN_SECONDS}; Path=/; "
+                    "HttpOnly; SameSite=Lax"
+                )
+                message["headers"] = [
+                    *message.get("headers", ()),
+                    (LSN_HEADER.lower().encode(), lsn.encode()),
+                    (b"set-cookie", cookie.encode()),
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_lsn)
+        finally:
+            _request_state.reset(context_token)
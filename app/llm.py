@@ -1,22 +1,411 @@
 __all__ = [
+    "call_in_slot",
     "get_embeddings",
     "one_chat",
-    "multi_chat"
+    "multi_chat",
+    "estimate_tokens",
+    "truncate_to_tokens",
+    "prune_llm_cache",
+    "LLMOverloaded",
+    "Priority",
+    "interactive_priority",
 ]
 
+import asyncio
+import collections
+import concurrent.futures
+import contextlib
+import contextvars
+import datetime
+import functools
+import hashlib
+import json
+import logging
 import os
+import threading
+import time
 import typing
-from openai import OpenAI
-from openai.types.chat import ChatCompletionUserMessageParam, ChatCompletionAssistantMessageParam
+import unicodedata
+import fastapi
+from .utils import deadline, tracing
+from .utils.breaker import CircuitBreaker
+from .utils.metrics import Counter, Gauge, Histogram
+
+if typing.TYPE_CHECKING:
+    from openai import OpenAI
+    from openai.types.chat import ChatCompletionUserMessageParam, ChatCompletionAssistantMessageParam
 
 # Config
 LLM_SP_AK = os.getenv("LLM_SP_AK", "")
 LLM_SP_BASE_URL = os.getenv("LLM_SP_BASE_URL", "")
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", "86400"))
+"""Seconds a cached chat completion stays valid.
+"""
+LLM_CACHE_SIZE = int(os.getenv("LLM_CACHE_SIZE", "1024"))
+"""Max number of chat completions cached in process.
+"""
+LLM_CACHE_PERSIST = os.getenv("LLM_CACHE_PERSIST", "1") == "1"
+"""Whether to share cached chat completions among workers in Postgres.
+"""
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "8"))
+"""Max LLM calls in flight in a process, of all priorities.
+"""
+LLM_CONCURRENCY_BACKGROUND = int(os.getenv("LLM_CONCURRENCY_BACKGROUND", "2"))
+LLM_MAX_QUEUE_INTERACTIVE = int(os.getenv("LLM_MAX_QUEUE_INTERACTIVE", "32"))
+"""Interactive calls waiting beyond it are shed with 503, 0 for no limit.
+"""
+LLM_RETRY_AFTER = int(os.getenv("LLM_RETRY_AFTER", "5"))
+
+logger = logging.getLogger(__name__)
 
-OPENAI_CLIENT = OpenAI(
-    base_url=LLM_SP_BASE_URL,
-    api_key=LLM_SP_AK,
+LLM_CACHE_LOOKUPS = Counter(
+    "inkcre_llm_cache_lookups_total", "Lookups of cached chat completions by result."
+)
+LLM_QUEUE_WAIT = Histogram(
+    "inkcre_llm_queue_wait_seconds", "Time LLM calls wait for a slot by priority."
 )
+LLM_QUEUE_LENGTH = Gauge(
+    "inkcre_llm_queue_length", "LLM calls waiting for a slot by priority."
+)
+LLM_SHED = Counter(
+    "inkcre_llm_shed_total", "LLM calls refused as too many were waiting by priority."
+)
+
+Priority = typing.Literal["interactive", "background"]
+_priority: contextvars.ContextVar[Priority] = contextvars.ContextVar(
+    "llm_priority", default="background"
+)
+
+
+async def interactive_priority() -> typing.AsyncIterator[None]:
+    """A fastapi dependency, LLM calls for the request go before background ones.
+
+    Background tasks of the request run after it, as background.
+    """
+    token = _priority.set("interactive")
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class LLMOverloaded(fastapi.HTTPException):
+
+    def __init__(self):
+        super().__init__(
+            status_code=503,
+            detail="Too many LLM calls are waiting, try again later.",
+            headers={"Retry-After": str(LLM_RETRY_AFTER)},
+        )
+
+
+class _Admission:
+    """Slots of LLM calls in flight, taken by interactive calls first.
+
+    Background calls are limited to `LLM_CONCURRENCY_BACKGROUND` and wait
+    while any interactive call waits, so a backfill can not hold up users.
+    Calls from the event loop wait by `acquire`, holding no thread, calls
+    from threads wait in `slot`.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._running: dict[Priority, int] = {"interactive": 0, "background": 0}
+        self._waiting: dict[Priority, int] = {"interactive": 0, "background": 0}
+        self._futures: set[asyncio.Future] = set()
+        """Wake up calls waiting in event loops.
+        """
+
+    def _is_free(self, priority: Priority) -> bool:
+        if sum(self._running.values()) >= LLM_CONCURRENCY:
+            return False
+        if priority == "background":
+            return (
+                self._running["background"] < LLM_CONCURRENCY_BACKGROUND
+                and not self._waiting["interactive"]
+            )
+        return True
+
+    def _notify(self):
+        self._condition.notify_all()
+        for future in self._futures:
+            future.get_loop().call_soon_threadsafe(_set_done, future)
+
+    def _start_waiting(self, priority: Priority):
+        """
+        :raise LLMOverloaded: If too many interactive calls are waiting.
+        """
+        if (
+            priority == "interactive" and LLM_MAX_QUEUE_INTERACTIVE
+            and self._waiting[priority] >= LLM_MAX_QUEUE_INTERACTIVE
+        ):
+            LLM_SHED.inc(priority=priority)
+            raise LLMOverloaded()
+        self._waiting[priority] += 1
+        LLM_QUEUE_LENGTH.inc(priority=priority)
+
+    def _stop_waiting(self, priority: Priority):
+        self._waiting[priority] -= 1
+        LLM_QUEUE_LENGTH.dec(priority=priority)
+        # background calls may go once no interactive one waits
+        self._notify()
+
+    def release(self, priority: Priority):
+        with self._condition:
+            self._running[priority] -= 1
+            self._notify()
+
+    async def acquire(self, priority: Priority):
+        """Take a slot, give it back by `release`.
+
+        :raise LLMOverloaded: If too many interactive calls are waiting.
+        """
+        loop = asyncio.get_running_loop()
+        started = time.monotonic()
+        with self._condition:
+            if self._is_free(priority):
+                self._running[priority] += 1
+                LLM_QUEUE_WAIT.observe(0, priority=priority)
+                return
+            self._start_waiting(priority)
+        try:
+            while True:
+                deadline.check()
+                future = loop.create_future()
+                with self._condition:
+                    if self._is_free(priority):
+                        self._running[priority] += 1
+                        break
+                    self._futures.add(future)
+                try:
+                    await asyncio.wait_for(future, deadline.remaining())
+                except TimeoutError:
+                    pass
+                finally:
+                    with self._condition:
+                        self._futures.discard(future)
+        finally:
+            with self._condition:
+                self._stop_waiting(priority)
+        LLM_QUEUE_WAIT.observe(time.monotonic() - started, priority=priority)
+
+    @contextlib.contextmanager
+    def slot(self) -> typing.Iterator[None]:
+        """
+        :raise LLMOverloaded: If too many interactive calls are waiting.
+        """
+        if _admitted.get():
+            yield
+            return
+
+        priority = _priority.get()
+        started = time.monotonic()
+        with self._condition:
+            if not self._is_free(priority):
+                self._start_waiting(priority)
+                try:
+                    while not self._is_free(priority):
+                        deadline.check()
+                        self._condition.wait(deadline.remaining())
+                finally:
+                    self._stop_waiting(priority)
+            self._running[priority] += 1
+        LLM_QUEUE_WAIT.observe(time.monotonic() - started, priority=priority)
+        try:
+            yield
+        finally:
+            self.release(priority)
+
+
+def _set_done(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+
+_admission = _Admission()
+_admitted: contextvars.ContextVar[bool] = contextvars.ContextVar("llm_admitted", default=False)
+"""Whether the slot of the call is taken by `call_in_slot` already.
+"""
+_executor = concurrent.futures.ThreadPoolExecutor(LLM_CONCURRENCY, thread_name_prefix="llm")
+"""Threads of LLM calls from the event loop, as many as the calls in flight.
+"""
+
+T = typing.TypeVar("T")
+
+
+async def call_in_slot(func: typing.Callable[..., T], *args, **kwargs) -> T:
+    """Run a blocking LLM call, e.g. `one_chat`, in a thread once it has a slot.
+
+    Waiting for the slot takes no thread, so waiting calls neither hold up
+    other `asyncio.to_thread` calls nor keep shedding from kicking in.
+
+    :raise LLMOverloaded: If too many interactive calls are waiting.
+    """
+    priority = _priority.get()
+    await _admission.acquire(priority)
+    context = contextvars.copy_context()
+
+    def run() -> T:
+        try:
+            _admitted.set(True)
+            return func(*args, **kwargs)
+        finally:
+            _admission.release(priority)
+
+    future = _executor.submit(context.run, run)
+    # cancelled before it ran, e.g. with the request
+    future.add_done_callback(lambda future: future.cancelled() and _admission.release(priority))
+    return await asyncio.wrap_future(future)
+
+
+def _is_provider_failure(e: Exception) -> bool:
+    import openai
+
+    token = deadline.current()
+    if token is not None and token.expired():
+        # cut by the deadline of the request
+        return False
+    if isinstance(e, openai.APIStatusError):
+        return e.status_code >= 500 or e.status_code == 429
+    return isinstance(e, openai.APIError)
+
+
+OPENAI_BREAKER = CircuitBreaker("openai", _is_provider_failure)
+
+
+@functools.cache
+def get_openai_client() -> "OpenAI":
+    """Create the client on first use, so importing needs no credentials.
+    """
+    from openai import OpenAI
+    return OpenAI(
+        base_url=LLM_SP_BASE_URL,
+        api_key=LLM_SP_AK,
+    )
+
+
+class _LRUCache:
+    """Thread safe LRU cache whose entries expire after `ttl` seconds.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: collections.OrderedDict[str, tuple[float, str]] = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> str | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key: str, value: str, ttl: float | None = None):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_chat_cache = _LRUCache(maxsize=LLM_CACHE_SIZE, ttl=LLM_CACHE_TTL)
+
+
+def _chat_cache_key(model: str, messages: list, response_format: dict | None) -> str:
+    """Hash of the model and messages, insensitive to surrounding whitespace and unicode forms.
+    """
+    normalized = [
+        {
+            "role": message["role"],
+            "content": unicodedata.normalize("NFC", message["content"] or "").strip(),
+        }
+        for message in messages
+    ]
+    payload = json.dumps(
+        {"model": model, "messages": normalized, "response_format": response_format},
+        ensure_ascii=False, sort_keys=True, separators=(",", ":"),
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _load_cached_chat(key: str) -> str | None:
+    response = _chat_cache.get(key)
+    if response is not None:
+        LLM_CACHE_LOOKUPS.inc(result="memory")
+        return response
+
+    if LLM_CACHE_PERSIST:
+        import sqlmodel
+        from .engine import SessionLocal
+        from .schemas.llm import LLMCacheModel
+
+        try:
+            with SessionLocal() as db_session:
+                row = db_session.exec(
+                    sqlmodel.select(LLMCacheModel.response, LLMCacheModel.expires_at)
+                    .where(LLMCacheModel.key == key)
+                    .where(LLMCacheModel.expires_at > sqlmodel.func.now())
+                ).first()
+        except Exception:
+            logger.warning("Failed to load cached chat completion", exc_info=True)
+            row = None
+        if row is not None:
+            response, expires_at = row
+            ttl = (expires_at - datetime.datetime.now(datetime.timezone.utc)).total_seconds()
+            _chat_cache.set(key, response, ttl=ttl)
+            LLM_CACHE_LOOKUPS.inc(result="postgres")
+            return response
+
+    LLM_CACHE_LOOKUPS.inc(result="miss")
+    return None
+
+
+def _store_cached_chat(key: str, model: str, response: str):
+    _chat_cache.set(key, response)
+    if not LLM_CACHE_PERSIST:
+        return
+
+    import sqlalchemy.dialects.postgresql
+    from .engine import SessionLocal
+    from .schemas.llm import LLMCacheModel
+
+    expires_at = sqlalchemy.func.now() + datetime.timedelta(seconds=LLM_CACHE_TTL)
+    try:
+        with SessionLocal(shared=False) as db_session:
+            db_session.execute(
+                sqlalchemy.dialects.postgresql.insert(LLMCacheModel)
+                .values(key=key, model=model, response=response, expires_at=expires_at)
+                .on_conflict_do_update(
+                    index_elements=(LLMCacheModel.key,),
+                    set_={"response": response, "expires_at": expires_at},
+                )
+            )
+            db_session.commit()
+    except Exception:
+        logger.warning("Failed to store chat completion to cache", exc_info=True)
+
+
+def prune_llm_cache():
+    """Delete expired chat completions from Postgres.
+    """
+    import sqlalchemy
+    from .engine import SessionLocal
+    from .schemas.llm import LLMCacheModel
+
+    with SessionLocal() as db_session:
+        db_session.execute(
+            sqlalchemy.delete(LLMCacheModel).where(LLMCacheModel.expires_at <= sqlalchemy.func.now())
+        )
+        db_session.commit()
 
 
 def get_embeddings(
@@ -24,52 +413,116 @@ def get_embeddings(
     model: str = "baai/bge-m3",
     encoding_format: typing.Literal['float', 'base64'] = "float",
 ):
-    response = OPENAI_CLIENT.embeddings.create(
-        model=model,
-        input=text,
-        encoding_format=encoding_format
-    )
+    deadline.check()
+    with _admission.slot(), OPENAI_BREAKER.call(), tracing.span("llm.embeddings", "llm", model=model):
+        response = get_openai_client().embeddings.create(
+            model=model,
+            input=text,
+            encoding_format=encoding_format,
+            **_timeout(),
+        )
     return response.data[0].embedding
 
 
+def _timeout() -> dict:
+    """Cut calls made for a request at its deadline, they go on in threads otherwise.
+    """
+    remaining = deadline.remaining()
+    return {"timeout": max(remaining, 0.001)} if remaining is not None else {}
+
+
 def one_chat(
     prompt: str | None = None,
     model: str = "deepseek/deepseek-v3-0324",
-    history_messages: list[ChatCompletionUserMessageParam | ChatCompletionAssistantMessageParam] | None = None,
+    history_messages: list["ChatCompletionUserMessageParam | ChatCompletionAssistantMessageParam"] | None = None,
+    response_format: dict | None = None,
+    cacheable: bool = False,
+    validate: typing.Callable[[str], typing.Any] | None = None,
 ):
-    chat_completion_res = OPENAI_CLIENT.chat.completions.create(
-        model=model,
-        messages=[
-            ChatCompletionUserMessageParam(
-                role="user",
-                content=prompt,
-            ),
-            *(history_messages or [])
-        ],
-        stream=False,
-    )
-    return chat_completion_res.choices[0].message.content
+    """
+    :param response_format: e.g. a `json_schema` format to get strict JSON output.
+    :param cacheable: Whether the same messages may be answered by a cached completion,
+        only for single-shot analytical calls whose answer need not vary.
+    :param validate: Raises if the reply can not be used, then it is not cached.
+    """
+    messages: list = [
+        {"role": "user", "content": prompt},
+        *(history_messages or [])
+    ]
+    if cacheable:
+        key = _chat_cache_key(model, messages, response_format)
+        cached = _load_cached_chat(key)
+        if cached is not None:
+            return cached
+
+    deadline.check()
+    with (
+        _admission.slot(), OPENAI_BREAKER.call(),
+        tracing.span("llm.chat", "llm", model=model, messages=len(messages)) as span,
+    ):
+        chat_completion_res = get_openai_client().chat.completions.create(
+            model=model,
+            messages=messages,
+            stream=False,
+            **({"response_format": response_format} if response_format else {}),
+            **_timeout(),
+        )
+        usage = getattr(chat_completion_res, "usage", None)
+        if usage is not None:
+            span.set(prompt_tokens=usage.prompt_tokens, completion_tokens=usage.completion_tokens)
+    content = chat_completion_res.choices[0].message.content
+    if cacheable and content is not None:
+        if validate is not None:
+            validate(content)
+        _store_cached_chat(key, model, content)
+    return content
 
 def multi_chat(
     init_prompt: str | None = None,
     model: str = "deepseek/deepseek-v3-0324"
 ) -> typing.Callable[[str], str]:
-    messages = []
+    messages: list["ChatCompletionUserMessageParam | ChatCompletionAssistantMessageParam"] = []
 
     def wrapper(prompt: str) -> str:
         nonlocal messages
 
         if not messages:
             prompt = init_prompt + prompt
-        messages.append(ChatCompletionUserMessageParam(
-            role="user",
-            content=prompt,
-        ))
+        messages.append({"role": "user", "content": prompt})
         response = one_chat(prompt=prompt, model=model, history_messages=messages)
-        messages.append(ChatCompletionAssistantMessageParam(
-            role="assistant",
-            content=response,
-        ))
+        messages.append({"role": "assistant", "content": response})
         return response
 
     return wrapper
+
+
+def _is_cjk(char: str) -> bool:
+    return (
+        "\u2e80" <= char <= "\u9fff"
+        or "\uac00" <= char <= "\ud7af"
+        or "\uf900" <= char <= "\ufaff"
+    )
+
+
+def estimate_tokens(text: str) -> int:
+    """Roughly count tokens without a tokenizer.
+
+    A CJK character is about a token, others about four characters a token.
+    """
+    cjk = sum(1 for char in text if _is_cjk(char))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def truncate_to_tokens(text: str, max_tokens: int, ellipsis: str = "…") -> str:
+    """Cut `text` to at most about `max_tokens` tokens.
+    """
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    low, high = 0, len(text)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if estimate_tokens(text[:mid]) < max_tokens:
+            low = mid
+        else:
+            high = mid - 1
+    return text[:low] + ellipsis
@@ -11,5 +11,8 @@ sqlmodel.SQLModel.metadata = Base.metadata
 from .block import BlockModel
 from .storage import StorageTable, StorageModel
 from .relation import RelationModel
-from .source import SourceModel
-from .extension import ExtensionModel
\ No newline at end of file
+from .source import SourceModel, SourceRunModel
+from .extension import ExtensionModel
+from .organize import OrganizeJobModel
+from .image import Img2TextModel
+from .llm import LLMCacheModel
\ No newline at end of file
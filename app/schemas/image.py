@@ -0,0 +1,52 @@
+import datetime
+import typing
+import sqlalchemy
+import sqlmodel
+from typing import Optional as Opt
+
+
+def phash_to_int(phash: str) -> int:
+    """Convert a 64 bits hex perceptual hash to a signed integer for BIGINT.
+    """
+    value = int(phash, 16)
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+class Img2TextModel(sqlmodel.SQLModel, table=True):
+    """Result of img2text of an image by a workflow.
+
+    Reused by the same image, found by `digest`, and by images look
+    the same, found by `phash`.
+    """
+    __tablename__: str = 'img2text_results'  # type: ignore
+    __table_args__ = (
+        sqlalchemy.UniqueConstraint("digest", "workflow_id"),
+    )
+
+    id: Opt[int] = sqlmodel.Field(
+        sa_column=sqlalchemy.Column(sqlalchemy.Integer, primary_key=True, autoincrement=True),
+        default=None,
+    )
+    digest: str = sqlmodel.Field(
+        sa_column=sqlalchemy.Column(sqlalchemy.String(64), nullable=False)
+    )
+    """SHA-256 of the image content, or of its URL if not fetchable.
+    """
+    workflow_id: str = sqlmodel.Field(
+        sa_column=sqlalchemy.Column(sqlalchemy.Text, nullable=False)
+    )
+    phash: Opt[int] = sqlmodel.Field(
+        sa_column=sqlalchemy.Column(sqlalchemy.BigInteger, nullable=True, index=True),
+        default=None,
+    )
+    """Perceptual hash of the image, see `phash_to_int`.
+
+    None if the image can not be decoded.
+    """
+    result: dict[str, typing.Any] = sqlmodel.Field(
+        sa_column=sqlalchemy.Column(sqlalchemy.JSON, nullable=False)
+    )
+    created_at: datetime.datetime = sqlmodel.Field(
+        default_factory=datetime.datetime.now,
+        sa_column=sqlalchemy.Column(sqlalchemy.TIMESTAMP(timezone=True))
+    )
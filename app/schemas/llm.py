@@ -0,0 +1,30 @@
+import datetime
+import sqlalchemy
+import sqlmodel
+
+
+class LLMCacheModel(sqlmodel.SQLModel, table=True):
+    """A cached chat completion, see `app.llm.one_chat`.
+    """
+    __tablename__: str = 'llm_cache'  # type: ignore
+
+    key: str = sqlmodel.Field(
+        sa_column=sqlalchemy.Column(sqlalchemy.String(64), primary_key=True)
+    )
+    """SHA-256 of the model and the normalized messages.
+    """
+    model: str = sqlmodel.Field(
+        sa_column=sqlalchemy.Column(sqlalchemy.Text, nullable=False)
+    )
+    response: str = sqlmodel.Field(
+        sa_column=sqlalchemy.Column(sqlalchemy.Text, nullable=False)
+    )
+    created_at: datetime.datetime = sqlmodel.Field(
+        sa_column=sqlalchemy.Column(
+            sqlalchemy.TIMESTAMP(timezone=True), nullable=False,
+            server_default=sqlalchemy.func.now(),
+        )
+    )
+    expires_at: datetime.datetime = sqlmodel.Field(
+        sa_column=sqlalchemy.Column(sqlalchemy.TIMESTAMP(timezone=True), nullable=False, index=True)
+    )
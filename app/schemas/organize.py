@@ -0,0 +1,71 @@
+import datetime
+import typing
+import sqlalchemy
+import sqlmodel
+from typing import Optional as Opt
+from .block import BlockID
+from .source import SourceID
+
+
+OrganizeJobKind: typing.TypeAlias = typing.Literal["block", "source"]
+OrganizeJobStatus: typing.TypeAlias = typing.Literal["pending", "running", "failed"]
+
+
+class OrganizeJobModel(sqlmodel.SQLModel, table=True):
+    """A block waiting to be organized.
+
+    Any worker can claim pending jobs, see `OrganizeManager.claim`.
+    Jobs are deleted once done.
+    """
+    __tablename__: str = 'organize_jobs'  # type: ignore
+
+    id: Opt[int] = sqlmodel.Field(
+        sa_column=sqlalchemy.Column(sqlalchemy.Integer, primary_key=True, autoincrement=True),
+        default=None,
+    )
+    kind: OrganizeJobKind = sqlmodel.Field(
+        sa_column=sqlalchemy.Column(sqlalchemy.Text, nullable=False)
+    )
+    """`block` to organize with the resolver of the block,
+    `source` with the source which collected the block.
+    """
+    block_id: BlockID = sqlmodel.Field(
+        sa_column=sqlalchemy.Column(
+            sqlalchemy.Integer,
+            sqlalchemy.ForeignKey("blocks.id", ondelete="CASCADE"),
+            nullable=False,
+        )
+    )
+    source_id: Opt[SourceID] = sqlmodel.Field(
+        default=None,
+        sa_column=sqlalchemy.Column(
+            sqlalchemy.Integer,
+            sqlalchemy.ForeignKey("sources.id", ondelete="CASCADE"),
+            nullable=True,
+        )
+    )
+    status: OrganizeJobStatus = sqlmodel.Field(
+        default="pending",
+        sa_column=sqlalchemy.Column(sqlalchemy.Text, nullable=False, server_default="pending")
+    )
+    attempts: int = sqlmodel.Field(default=0)
+    run_after: datetime.datetime = sqlmodel.Field(
+        default_factory=datetime.datetime.now,
+        sa_column=sqlalchemy.Column(
+            sqlalchemy.TIMESTAMP(timezone=True), nullable=False,
+            server_default=sqlalchemy.func.now(),
+        )
+    )
+    """Not to be claimed before.
+    """
+    claimed_by: Opt[str] = sqlmodel.Field(default=None)
+    """Worker claimed the job.
+    """
+    claimed_at: Opt[datetime.datetime] = sqlmodel.Field(
+        default=None,
+        sa_column=sqlalchemy.Column(sqlalchemy.TIMESTAMP(timezone=True), nullable=True)
+    )
+    error: Opt[str] = sqlmodel.Field(
+        default=None,
+        sa_column=sqlalchemy.Column(sqlalchemy.Text, nullable=True)
+    )
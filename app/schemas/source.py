@@ -1,4 +1,7 @@
+import datetime
 import apscheduler.triggers.cron
+import apscheduler.triggers.interval
+import pydantic
 import sqlalchemy
 import typing
 import sqlmodel
@@ -6,16 +9,64 @@ from typing import Optional as Opt
 
 
 SourceID: typing.TypeAlias = int
+RunTrigger: typing.TypeAlias = typing.Literal["scheduled", "manual", "push"]
+RunStatus: typing.TypeAlias = typing.Literal["running", "succeeded", "failed", "skipped"]
 
 
+class AdaptiveCollect(sqlmodel.SQLModel):
+    """Collect at an interval adapted to how much the source yields.
+
+    Interval is doubled after a run collecting nothing and halved after
+    a run collecting at least `target` items, within the bounds.
+    """
+    min_interval: float = sqlmodel.Field(default=15, gt=0)
+    """Minimum minutes between two collects.
+    """
+    max_interval: float = sqlmodel.Field(default=24 * 60, gt=0)
+    """Maximum minutes between two collects.
+    """
+    target: int = sqlmodel.Field(default=5, ge=1)
+
+    @pydantic.model_validator(mode="after")
+    def _check_bounds(self) -> "AdaptiveCollect":
+        if self.min_interval > self.max_interval:
+            raise ValueError("min_interval must not be greater than max_interval")
+        return self
+
+    def next_interval(self, interval: float, collected: int) -> float:
+        """Get the interval (in minutes) to wait before the next collect.
+
+        :param interval: Interval before the run just finished.
+        :param collected: Number of items the run collected.
+        """
+        if collected == 0:
+            interval *= 2
+        elif collected >= self.target:
+            interval /= 2
+        return min(max(interval, self.min_interval), self.max_interval)
+
 class CollectAt(sqlmodel.SQLModel):
     day_of_week: Opt[int] = sqlmodel.Field(default=None, ge=0, le=6)
     """0-6, where 0 is Monday
     """
     hour: Opt[int] = sqlmodel.Field(default=None, ge=0, le=23)
     minute: Opt[int] = sqlmodel.Field(default=None, ge=0, le=59)
+    adaptive: Opt[AdaptiveCollect] = None
+    """Adapt the interval to the yield instead, ignoring fields above.
+    """
 
-    def to_trigger(self) -> apscheduler.triggers.cron.CronTrigger:
+    def to_trigger(
+        self, interval: Opt[float] = None
+    ) -> apscheduler.triggers.cron.CronTrigger | apscheduler.triggers.interval.IntervalTrigger:
+        """
+
+        :param interval: Current interval in minutes, for adaptive only.
+            None to start from the minimum interval.
+        """
+        if self.adaptive is not None:
+            return apscheduler.triggers.interval.IntervalTrigger(
+                minutes=interval or self.adaptive.min_interval
+            )
         return apscheduler.triggers.cron.CronTrigger(
             day_of_week=self.day_of_week,
             hour=self.hour,
@@ -46,4 +97,64 @@ class SourceModel(sqlmodel.SQLModel, table=True):
     """When to run collect method of this source.
 
     None for disabled.
-    """
\ No newline at end of file
+    """
+    ingest_token: Opt[str] = sqlmodel.Field(
+        sa_column=sqlalchemy.Column(sqlalchemy.Text, nullable=True),
+        default=None,
+    )
+    """SHA-256 hex digest of the token pushes to this source must carry.
+
+    None for push ingestion disabled.
+    """
+
+class SourceRunModel(sqlmodel.SQLModel, table=True):
+    """A run of collect of a source, or an ingestion of a push to it.
+    """
+    __tablename__: str = 'source_runs'  # type: ignore
+
+    id: Opt[int] = sqlmodel.Field(
+        sa_column=sqlalchemy.Column(sqlalchemy.Integer, primary_key=True, autoincrement=True),
+        default=None,
+    )
+    source_id: SourceID = sqlmodel.Field(
+        sa_column=sqlalchemy.Column(
+            sqlalchemy.Integer,
+            sqlalchemy.ForeignKey("sources.id", ondelete="CASCADE"),
+            nullable=False, index=True,
+        )
+    )
+    started_at: datetime.datetime = sqlmodel.Field(
+        sa_column=sqlalchemy.Column(sqlalchemy.TIMESTAMP(timezone=True), nullable=False)
+    )
+    finished_at: Opt[datetime.datetime] = sqlmodel.Field(
+        default=None,
+        sa_column=sqlalchemy.Column(sqlalchemy.TIMESTAMP(timezone=True), nullable=True)
+    )
+    trigger: RunTrigger = sqlmodel.Field(
+        default="scheduled",
+        sa_column=sqlalchemy.Column(sqlalchemy.Text, nullable=False, server_default="scheduled")
+    )
+    status: RunStatus = sqlmodel.Field(
+        default="running",
+        sa_column=sqlalchemy.Column(sqlalchemy.Text, nullable=False, server_default="running")
+    )
+    """`running` from when the run starts until it is finished.
+    """
+    collected: int = sqlmodel.Field(default=0)
+    """Number of blocks the run collected.
+    """
+    api_calls: int = sqlmodel.Field(default=0)
+    """Number of calls the run made to the API of the source.
+    """
+    fetch_seconds: float = sqlmodel.Field(default=0)
+    persist_seconds: float = sqlmodel.Field(default=0)
+    schedule_seconds: float = sqlmodel.Field(default=0)
+    """Seconds spent on scheduling organization of collected blocks.
+    """
+    error: Opt[str] = sqlmodel.Field(
+        default=None,
+        sa_column=sqlalchemy.Column(sqlalchemy.Text, nullable=True)
+    )
+    next_interval: Opt[float] = sqlmodel.Field(default=None)
+    """Minutes planned before the next run, for adaptive scheduled run only.
+    """
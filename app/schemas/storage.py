@@ -5,6 +5,7 @@ import pydantic
 import sqlalchemy
 from . import Base
 from ..utils.base import enum_serializer, AIOHTTP_CONNECTOR_GETTER
+from ..utils.tracing import AIOHTTP_TRACE_CONFIGS
 
 
 class StorageType(enum.Enum):
@@ -31,7 +32,9 @@ class StorageModel(pydantic.BaseModel):
 
     async def get_content(self, raw_content) -> bytes:
         if self.type == StorageType.URL:
-            async with aiohttp.ClientSession(connector=AIOHTTP_CONNECTOR_GETTER()) as session:
+            async with aiohttp.ClientSession(
+                connector=AIOHTTP_CONNECTOR_GETTER(), trace_configs=AIOHTTP_TRACE_CONFIGS
+            ) as session:
                 async with session.get(raw_content) as response:
                     response.raise_for_status()
                     return await response.read()
@@ -1,3 +1,201 @@
+__all__ = [
+    "scheduler",
+    "start_scheduler",
+    "stop_scheduler",
+    "distributed_lock",
+    "async_distributed_lock",
+    "run_as_leader",
+]
+
+import asyncio
+import contextlib
+import logging
+import os
+import typing
+import apscheduler.jobstores.sqlalchemy
 import apscheduler.schedulers.asyncio
+import sqlalchemy
+from typing import Optional as Opt
+from .engine import SQLDB_ENGINE, SQLDB_DIRECT_ENGINE
+
+
+# configs
+TASK_COORDINATION = os.getenv('TASK_COORDINATION', 'local')
+"""`local` for a single worker, `postgres` to coordinate workers through Postgres.
+"""
+LEADER_CHECK_INTERVAL = float(os.getenv('TASK_LEADER_CHECK_INTERVAL', '15'))
+
+logger = logging.getLogger(__name__)
+
+
+if TASK_COORDINATION == 'postgres':
+    scheduler = apscheduler.schedulers.asyncio.AsyncIOScheduler(jobstores={
+        "default": apscheduler.jobstores.sqlalchemy.SQLAlchemyJobStore(
+            engine=SQLDB_ENGINE, tablename="apscheduler_jobs"
+        )
+    })
+else:
+    scheduler = apscheduler.schedulers.asyncio.AsyncIOScheduler()
+
+_LEADER_LOCK = "inkcre.scheduler"
+_leader_conn: Opt[sqlalchemy.Connection] = None
+_campaign_task: Opt[asyncio.Task] = None
+_leader_funcs: list[typing.Callable[[], typing.Awaitable]] = []
+
+
+def _try_advisory_lock(name: str) -> Opt[sqlalchemy.Connection]:
+    """Try to take a session level advisory lock.
+
+    :returns: The connection holding the lock, give it to `_release_advisory_lock`.
+        None if the lock is held by others.
+    """
+    conn = SQLDB_DIRECT_ENGINE.connect().execution_options(isolation_level="AUTOCOMMIT")
+    try:
+        acquired = conn.execute(
+            sqlalchemy.text("SELECT pg_try_advisory_lock(hashtext(:name))"),
+            {"name": name},
+        ).scalar()
+    except Exception:
+        conn.close()
+        raise
+    if not acquired:
+        conn.close()
+        return None
+    return conn
+
+
+def _release_advisory_lock(conn: sqlalchemy.Connection, name: str):
+    """Release a lock taken by `_try_advisory_lock`, and give back its connection.
+
+    Closing alone keeps the lock, as the connection stays open in the pool.
+    """
+    try:
+        conn.execute(
+            sqlalchemy.text("SELECT pg_advisory_unlock(hashtext(:name))"),
+            {"name": name},
+        )
+    except Exception:
+        logger.warning("Failed to release lock %s, dropping its connection", name, exc_info=True)
+        conn.invalidate()
+    finally:
+        conn.close()
+
+
+@contextlib.contextmanager
+def distributed_lock(name: str) -> typing.Iterator[bool]:
+    """Hold a lock named `name` among all workers.
+
+    Always acquired when coordination is local.
+
+    :yields: Whether the lock is acquired.
+    """
+    if TASK_COORDINATION != 'postgres':
+        yield True
+        return
+
+    conn = _try_advisory_lock(name)
+    try:
+        yield conn is not None
+    finally:
+        if conn is not None:
+            _release_advisory_lock(conn, name)
+
+
+@contextlib.asynccontextmanager
+async def async_distributed_lock(name: str) -> typing.AsyncIterator[bool]:
+    """`distributed_lock` for the event loop, taken and released in threads.
+
+    :yields: Whether the lock is acquired.
+    """
+    if TASK_COORDINATION != 'postgres':
+        yield True
+        return
+
+    acquiring = asyncio.ensure_future(asyncio.to_thread(_try_advisory_lock, name))
+    try:
+        conn = await asyncio.shield(acquiring)
+    except asyncio.CancelledError:
+        # the thread may still take the lock, give it back then
+        acquiring.add_done_callback(lambda task: _release_taken_lock(task, name))
+        raise
+    try:
+        yield conn is not None
+    finally:
+        if conn is not None:
+            await asyncio.to_thread(_release_advisory_lock, conn, name)
+
+
+def _release_taken_lock(task: "asyncio.Future[Opt[sqlalchemy.Connection]]", name: str):
+    if task.cancelled() or task.exception() is not None or task.result() is None:
+        return
+    asyncio.get_running_loop().run_in_executor(None, _release_advisory_lock, task.result(), name)
+
+
+async def run_as_leader(func: typing.Callable[[], typing.Awaitable]):
+    """Run `func` in the leader only, e.g. to set up what all workers share.
+
+    Run at once if this worker is the leader or coordination is local,
+    otherwise whenever this worker becomes the leader.
+    """
+    _leader_funcs.append(func)
+    if TASK_COORDINATION != 'postgres' or _leader_conn is not None:
+        await func()
+
+
+async def _lead():
+    for func in _leader_funcs:
+        try:
+            await func()
+        except Exception:
+            logger.exception("Failed to run %s as the leader", func)
+
+
+async def _campaign():
+    """Keep trying to be the leader, who is the only one running scheduled jobs.
+
+    Other workers keep the scheduler paused, so they can still add jobs
+    to the shared job store.
+    """
+    global _leader_conn
+
+    while True:
+        try:
+            if _leader_conn is None:
+                _leader_conn = await asyncio.to_thread(_try_advisory_lock, _LEADER_LOCK)
+                if _leader_conn is not None:
+                    logger.info("Became scheduler leader")
+                    scheduler.resume()
+                    await _lead()
+            else:
+                await asyncio.to_thread(_leader_conn.execute, sqlalchemy.text("SELECT 1"))
+        except Exception:
+            logger.exception("Lost scheduler leadership")
+            scheduler.pause()
+            if _leader_conn is not None:
+                _leader_conn.invalidate()
+                _leader_conn = None
+        await asyncio.sleep(LEADER_CHECK_INTERVAL)
+
+
+async def start_scheduler():
+    global _campaign_task
+
+    if TASK_COORDINATION != 'postgres':
+        scheduler.start()
+        return
+
+    scheduler.start(paused=True)
+    _campaign_task = asyncio.create_task(_campaign())
+
+
+async def stop_scheduler():
+    global _campaign_task, _leader_conn
 
-scheduler = apscheduler.schedulers.asyncio.AsyncIOScheduler()
+    if _campaign_task is not None:
+        _campaign_task.cancel()
+        _campaign_task = None
+    _leader_funcs.clear()
+    scheduler.shutdown(wait=True)
+    if _leader_conn is not None:
+        _release_advisory_lock(_leader_conn, _LEADER_LOCK)
+        _leader_conn = None
@@ -0,0 +1,161 @@
+"""Circuit breakers of external providers.
+
+A breaker keeps outcomes of calls to its provider for `BREAKER_WINDOW`
+seconds. Once `BREAKER_MIN_CALLS` of them failed at `BREAKER_FAILURE_RATE`
+or more, it opens and calls fail fast with `CircuitOpen`. After
+`BREAKER_OPEN_SECONDS` it lets a probe call through, half-open, whose
+success closes it and whose failure opens it again.
+"""
+
+__all__ = [
+    "CircuitBreaker",
+    "CircuitOpen",
+]
+
+import collections
+import contextlib
+import logging
+import math
+import os
+import threading
+import time
+import typing
+import fastapi
+from .metrics import Counter, Gauge
+
+# configs
+WINDOW = float(os.getenv('BREAKER_WINDOW', '60'))
+MIN_CALLS = int(os.getenv('BREAKER_MIN_CALLS', '10'))
+"""Calls needed in the window before the failure rate is trusted.
+"""
+FAILURE_RATE = float(os.getenv('BREAKER_FAILURE_RATE', '0.5'))
+OPEN_SECONDS = float(os.getenv('BREAKER_OPEN_SECONDS', '30'))
+"""How long an opened breaker fails calls fast before probing.
+"""
+
+logger = logging.getLogger(__name__)
+
+BREAKER_STATE = Gauge(
+    "inkcre_circuit_breaker_state", "State of breakers by provider, 0 closed, 1 half open, 2 open."
+)
+BREAKER_REJECTED = Counter(
+    "inkcre_circuit_breaker_rejected_total", "Calls failed fast by open breakers by provider."
+)
+
+State = typing.Literal["closed", "half_open", "open"]
+_STATE_VALUES: dict[State, int] = {"closed": 0, "half_open": 1, "open": 2}
+
+
+class CircuitOpen(fastapi.HTTPException):
+    """The provider is seen as down, retry in `retry_in` seconds.
+    """
+
+    def __init__(self, provider: str, retry_in: float):
+        self.provider = provider
+        self.retry_in = retry_in
+        super().__init__(
+            status_code=503,
+            detail=f"{provider} is unavailable, try again later.",
+            headers={"Retry-After": str(math.ceil(retry_in))},
+        )
+
+
+class CircuitBreaker:
+
+    def __init__(
+        self,
+        provider: str,
+        is_failure: typing.Callable[[Exception], bool] = lambda e: True,
+    ):
+        """
+        :param is_failure: Whether an error is of the provider, e.g. not a bad request.
+        """
+        self.provider = provider
+        self._is_failure = is_failure
+        self._lock = threading.Lock()
+        self._outcomes: collections.deque[tuple[float, bool]] = collections.deque()
+        """(time, failed) of calls in the window.
+        """
+        self._state: State = "closed"
+        self._opened_at = 0.0
+        self._probing = False
+        BREAKER_STATE.set(0, provider=provider)
+
+    @property
+    def state(self) -> State:
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self) -> State:
+        if self._state == "open" and time.monotonic() - self._opened_at >= OPEN_SECONDS:
+            self._set_state("half_open")
+        return self._state
+
+    def _set_state(self, state: State):
+        if state != self._state:
+            logger.warning("Circuit breaker of %s is %s", self.provider, state)
+        self._state = state
+        BREAKER_STATE.set(_STATE_VALUES[state], provider=self.provider)
+
+    def _before(self) -> bool:
+        """
+        :returns: Whether the call is a probe of the half open breaker.
+        :raise CircuitOpen:
+        """
+        with self._lock:
+            state = self._current_state()
+            if state == "closed":
+                return False
+            if state == "half_open" and not self._probing:
+                self._probing = True
+                return True
+            retry_in = OPEN_SECONDS - (time.monotonic() - self._opened_at) if state == "open" else 1.0
+        BREAKER_REJECTED.inc(provider=self.provider)
+        raise CircuitOpen(self.provider, max(retry_in, 1.0))
+
+    def _after(self, probe: bool, failed: bool):
+        now = time.monotonic()
+        with self._lock:
+            if probe:
+                self._probing = False
+                self._outcomes.clear()
+                if failed:
+                    self._opened_at = now
+                    self._set_state("open")
+                else:
+                    self._set_state("closed")
+                return
+            if self._state != "closed":
+                return
+
+            self._outcomes.append((now, failed))
+            while self._outcomes and self._outcomes[0][0] < now - WINDOW:
+                self._outcomes.popleft()
+            failures = sum(failed for _, failed in self._outcomes)
+            if (
+                len(self._outcomes) >= MIN_CALLS
+                and failures / len(self._outcomes) >= FAILURE_RATE
+            ):
+                self._opened_at = now
+                self._set_state("open")
+
+    @contextlib.contextmanager
+    def call(self) -> typing.Iterator[None]:
+        """Guard a call to the provider, works around awaits as well.
+
+        :raise CircuitOpen: If the breaker is open.
+        """
+        probe = self._before()
+        try:
+            yield
+        except Exception as e:
+            self._after(probe, failed=self._is_failure(e))
+            raise
+        except BaseException:
+            # cancelled, tells nothing about the provider
+            if probe:
+                with self._lock:
+                    self._probing = False
+            raise
+        else:
+            self._after(probe, failed=False)
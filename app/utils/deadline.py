@@ -0,0 +1,134 @@
+"""Deadlines of requests, and cancellation of requests abandoned by clients.
+
+An endpoint taking `fastapi.Depends(deadline(seconds))` gets a cancellation
+token, current in its context. Its work calls `check()` between steps, e.g.
+hops and LLM calls, SQL is limited by a `statement_timeout` of what remains,
+and the request is cancelled once its client disconnects or the deadline
+passes, so its capacity goes back to live requests.
+"""
+
+__all__ = [
+    "CancellationToken",
+    "DeadlineExceeded",
+    "RequestCancelled",
+    "check",
+    "current",
+    "deadline",
+    "remaining",
+]
+
+import asyncio
+import contextvars
+import os
+import time
+import typing
+from typing import Optional as Opt
+import fastapi
+
+# configs
+DISCONNECT_POLL_INTERVAL = float(os.getenv('DISCONNECT_POLL_INTERVAL', '0.5'))
+"""Seconds between checks whether the client of a request is gone.
+"""
+
+
+class DeadlineExceeded(fastapi.HTTPException):
+
+    def __init__(self):
+        super().__init__(status_code=504, detail="Deadline of the request exceeded.")
+
+
+class RequestCancelled(fastapi.HTTPException):
+
+    def __init__(self):
+        # nginx's code for a client closed request, seen by logs only
+        super().__init__(status_code=499, detail="Client closed the request.")
+
+
+class CancellationToken:
+
+    def __init__(self, seconds: float):
+        self.expires_at = time.monotonic() + seconds
+        self.disconnected = False
+
+    def remaining(self) -> float:
+        return self.expires_at - time.monotonic()
+
+    def expired(self) -> bool:
+        return self.disconnected or self.remaining() <= 0
+
+    def error(self) -> fastapi.HTTPException:
+        return RequestCancelled() if self.disconnected else DeadlineExceeded()
+
+    def check(self):
+        """
+        :raise DeadlineExceeded:
+        :raise RequestCancelled: If the client disconnected.
+        """
+        if self.expired():
+            raise self.error()
+
+
+_current: contextvars.ContextVar[Opt[CancellationToken]] = contextvars.ContextVar(
+    "cancellation_token", default=None
+)
+
+
+def current() -> Opt[CancellationToken]:
+    return _current.get()
+
+
+def check():
+    """Stop the work if its request is abandoned, no-op out of a request with a deadline.
+    """
+    token = _current.get()
+    if token is not None:
+        token.check()
+
+
+def remaining() -> Opt[float]:
+    """Seconds left to the deadline of the current request, None if there is no deadline.
+    """
+    token = _current.get()
+    return token.remaining() if token is not None else None
+
+
+def deadline(seconds: float) -> typing.Callable[..., typing.AsyncIterator[CancellationToken]]:
+    """A fastapi dependency giving the request `seconds`.
+
+    Not for endpoints reading the body themselves, as watching the client
+    receives its messages.
+    """
+
+    async def dependency(request: fastapi.Request) -> typing.AsyncIterator[CancellationToken]:
+        token = CancellationToken(seconds)
+        context_token = _current.set(token)
+        task = typing.cast(asyncio.Task, asyncio.current_task())
+        watcher = asyncio.create_task(_watch(request, token, task))
+        try:
+            yield token
+        except asyncio.CancelledError:
+            if not token.expired():
+                raise
+            task.uncancel()
+            raise token.error() from None
+        except Exception as exc:
+            # e.g. statement_timeout or a timed out LLM call
+            if isinstance(exc, fastapi.HTTPException) or not token.expired():
+                raise
+            raise token.error() from exc
+        finally:
+            watcher.cancel()
+            _current.reset(context_token)
+
+    return dependency
+
+
+async def _watch(request: fastapi.Request, token: CancellationToken, task: asyncio.Task):
+    while True:
+        await asyncio.sleep(max(0.0, min(DISCONNECT_POLL_INTERVAL, token.remaining())))
+        if token.remaining() <= 0:
+            break
+        if await request.is_disconnected():
+            token.disconnected = True
+            break
+    task.cancel()
@@ -0,0 +1,87 @@
+"""Image preprocessing.
+
+Functions here are CPU-bound and picklable, meant to run in a process pool.
+"""
+
+__all__ = [
+    "PreprocessedImage",
+    "preprocess_image",
+    "perceptual_hash",
+]
+
+import io
+import typing
+import numpy
+
+
+class PreprocessedImage(typing.NamedTuple):
+    data: bytes
+    """Re-encoded image.
+    """
+    mime_type: str
+    width: int
+    height: int
+    phash: str
+    """Perceptual hash in 16 hex digits.
+    """
+
+
+def _dct_matrix(size: int) -> numpy.ndarray:
+    k = numpy.arange(size)
+    matrix = numpy.cos(numpy.pi * (2 * k[None, :] + 1) * k[:, None] / (2 * size))
+    matrix[0] /= numpy.sqrt(2)
+    return matrix * numpy.sqrt(2 / size)
+
+
+def perceptual_hash(image) -> str:
+    """DCT based perceptual hash of a `PIL.Image.Image`.
+
+    Images look the same get the same or a close hash, despite
+    of resizing and re-encoding.
+    """
+    from PIL import Image
+
+    pixels = numpy.asarray(
+        image.convert("L").resize((32, 32), Image.Resampling.LANCZOS), dtype=numpy.float64
+    )
+    dct = _dct_matrix(32)
+    low = (dct @ pixels @ dct.T)[:8, :8].flatten()
+    # DC term is excluded from the median, as it is the average brightness
+    bits = low > numpy.median(low[1:])
+    return f"{int(''.join('1' if bit else '0' for bit in bits), 2):016x}"
+
+
+def preprocess_image(raw: bytes, max_edge: int = 1024, quality: int = 85) -> PreprocessedImage:
+    """Decode the image, downscale it to `max_edge` and re-encode it.
+
+    Images with transparency are encoded to PNG, otherwise JPEG.
+
+    :param max_edge: Max length in pixels of the longer edge.
+    :param quality: JPEG quality.
+    :raise PIL.UnidentifiedImageError: If not an image.
+    """
+    from PIL import Image, ImageOps
+
+    with Image.open(io.BytesIO(raw)) as image:
+        image = ImageOps.exif_transpose(image)
+        phash = perceptual_hash(image)
+        image.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+
+        buffer = io.BytesIO()
+        has_alpha = image.mode in ("RGBA", "LA") or (
+            image.mode == "P" and "transparency" in image.info
+        )
+        if has_alpha:
+            image.save(buffer, format="PNG", optimize=True)
+            mime_type = "image/png"
+        else:
+            image.convert("RGB").save(buffer, format="JPEG", quality=quality, optimize=True)
+            mime_type = "image/jpeg"
+
+        return PreprocessedImage(
+            data=buffer.getvalue(),
+            mime_type=mime_type,
+            width=image.width,
+            height=image.height,
+            phash=phash,
+        )
@@ -0,0 +1,167 @@
+"""Detection of blocking calls on the event loop.
+
+Set `LOOP_LAG_MONITOR=1` to watch the loop of the app. A heartbeat
+coroutine measures how late the loop wakes it, and a watchdog thread
+takes the stack of the loop thread once a heartbeat is later than
+`LOOP_LAG_THRESHOLD`, which is where the loop is held.
+"""
+
+__all__ = [
+    "LOOP_LAG_MONITOR",
+    "LoopBlock",
+    "LoopLagMonitor",
+]
+
+import asyncio
+import collections
+import dataclasses
+import datetime
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+import typing
+from typing import Optional as Opt
+import numpy
+from .metrics import Counter, Histogram
+
+# configs
+LOOP_LAG_MONITOR = os.getenv('LOOP_LAG_MONITOR', '') == '1'
+INTERVAL = float(os.getenv('LOOP_LAG_INTERVAL', '0.25'))
+"""Seconds between heartbeats.
+"""
+THRESHOLD = float(os.getenv('LOOP_LAG_THRESHOLD', '0.1'))
+"""Seconds a heartbeat may be late before the loop is seen as blocked.
+"""
+MAX_BLOCKS = int(os.getenv('LOOP_LAG_MAX_BLOCKS', '50'))
+"""Recent blocks kept with their stacks.
+"""
+
+logger = logging.getLogger(__name__)
+
+LOOP_LAG = Histogram(
+    "inkcre_event_loop_lag_seconds", "Delay of event loop heartbeats.",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+LOOP_BLOCKS = Counter(
+    "inkcre_event_loop_blocks_total", "Times the event loop was held beyond the threshold."
+)
+
+
+@dataclasses.dataclass
+class LoopBlock:
+    started_at: datetime.datetime
+    seconds: float
+    """How long the loop was held, updated until it is released.
+    """
+    stack: list[str]
+    """Stack of the loop thread when seen blocked, innermost last.
+    """
+    released: bool = False
+
+
+class LoopLagMonitor:
+
+    _heartbeat: Opt[asyncio.Task] = None
+    _watchdog: Opt[threading.Thread] = None
+    _stopped = threading.Event()
+    _loop_thread_id: Opt[int] = None
+    _expected_at: float = 0.0
+    """When the next heartbeat is due, in `time.monotonic()`.
+    """
+    _current: Opt[LoopBlock] = None
+    _lags: collections.deque[float] = collections.deque(maxlen=1000)
+    blocks: collections.deque[LoopBlock] = collections.deque(maxlen=MAX_BLOCKS)
+    _blocks_lock = threading.Lock()
+    """Guards `blocks`, `_current` and `_expected_at`, shared with the watchdog.
+    """
+
+    @classmethod
+    def start(cls):
+        """Watch the running loop.
+        """
+        if cls._heartbeat is not None:
+            return
+        cls._loop_thread_id = threading.get_ident()
+        cls._expected_at = time.monotonic() + INTERVAL
+        cls._stopped.clear()
+        cls._heartbeat = asyncio.create_task(cls._beat())
+        cls._watchdog = threading.Thread(target=cls._watch, name="loop-lag-watchdog", daemon=True)
+        cls._watchdog.start()
+
+    @classmethod
+    async def stop(cls):
+        cls._stopped.set()
+        if cls._heartbeat is not None:
+            cls._heartbeat.cancel()
+            cls._heartbeat = None
+        cls._watchdog = None
+
+    @classmethod
+    async def _beat(cls):
+        while True:
+            await asyncio.sleep(INTERVAL)
+            with cls._blocks_lock:
+                now = time.monotonic()
+                lag = max(0.0, now - cls._expected_at)
+                # due again before the block is let go, or the watchdog takes
+                # the old due time for a new block
+                cls._expected_at = now + INTERVAL
+                block = cls._current
+                cls._current = None
+            cls._lags.append(lag)
+            LOOP_LAG.observe(lag)
+
+            if block is not None:
+                block.seconds = lag
+                block.released = True
+                logger.warning(
+                    "Event loop was blocked for %.3fs at:\n%s", lag, "".join(block.stack)
+                )
+
+    @classmethod
+    def _watch(cls):
+        while not cls._stopped.wait(min(INTERVAL, THRESHOLD) / 2):
+            with cls._blocks_lock:
+                late = time.monotonic() - cls._expected_at
+                if late < THRESHOLD:
+                    continue
+                block = cls._current
+                if block is not None:
+                    block.seconds = late
+                    continue
+
+                frame = sys._current_frames().get(typing.cast(int, cls._loop_thread_id))
+                if frame is None:
+                    continue
+                cls._current = LoopBlock(
+                    started_at=datetime.datetime.now(datetime.timezone.utc)
+                    - datetime.timedelta(seconds=late),
+                    seconds=late,
+                    stack=traceback.format_stack(frame),
+                )
+                cls.blocks.append(cls._current)
+            LOOP_BLOCKS.inc()
+
+    @classmethod
+    def report(cls) -> dict:
+        """Lag percentiles of recent heartbeats and recent blocks, latest first.
+        """
+        lags = list(cls._lags)
+        with cls._blocks_lock:
+            blocks = list(cls.blocks)
+        blocks.reverse()
+        return {
+            "enabled": cls._heartbeat is not None,
+            "interval": INTERVAL,
+            "threshold": THRESHOLD,
+            "lag": {
+                "samples": len(lags),
+                "p50": float(numpy.percentile(lags, 50)) if lags else None,
+                "p99": float(numpy.percentile(lags, 99)) if lags else None,
+                "max": max(lags, default=None),
+            },
+            "blocks": blocks,
+        }
@@ -0,0 +1,119 @@
+"""Minimal Prometheus-style metrics.
+
+Metrics are kept in process and rendered in the text exposition format,
+so no extra dependency nor agent is needed to scrape them.
+"""
+
+__all__ = [
+    "Counter",
+    "Gauge",
+    "Histogram",
+    "render",
+]
+
+import math
+import threading
+import typing
+
+
+LabelsT: typing.TypeAlias = tuple[tuple[str, str], ...]
+
+REGISTRY: list["_Metric"] = []
+_LOCK = threading.Lock()
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(labels: LabelsT, **extra: str) -> str:
+    pairs = (*labels, *extra.items())
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+class _Metric:
+    type_: str
+
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self._values: dict[LabelsT, typing.Any] = {}
+        REGISTRY.append(self)
+
+    @staticmethod
+    def _key(labels: dict[str, typing.Any]) -> LabelsT:
+        return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def _samples(self) -> typing.Iterator[str]:
+        for labels, value in self._values.items():
+            yield f"{self.name}{_format_labels(labels)} {value}"
+
+    def render(self) -> str:
+        return "\n".join((
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type_}",
+            *self._samples(),
+        ))
+
+
+class Counter(_Metric):
+    type_ = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with _LOCK:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    type_ = "gauge"
+
+    def set(self, value: float, **labels):
+        with _LOCK:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with _LOCK:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    type_ = "histogram"
+
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+    def __init__(
+        self, name: str, documentation: str,
+        buckets: typing.Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation)
+        self.buckets = (*sorted(buckets), math.inf)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with _LOCK:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value)
+
+    def _samples(self) -> typing.Iterator[str]:
+        for labels, (counts, total) in self._values.items():
+            for bound, count in zip(self.buckets, counts):
+                le = "+Inf" if bound == math.inf else repr(bound)
+                yield f"{self.name}_bucket{_format_labels(labels, le=le)} {count}"
+            yield f"{self.name}_sum{_format_labels(labels)} {total}"
+            yield f"{self.name}_count{_format_labels(labels)} {counts[-1]}"
+
+
+def render() -> str:
+    """Render all metrics in Prometheus text exposition format.
+    """
+    with _LOCK:
+        return "\n".join(metric.render() for metric in REGISTRY) + "\n"
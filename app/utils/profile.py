@@ -0,0 +1,126 @@
+"""Startup profiling.
+
+Set `STARTUP_PROFILE=1` to log how long startup steps and imports of
+each module take. Nothing is hooked when disabled.
+"""
+
+__all__ = [
+    "STARTUP_PROFILE",
+    "StartupProfile",
+]
+
+import contextlib
+import importlib.abc
+import logging
+import os
+import sys
+import threading
+import time
+import typing
+
+
+logger = logging.getLogger(__name__)
+
+
+class _ImportTimer(importlib.abc.MetaPathFinder):
+    """Time execution of each module imported after installed.
+    """
+
+    def __init__(self):
+        self.cumulative: dict[str, float] = {}
+        self.self_: dict[str, float] = {}
+        self._local = threading.local()
+
+    def find_spec(self, fullname, path, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, "find_spec"):
+                continue
+            spec = finder.find_spec(fullname, path, target)
+            if spec is not None:
+                break
+        else:
+            return None
+
+        loader = spec.loader
+        # builtin and frozen loaders are classes shared by modules
+        if loader is None or isinstance(loader, type) or not hasattr(loader, "exec_module"):
+            return spec
+
+        exec_module = loader.exec_module
+        timer = self
+
+        def timed_exec_module(module):
+            # time of children imports, per thread as extensions import in threads
+            stack: list[float] = timer._local.__dict__.setdefault("stack", [])
+            stack.append(0.0)
+            started_at = time.perf_counter()
+            try:
+                exec_module(module)
+            finally:
+                elapsed = time.perf_counter() - started_at
+                children = stack.pop()
+                if stack:
+                    stack[-1] += elapsed
+                timer.cumulative[fullname] = elapsed
+                timer.self_[fullname] = elapsed - children
+
+        loader.exec_module = timed_exec_module  # type: ignore[method-assign]
+        return spec
+
+
+class StartupProfile:
+
+    def __init__(self, enabled: bool):
+        self.enabled = enabled
+        self.spans: list[tuple[str, float]] = []
+        self._import_timer: typing.Optional[_ImportTimer] = None
+        self._started_at = time.perf_counter()
+
+    def install(self):
+        """Start timing imports.
+        """
+        if self.enabled and self._import_timer is None:
+            self._import_timer = _ImportTimer()
+            sys.meta_path.insert(0, self._import_timer)
+
+    @contextlib.contextmanager
+    def span(self, name: str) -> typing.Iterator[None]:
+        """Time a startup step.
+        """
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started_at
+            self.spans.append((name, elapsed))
+            logger.debug("%s took %.3fs", name, elapsed)
+
+    def report(self, top: int = 20) -> str:
+        """Stop timing imports and log the report.
+
+        :param top: Number of slowest modules to list.
+        """
+        if not self.enabled:
+            return ""
+
+        lines = [f"startup took {time.perf_counter() - self._started_at:.3f}s"]
+        lines.extend(f"  {name}: {elapsed:.3f}s" for name, elapsed in self.spans)
+
+        if self._import_timer is not None:
+            sys.meta_path.remove(self._import_timer)
+            lines.append(f"slowest {top} imports (cumulative / self):")
+            lines.extend(
+                f"  {name}: {elapsed:.3f}s / {self._import_timer.self_[name]:.3f}s"
+                for name, elapsed in sorted(
+                    self._import_timer.cumulative.items(),
+                    key=lambda item: item[1], reverse=True,
+                )[:top]
+            )
+            self._import_timer = None
+
+        report = "\n".join(lines)
+        logger.info("Startup profile:\n%s", report)
+        return report
+
+
+STARTUP_PROFILE = StartupProfile(enabled=os.getenv("STARTUP_PROFILE", "") == "1")
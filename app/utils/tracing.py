@@ -0,0 +1,412 @@
+"""Tracing of requests and background work.
+
+Set `TRACING_EXPORT` to an OTLP/HTTP traces endpoint, e.g.
+`http://localhost:4318/v1/traces`, or to a file path to append spans to
+in OTLP JSON, one export request a line. When unset, nothing is hooked
+and `span` returns a shared no-op.
+
+Spans of a category (`db`, `http`, `llm`, `workflow`) add up per request
+in its `Server-Timing` header. Categories may nest, e.g. queries made
+while a workflow runs count to both.
+"""
+
+__all__ = [
+    "TRACING_EXPORT",
+    "ENABLED",
+    "AIOHTTP_TRACE_CONFIGS",
+    "Span",
+    "span",
+    "traced",
+    "instrument_engine",
+    "TracingMiddleware",
+]
+
+import atexit
+import contextlib
+import contextvars
+import functools
+import inspect
+import json
+import logging
+import os
+import re
+import secrets
+import threading
+import time
+import typing
+import urllib.request
+from typing import Optional as Opt
+
+# configs
+TRACING_EXPORT = os.getenv("TRACING_EXPORT", "")
+SERVICE_NAME = os.getenv("TRACING_SERVICE_NAME", "inkcre-core")
+FLUSH_INTERVAL = float(os.getenv("TRACING_FLUSH_INTERVAL", "5"))
+"""Seconds between exports of ended spans.
+"""
+MAX_QUEUE_SIZE = int(os.getenv("TRACING_MAX_QUEUE_SIZE", "8192"))
+"""Ended spans kept until exported, more are dropped.
+"""
+
+ENABLED = bool(TRACING_EXPORT)
+
+SpanKind: typing.TypeAlias = typing.Literal["internal", "server", "client"]
+_OTLP_KINDS = {"internal": 1, "server": 2, "client": 3}
+_TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$")
+_MAX_STATEMENT_LENGTH = 1000
+
+logger = logging.getLogger(__name__)
+
+
+class _Timings:
+    """Time spent by category in one request, shared by threads it runs in.
+    """
+
+    def __init__(self):
+        self._totals: dict[str, list[float]] = {}
+        self._lock = threading.Lock()
+
+    def add(self, category: str, seconds: float):
+        with self._lock:
+            total = self._totals.setdefault(category, [0.0, 0])
+            total[0] += seconds
+            total[1] += 1
+
+    def header(self, trace_id: str, total_seconds: float) -> str:
+        with self._lock:
+            entries = [
+                f'{category};dur={seconds * 1000:.1f};desc="{count} spans"'
+                for category, (seconds, count) in sorted(self._totals.items())
+            ]
+        entries.append(f"total;dur={total_seconds * 1000:.1f}")
+        entries.append(f'trace;desc="{trace_id}"')
+        return ", ".join(entries)
+
+
+_current_span: contextvars.ContextVar[Opt["Span"]] = contextvars.ContextVar(
+    "tracing_current_span", default=None
+)
+_current_timings: contextvars.ContextVar[Opt[_Timings]] = contextvars.ContextVar(
+    "tracing_current_timings", default=None
+)
+
+
+class Span:
+
+    __slots__ = (
+        "name", "category", "kind", "trace_id", "span_id", "parent_id",
+        "attributes", "started_at", "ended_at", "error", "_timings",
+    )
+
+    def __init__(
+        self,
+        name: str,
+        category: Opt[str] = None,
+        kind: SpanKind = "internal",
+        parent: Opt["Span"] = None,
+        attributes: Opt[dict[str, typing.Any]] = None,
+        trace_id: Opt[str] = None,
+        parent_id: Opt[str] = None,
+    ):
+        """Start a span, a child of `parent` if given.
+
+        :param trace_id: Of a trace continued from another service.
+        """
+        self.name = name
+        self.category = category
+        self.kind = kind
+        self.trace_id = parent.trace_id if parent else (trace_id or secrets.token_hex(16))
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent.span_id if parent else parent_id
+        self.attributes = attributes or {}
+        self.started_at = time.time_ns()
+        self.ended_at: Opt[int] = None
+        self.error: Opt[BaseException] = None
+        self._timings = _current_timings.get()
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def end(self, error: Opt[BaseException] = None):
+        if self.ended_at is not None:
+            return
+        self.ended_at = time.time_ns()
+        self.error = error
+        if self.category and self._timings is not None:
+            self._timings.add(self.category, (self.ended_at - self.started_at) / 1e9)
+        _EXPORTER.add(self)
+
+    def to_otlp(self) -> dict:
+        encoded: dict[str, typing.Any] = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": _OTLP_KINDS[self.kind],
+            "startTimeUnixNano": str(self.started_at),
+            "endTimeUnixNano": str(self.ended_at),
+            "attributes": _otlp_attributes({
+                **self.attributes, **({"category": self.category} if self.category else {}),
+            }),
+        }
+        if self.parent_id:
+            encoded["parentSpanId"] = self.parent_id
+        if self.error is not None:
+            encoded["status"] = {"code": 2, "message": f"{type(self.error).__name__}: {self.error}"}
+        return encoded
+
+
+class _NoopSpan:
+
+    def set(self, **attributes):
+        pass
+
+
+_NOOP = contextlib.nullcontext(_NoopSpan())
+
+
+def _otlp_value(value: typing.Any) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_attributes(attributes: dict[str, typing.Any]) -> list[dict]:
+    return [{"key": key, "value": _otlp_value(value)} for key, value in attributes.items()]
+
+
+def _otlp_request(spans: typing.Sequence[Span]) -> dict:
+    """An OTLP `ExportTraceServiceRequest` in JSON.
+    """
+    return {"resourceSpans": [{
+        "resource": {"attributes": _otlp_attributes({"service.name": SERVICE_NAME})},
+        "scopeSpans": [{
+            "scope": {"name": __name__},
+            "spans": [span.to_otlp() for span in spans],
+        }],
+    }]}
+
+
+class _Exporter:
+    """Export ended spans in batches from a daemon thread.
+    """
+
+    def __init__(self, target: str):
+        self.target = target
+        self.dropped = 0
+        self._spans: list[Span] = []
+        self._lock = threading.Lock()
+        self._thread: Opt[threading.Thread] = None
+
+    def add(self, span: Span):
+        with self._lock:
+            if len(self._spans) >= MAX_QUEUE_SIZE:
+                self.dropped += 1
+                return
+            self._spans.append(span)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="tracing-export", daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            time.sleep(FLUSH_INTERVAL)
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            spans, self._spans = self._spans, []
+        if not spans:
+            return
+        body = json.dumps(_otlp_request(spans), separators=(",", ":"))
+        try:
+            if self.target.startswith(("http://", "https://")):
+                request = urllib.request.Request(
+                    self.target, data=body.encode("utf-8"),
+                    headers={"Content-Type": "application/json"}, method="POST",
+                )
+                with urllib.request.urlopen(request, timeout=10):
+                    pass
+            else:
+                with open(self.target, "a", encoding="utf-8") as f:
+                    f.write(body + "\n")
+        except Exception:
+            logger.warning("Failed to export %d spans", len(spans), exc_info=True)
+
+
+_EXPORTER = _Exporter(TRACING_EXPORT)
+
+
+@contextlib.contextmanager
+def _span(
+    name: str, category: Opt[str], kind: SpanKind, attributes: dict[str, typing.Any]
+) -> typing.Iterator[Span]:
+    span_ = Span(name, category, kind, _current_span.get(), attributes)
+    token = _current_span.set(span_)
+    try:
+        yield span_
+    except BaseException as e:
+        span_.end(e)
+        raise
+    finally:
+        _current_span.reset(token)
+        span_.end()
+
+
+def span(
+    name: str, category: Opt[str] = None, kind: SpanKind = "internal", **attributes
+) -> typing.ContextManager[Span | _NoopSpan]:
+    """Trace the block as a child of the current span, or as a new trace.
+
+    :param category: To add up in `Server-Timing` of the request.
+    """
+    if not ENABLED:
+        return _NOOP
+    return _span(name, category, kind, attributes)
+
+
+def traced(name: str, category: Opt[str] = None):
+    """Trace every call of the function, sync or async.
+
+    Returns the function as is if tracing is disabled.
+    """
+    def decorator(func):
+        if not ENABLED:
+            return func
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with _span(name, category, "internal", {}):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with _span(name, category, "internal", {}):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _child_span(name: str, category: str, attributes: dict[str, typing.Any]) -> Opt[Span]:
+    """Start a client span only within a trace, so polling queries start no trace.
+    """
+    parent = _current_span.get()
+    if parent is None:
+        return None
+    return Span(name, category, "client", parent, attributes)
+
+
+def instrument_engine(engine):
+    """Trace statements executed by the SQLAlchemy engine.
+    """
+    if not ENABLED:
+        return
+    import sqlalchemy.event
+
+    @sqlalchemy.event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context._tracing_span = _child_span("db.query", "db", {
+                "db.system": "postgresql",
+                "db.statement": statement[:_MAX_STATEMENT_LENGTH],
+            })
+
+    @sqlalchemy.event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        span_ = getattr(context, "_tracing_span", None)
+        if span_ is not None:
+            span_.set(**{"db.rows": cursor.rowcount})
+            span_.end()
+
+    @sqlalchemy.event.listens_for(engine, "handle_error")
+    def handle_error(exception_context):
+        span_ = getattr(exception_context.execution_context, "_tracing_span", None)
+        if span_ is not None:
+            span_.end(exception_context.original_exception)
+
+
+def _aiohttp_trace_configs() -> list:
+    if not ENABLED:
+        return []
+    import aiohttp
+
+    async def on_request_start(session, context, params):
+        context.span = _child_span(f"HTTP {params.method}", "http", {
+            "http.method": params.method,
+            "http.url": str(params.url.with_query(None)),
+        })
+
+    async def on_request_end(session, context, params):
+        if context.span is not None:
+            context.span.set(**{"http.status_code": params.response.status})
+            context.span.end()
+
+    async def on_request_exception(session, context, params):
+        if context.span is not None:
+            context.span.end(params.exception)
+
+    config = aiohttp.TraceConfig()
+    config.on_request_start.append(on_request_start)
+    config.on_request_end.append(on_request_end)
+    config.on_request_exception.append(on_request_exception)
+    return [config]
+
+
+AIOHTTP_TRACE_CONFIGS = _aiohttp_trace_configs()
+"""Pass as `trace_configs` of `aiohttp.ClientSession` to trace its requests.
+"""
+
+
+class TracingMiddleware:
+    """Trace each HTTP request and report its breakdown in `Server-Timing`.
+
+    A `traceparent` header of the request continues its trace.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        headers = dict(scope.get("headers") or ())
+        match = _TRACEPARENT.match(headers.get(b"traceparent", b"").decode("latin-1"))
+        timings = _Timings()
+        timings_token = _current_timings.set(timings)
+        root = Span(
+            f"{scope['method']} {scope['path']}", kind="server",
+            attributes={"http.method": scope["method"], "url.path": scope["path"]},
+            trace_id=match.group(1) if match else None,
+            parent_id=match.group(2) if match else None,
+        )
+        span_token = _current_span.set(root)
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                route = getattr(scope.get("route"), "path", None)
+                if route:
+                    root.name = f"{scope['method']} {route}"
+                    root.set(**{"http.route": route})
+                root.set(**{"http.status_code": message["status"]})
+                message["headers"] = [
+                    *message.get("headers", ()),
+                    (b"server-timing", timings.header(
+                        root.trace_id, (time.time_ns() - root.started_at) / 1e9
+                    ).encode("latin-1")),
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        except BaseException as e:
+            root.end(e)
+            raise
+        finally:
+            _current_span.reset(span_token)
+            _current_timings.reset(timings_token)
+            root.end()
@@ -0,0 +1,255 @@
+"""In-process stand-ins of the OpenAI, Tencent LKE and X APIs.
+
+All fakes are served by one aiohttp server in a thread of its own,
+as the LKE SDK calls are blocking and made from the event loop of the app.
+Each service has its own `Behaviour` of latency, rate limit and failures.
+"""
+
+import asyncio
+import dataclasses
+import itertools
+import json
+import random
+import re
+import threading
+import time
+import uuid
+import aiohttp.web
+from typing import Optional as Opt
+from . import synthetic
+
+SERVICES = ("openai", "lke", "x")
+
+
+@dataclasses.dataclass
+class Behaviour:
+    latency: float = 0.0
+    """Seconds added to every response.
+    """
+    jitter: float = 0.0
+    """Max seconds added to latency at random.
+    """
+    failure_rate: float = 0.0
+    """Share of requests failed with a server error.
+    """
+    rate_limit: Opt[float] = None
+    """Requests a second allowed, with a burst of one second.
+    """
+    workflow_seconds: float = 0.0
+    """Seconds an LKE workflow run takes to finish.
+    """
+    _allowance: float = dataclasses.field(default=0.0, init=False, repr=False)
+    _checked_at: float = dataclasses.field(default_factory=time.monotonic, init=False, repr=False)
+
+    def take(self) -> bool:
+        """Whether a request is within the rate limit, by token bucket.
+        """
+        if self.rate_limit is None:
+            return True
+        now = time.monotonic()
+        self._allowance = min(
+            self.rate_limit, self._allowance + (now - self._checked_at) * self.rate_limit
+        )
+        self._checked_at = now
+        if self._allowance < 1:
+            return False
+        self._allowance -= 1
+        return True
+
+
+class FakeServices:
+    """Start with `with FakeServices(...) as fakes:`, then point the app to `fakes.url(...)`.
+    """
+
+    def __init__(self, behaviours: dict[str, Behaviour], seed: int = 0):
+        self.behaviours = {service: behaviours.get(service, Behaviour()) for service in SERVICES}
+        self.requests = dict.fromkeys(SERVICES, 0)
+        self.rejected = dict.fromkeys(SERVICES, 0)
+        self._random = random.Random(seed)
+        self._tweet_ids = itertools.count(1_900_000_000_000_000_000)
+        self._workflow_runs: dict[str, float] = {}
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._runner: Opt[aiohttp.web.AppRunner] = None
+        self.port = 0
+
+    def url(self, service: str) -> str:
+        return {
+            "openai": f"http://127.0.0.1:{self.port}/openai/v1",
+            "lke": f"http://127.0.0.1:{self.port}",
+            "x": f"http://127.0.0.1:{self.port}/x/2",
+        }[service]
+
+    def __enter__(self) -> "FakeServices":
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(self._start(), self._loop).result()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._runner is not None:
+            asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+    async def _start(self):
+        app = aiohttp.web.Application(middlewares=[self._behave])
+        app.add_routes([
+            aiohttp.web.post("/openai/v1/embeddings", self._embeddings),
+            aiohttp.web.post("/openai/v1/chat/completions", self._chat_completions),
+            aiohttp.web.post("/", self._lke),
+            aiohttp.web.post("/x/2/oauth2/token", self._x_token),
+            aiohttp.web.get("/x/2/users/me", self._x_me),
+            aiohttp.web.get("/x/2/users/{id}/bookmarks", self._x_bookmarks),
+            aiohttp.web.get("/x/2/tweets/search/recent", self._x_search),
+        ])
+        self._runner = aiohttp.web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = aiohttp.web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]  # type: ignore[union-attr]
+
+    @aiohttp.web.middleware
+    async def _behave(self, request: aiohttp.web.Request, handler):
+        service = "openai" if request.path.startswith("/openai") else (
+            "x" if request.path.startswith("/x") else "lke"
+        )
+        behaviour = self.behaviours[service]
+        self.requests[service] += 1
+        await asyncio.sleep(behaviour.latency + self._random.uniform(0, behaviour.jitter))
+
+        if not behaviour.take():
+            self.rejected[service] += 1
+            return self._error(service, 429, "RequestLimitExceeded")
+        if self._random.random() < behaviour.failure_rate:
+            self.rejected[service] += 1
+            return self._error(service, 500, "InternalError")
+        return await handler(request)
+
+    @staticmethod
+    def _error(service: str, status: int, code: str) -> aiohttp.web.Response:
+        if service == "lke":
+            # errors of Tencent Cloud APIs are in the body of 200 responses
+            return aiohttp.web.json_response({"Response": {
+                "Error": {"Code": code, "Message": code}, "RequestId": str(uuid.uuid4()),
+            }})
+        headers = {"x-rate-limit-reset": str(int(time.time()) + 1)} if status == 429 else {}
+        return aiohttp.web.json_response(
+            {"error": {"message": code, "type": code, "code": code}}, status=status, headers=headers
+        )
+
+    # OpenAI
+
+    async def _embeddings(self, request: aiohttp.web.Request) -> aiohttp.web.Response:
+        body = await request.json()
+        inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        return aiohttp.web.json_response({
+            "object": "list",
+            "model": body["model"],
+            "data": [
+                {"object": "embedding", "index": i, "embedding": synthetic.embed(text)}
+                for i, text in enumerate(inputs)
+            ],
+            "usage": {"prompt_tokens": 0, "total_tokens": 0},
+        })
+
+    async def _chat_completions(self, request: aiohttp.web.Request) -> aiohttp.web.Response:
+        body = await request.json()
+        messages = body["messages"]
+        prompt = messages[-1]["content"]
+        if body.get("response_format", {}).get("type") == "json_schema":
+            # candidates are csv rows of `id,content`
+            ids = [int(id_) for id_ in re.findall(r"^(\d+),\"", prompt, re.MULTILINE)]
+            content = json.dumps({"blocks": ids[:3]})
+        else:
+            # relations to follow are csv rows of `relation id,content,block id,block content`
+            targets = re.findall(r"^\d+,[^,\n]*,(\d+),", prompt, re.MULTILINE)
+            if targets and len(messages) < 6:
+                content = f"FOLLOW:{self._random.choice(targets)}."
+            elif targets:
+                content = f"FOUND:[{targets[0]}]."
+            else:
+                content = "NOTFOUND:no relations."
+        return aiohttp.web.json_response({
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body["model"],
+            "choices": [{
+                "index": 0, "finish_reason": "stop",
+                "message": {"role": "assistant", "content": content},
+            }],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+        })
+
+    # LKE, actions are named by header and answered in `Response`
+
+    async def _lke(self, request: aiohttp.web.Request) -> aiohttp.web.Response:
+        action = request.headers.get("X-TC-Action")
+        body = await request.json()
+        if action == "CreateWorkflowRun":
+            run_id = uuid.uuid4().hex
+            self._workflow_runs[run_id] = time.monotonic()
+            response: dict = {"WorkflowRunId": run_id}
+        elif action == "DescribeWorkflowRun":
+            run_id = body["WorkflowRunId"]
+            finished = (
+                time.monotonic() - self._workflow_runs[run_id]
+                >= self.behaviours["lke"].workflow_seconds
+            )
+            response = {
+                "WorkflowRun": {"WorkflowRunId": run_id, "State": 2 if finished else 1},
+                "NodeRuns": [{"NodeRunId": f"{run_id}-end", "NodeType": 16}] if finished else [],
+            }
+        elif action == "DescribeNodeRun":
+            self._workflow_runs.pop(body["NodeRunId"].removesuffix("-end"), None)
+            words = synthetic.vocabulary(64)
+            response = {"NodeRun": {
+                "NodeRunId": body["NodeRunId"],
+                "OutputRef": "",
+                "Output": json.dumps({"result": {
+                    "summary": " ".join(self._random.sample(words, 8)),
+                    "details": [
+                        {
+                            "type": self._random.choice(words),
+                            "content": " ".join(self._random.sample(words, 6)),
+                            "actions": self._random.sample(words, 2),
+                        }
+                        for _ in range(3)
+                    ],
+                }}),
+            }}
+        else:
+            return self._error("lke", 400, "InvalidAction")
+        response["RequestId"] = str(uuid.uuid4())
+        return aiohttp.web.json_response({"Response": response})
+
+    # X
+
+    async def _x_token(self, request: aiohttp.web.Request) -> aiohttp.web.Response:
+        return aiohttp.web.json_response({
+            "token_type": "bearer", "expires_in": 7200,
+            "access_token": uuid.uuid4().hex, "refresh_token": uuid.uuid4().hex,
+        })
+
+    async def _x_me(self, request: aiohttp.web.Request) -> aiohttp.web.Response:
+        return aiohttp.web.json_response({"data": {"id": "1", "username": "bench"}})
+
+    async def _x_bookmarks(self, request: aiohttp.web.Request) -> aiohttp.web.Response:
+        """A page of bookmarks never seen before, newest first.
+        """
+        num = int(request.query.get("max_results", "20"))
+        ids = sorted((next(self._tweet_ids) for _ in range(num)), reverse=True)
+        words = synthetic.vocabulary(256)
+        return aiohttp.web.json_response({
+            "data": [
+                {
+                    "id": str(id_), "lang": "en", "conversation_id": str(id_),
+                    "text": " ".join(self._random.sample(words, 16)),
+                }
+                for id_ in ids
+            ],
+            "meta": {"result_count": num, "next_token": uuid.uuid4().hex},
+        })
+
+    async def _x_search(self, request: aiohttp.web.Request) -> aiohttp.web.Response:
+        return aiohttp.web.json_response({"meta": {"result_count": 0}})
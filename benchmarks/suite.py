@@ -0,0 +1,356 @@
+"""End to end benchmarks of the app against fakes of remote APIs.
+
+Creates a throwaway database on the Postgres server of `DATABASE_URL`,
+which needs pgvector and pg_trgm, migrates it, loads a synthetic graph
+and points the app to in-process fakes of OpenAI, LKE and X.
+
+    DATABASE_URL=postgresql+psycopg2://... python -m benchmarks.suite --out results.json
+
+Reports throughput and p50/p99 latency of each scenario as JSON.
+Pass `--baseline` a former report to exit with 1 on regressions.
+
+Latency, rate limit and failure rate of fakes take a number for all
+services or a list for some of them, e.g. `--latency openai=0.3,lke=0.05`.
+"""
+
+import argparse
+import asyncio
+import base64
+import collections
+import contextlib
+import datetime
+import io
+import json
+import os
+import pathlib
+import platform
+import secrets
+import subprocess
+import sys
+import time
+import typing
+import numpy
+import sqlalchemy
+from . import fakes, synthetic
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+SCENARIOS = (
+    "create_block",
+    "collect",
+    "organize_block",
+    "iteration",
+    "similarity_search",
+    "llm_driven_block_query.llm",
+    "llm_driven_block_query.beam",
+)
+
+
+@contextlib.contextmanager
+def throwaway_database(server_url: str) -> typing.Iterator[sqlalchemy.URL]:
+    """Create a database with pgvector on the server and drop it after.
+    """
+    url = sqlalchemy.make_url(server_url).set(drivername="postgresql+psycopg2")
+    name = f"inkcre_bench_{secrets.token_hex(4)}"
+    admin_engine = sqlalchemy.create_engine(url, isolation_level="AUTOCOMMIT")
+    with admin_engine.connect() as conn:
+        conn.execute(sqlalchemy.text(f'CREATE DATABASE "{name}"'))
+    database_url = url.set(database=name)
+    try:
+        engine = sqlalchemy.create_engine(database_url)
+        with engine.begin() as conn:
+            conn.execute(sqlalchemy.text("CREATE EXTENSION IF NOT EXISTS vector"))
+        engine.dispose()
+        yield database_url
+    finally:
+        with admin_engine.connect() as conn:
+            conn.execute(sqlalchemy.text(f'DROP DATABASE IF EXISTS "{name}" WITH (FORCE)'))
+        admin_engine.dispose()
+
+
+def migrate(database_url: sqlalchemy.URL):
+    import alembic.command
+    import alembic.config
+
+    os.environ["DATABASE_URL"] = database_url.render_as_string(hide_password=False)
+    alembic.command.upgrade(alembic.config.Config(str(ROOT / "alembic.ini")), "head")
+
+
+def configure_app(database_url: sqlalchemy.URL, services: fakes.FakeServices):
+    """Point the app to the database and fakes.
+
+    Must be called before importing the app, configs are read on import.
+    """
+    os.environ.update({
+        "DB_USERNAME": database_url.username or "",
+        "DB_PASSWORD": database_url.password or "",
+        "DB_HOST": database_url.host or "",
+        "DB_PORT": str(database_url.port or 5432),
+        "DB_DATABASE": database_url.database or "",
+        "DB_SCHEMA": "public",
+        "LLM_SP_BASE_URL": services.url("openai"),
+        "LLM_SP_AK": "bench",
+        "LKE_ENDPOINT": services.url("lke"),
+        "TWITTER_API_BASE_URL": services.url("x"),
+    })
+    os.environ.setdefault("TENCENTCLOUD_SECRET_ID", "bench")
+    os.environ.setdefault("TENCENTCLOUD_SECRET_KEY", "bench")
+
+
+def random_image(rng: numpy.random.Generator) -> str:
+    """A distinct small image in base64, so img2text results are not reused.
+    """
+    from PIL import Image
+
+    pixels = rng.integers(0, 256, (16, 16, 3), dtype=numpy.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).resize((256, 256)).save(buffer, format="PNG")
+    return base64.b64encode(buffer.getvalue()).decode("ascii")
+
+
+async def measure(
+    operation: typing.Callable[[int], typing.Awaitable], iterations: int, concurrency: int
+) -> dict:
+    """Run the operation `iterations` times, at most `concurrency` at once.
+
+    Failed runs are counted by exception, latency is of successful runs.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: list[float] = []
+    errors: collections.Counter[str] = collections.Counter()
+
+    async def run(i: int):
+        async with semaphore:
+            started_at = time.perf_counter()
+            try:
+                await operation(i)
+            except Exception as e:
+                errors[type(e).__name__] += 1
+            else:
+                latencies.append(time.perf_counter() - started_at)
+
+    started_at = time.perf_counter()
+    await asyncio.gather(*(run(i) for i in range(iterations)))
+    seconds = time.perf_counter() - started_at
+    return {
+        "iterations": iterations,
+        "concurrency": concurrency,
+        "seconds": seconds,
+        "throughput": len(latencies) / seconds,
+        "p50_ms": float(numpy.percentile(latencies, 50) * 1000) if latencies else None,
+        "p99_ms": float(numpy.percentile(latencies, 99) * 1000) if latencies else None,
+        "errors": dict(errors),
+    }
+
+
+async def run_scenarios(args: argparse.Namespace, num_blocks: int) -> dict[str, dict]:
+    from app.business.block import (
+        _create_block, _iterate_from_block, _query_from_block_by_embedding,
+        llm_driven_block_query, organize_block,
+    )
+    from app.business.source import SourceManager
+    from app.engine import SessionLocal
+    from app.schemas.block import BlockModel
+
+    rng = numpy.random.default_rng(args.seed)
+    words = synthetic.vocabulary(32 * 64)
+
+    def sentence() -> str:
+        return " ".join(words[i] for i in rng.integers(0, len(words), 12))
+
+    def block_ids(num: int) -> list[int]:
+        return rng.choice(num_blocks, min(num, num_blocks), replace=False).tolist()
+
+    async def create_block(i: int):
+        await asyncio.to_thread(_create_block, BlockModel(resolver="text", content=sentence()))
+
+    image_blocks = [
+        await asyncio.to_thread(
+            _create_block, BlockModel(resolver="image", content=random_image(rng))
+        )
+        for _ in range(args.iterations if "organize_block" in args.scenarios else 0)
+    ]
+
+    async def organize(i: int):
+        await organize_block(image_blocks[i])
+
+    iteration_starts = block_ids(args.iterations)
+
+    async def iterate(i: int):
+        with SessionLocal() as db_session:
+            await _iterate_from_block(iteration_starts[i] + 1, db_session)
+
+    search_starts = block_ids(args.iterations)
+
+    async def similarity_search(i: int):
+        def run():
+            with SessionLocal() as db_session:
+                _query_from_block_by_embedding(search_starts[i] + 1, db_session, min_similarity=0)
+        await asyncio.to_thread(run)
+
+    query_starts = block_ids(args.iterations)
+
+    def llm_driven(strategy: typing.Literal["llm", "beam"]):
+        async def query(i: int):
+            with SessionLocal() as db_session:
+                await llm_driven_block_query(
+                    block_id=query_starts[i] + 1, prompt=sentence(), scope=1, strategy=strategy,
+                    max_hops=5, max_llm_calls=6, beam_width=4, db_session=db_session,
+                )
+        return query
+
+    operations: dict[str, tuple[typing.Callable[[int], typing.Awaitable], int]] = {
+        "create_block": (create_block, args.concurrency),
+        "organize_block": (organize, args.concurrency),
+        "iteration": (iterate, args.concurrency),
+        "similarity_search": (similarity_search, args.concurrency),
+        "llm_driven_block_query.llm": (llm_driven("llm"), args.concurrency),
+        "llm_driven_block_query.beam": (llm_driven("beam"), args.concurrency),
+    }
+    if "collect" in args.scenarios:
+        from extensions.twitter.api import OfficialAPI, TwitterAPI
+        from extensions.twitter.bookmark import Source
+
+        api = TwitterAPI.SINGLETON = OfficialAPI(client_id="bench", client_secret="bench")
+        api.state, api.code_challenge = "bench", "bench"
+        await api.handle_oauth_callback(code="bench", state="bench")
+        source_id = typing.cast(int, SourceManager.create(Source.__module__, "bench").id)
+
+        async def collect(i: int):
+            await Source(source_id).collect()
+
+        # runs of a source are serialized by the app
+        operations["collect"] = (collect, 1)
+
+    results = {}
+    for name in args.scenarios:
+        operation, concurrency = operations[name]
+        results[name] = await measure(operation, args.iterations, concurrency)
+        print(json.dumps({name: results[name]}), file=sys.stderr)
+    return results
+
+
+def per_service(value: str, cast: typing.Callable[[str], typing.Any] = float) -> dict[str, typing.Any]:
+    """Parse `0.1` for all services or `openai=0.1,lke=0.2` for some.
+    """
+    if "=" not in value:
+        return dict.fromkeys(fakes.SERVICES, cast(value))
+    pairs = (item.split("=", 1) for item in value.split(","))
+    return {service.strip(): cast(setting) for service, setting in pairs}
+
+
+def compare(report: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Scenarios slower or of less throughput than the baseline beyond tolerance.
+    """
+    regressions = []
+    for name, result in report["scenarios"].items():
+        base = baseline.get("scenarios", {}).get(name)
+        if not base:
+            continue
+        for key in ("p50_ms", "p99_ms"):
+            if result[key] and base[key] and result[key] > base[key] * (1 + tolerance):
+                regressions.append(f"{name} {key}: {base[key]:.1f} -> {result[key]:.1f}")
+        if result["throughput"] < base["throughput"] * (1 - tolerance):
+            regressions.append(
+                f"{name} throughput: {base['throughput']:.2f} -> {result['throughput']:.2f}"
+            )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--database-url", default=None, help="defaults to env DATABASE_URL")
+    parser.add_argument("--blocks", type=int, default=10_000)
+    parser.add_argument("--degree", type=int, default=3, help="relations a block on average")
+    parser.add_argument("--iterations", type=int, default=50, help="runs of each scenario")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--latency", default="0", help="seconds added to responses of fakes")
+    parser.add_argument("--jitter", default="0")
+    parser.add_argument("--rate-limit", default="", help="requests a second allowed by fakes")
+    parser.add_argument("--failure-rate", default="0")
+    parser.add_argument("--workflow-seconds", type=float, default=0, help="of a fake LKE workflow run")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default=None, help="defaults to stdout")
+    parser.add_argument("--baseline", default=None, help="report to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+    args.scenarios = [name for name in args.scenarios.split(",") if name]
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios {', '.join(sorted(unknown))}")
+
+    latency, jitter = per_service(args.latency), per_service(args.jitter)
+    failure_rate = per_service(args.failure_rate)
+    rate_limit = per_service(args.rate_limit) if args.rate_limit else {}
+    behaviours = {
+        service: fakes.Behaviour(
+            latency=latency.get(service, 0), jitter=jitter.get(service, 0),
+            failure_rate=failure_rate.get(service, 0), rate_limit=rate_limit.get(service),
+            workflow_seconds=args.workflow_seconds,
+        )
+        for service in fakes.SERVICES
+    }
+
+    with (
+        throwaway_database(args.database_url or os.environ["DATABASE_URL"]) as database_url,
+        fakes.FakeServices(behaviours, seed=args.seed) as services,
+    ):
+        configure_app(database_url, services)
+        migrate(database_url)
+        from app.engine import SQLDB_ENGINE
+
+        started_at = time.perf_counter()
+        graph = synthetic.generate(args.blocks, degree=args.degree, seed=args.seed)
+        raw_connection = SQLDB_ENGINE.raw_connection()
+        try:
+            synthetic.load(raw_connection, graph)
+        finally:
+            raw_connection.close()
+        load_seconds = time.perf_counter() - started_at
+
+        with SQLDB_ENGINE.connect() as conn:
+            server_version = conn.execute(sqlalchemy.text("SHOW server_version")).scalar()
+        scenarios = asyncio.run(run_scenarios(args, args.blocks))
+        SQLDB_ENGINE.dispose()
+
+    commit = subprocess.run(
+        ("git", "rev-parse", "HEAD"), cwd=ROOT, capture_output=True, text=True
+    ).stdout.strip()
+    report = {
+        "meta": {
+            "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "commit": commit or None,
+            "python": platform.python_version(),
+            "postgres": server_version,
+            "blocks": args.blocks,
+            "relations": len(graph.relations),
+            "load_seconds": load_seconds,
+            "fakes": {
+                service: {
+                    "latency": behaviour.latency, "jitter": behaviour.jitter,
+                    "failure_rate": behaviour.failure_rate, "rate_limit": behaviour.rate_limit,
+                    "requests": services.requests[service], "rejected": services.rejected[service],
+                }
+                for service, behaviour in services.behaviours.items()
+            },
+        },
+        "scenarios": scenarios,
+    }
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"regression: {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""Synthetic block graph.
+
+Blocks are sentences of words of one of a few topics, related mostly
+within their topic. Embeddings are sums of per word vectors, the same
+as those of the fake embeddings API in `benchmarks.fakes`, so searches
+by text and by stored embeddings agree.
+"""
+
+import functools
+import io
+import re
+import struct
+import typing
+import zlib
+import numpy
+
+DIM = 1024
+_SYLLABLES = ("ka", "lo", "mi", "nu", "re", "sa", "ti", "vo", "ze", "qu", "ha", "pe")
+_PGCOPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack(">ii", 0, 0)
+_PGCOPY_TRAILER = struct.pack(">h", -1)
+
+
+def vocabulary(size: int) -> list[str]:
+    """Distinct made up words, so full text search sees real tokens.
+    """
+    words = []
+    for i in range(size):
+        word = ""
+        while True:
+            i, rest = divmod(i, len(_SYLLABLES))
+            word += _SYLLABLES[rest]
+            if not i:
+                break
+        words.append(word + "x")
+    return words
+
+
+@functools.lru_cache(maxsize=65536)
+def word_vector(word: str) -> numpy.ndarray:
+    return numpy.random.default_rng(zlib.crc32(word.encode("utf-8"))).standard_normal(
+        DIM, dtype=numpy.float32
+    )
+
+
+def embed(text: str) -> list[float]:
+    """Embedding of a text, the normalized sum of vectors of its words.
+    """
+    vector = numpy.zeros(DIM, dtype=numpy.float32)
+    for word in re.findall(r"\w+", text.lower()):
+        vector += word_vector(word)
+    norm = numpy.linalg.norm(vector)
+    return (vector / norm if norm else vector).tolist()
+
+
+class Graph(typing.NamedTuple):
+    contents: list[str]
+    relations: list[tuple[int, int, str]]
+    """(from_, to_, content), by 1-based block ids.
+    """
+    block_embeddings: numpy.ndarray
+    relation_embeddings: numpy.ndarray
+    """Of the first relations, not every relation has one.
+    """
+
+
+def generate(
+    num_blocks: int,
+    degree: int = 3,
+    topics: int = 32,
+    words_per_block: int = 12,
+    relation_embedding_ratio: float = 0.5,
+    seed: int = 0,
+) -> Graph:
+    """Generate blocks with `degree` outgoing relations each on average.
+
+    :param relation_embedding_ratio: Share of relations with an embedding.
+    """
+    rng = numpy.random.default_rng(seed)
+    words = vocabulary(topics * 64)
+    vectors = numpy.stack([word_vector(word) for word in words])
+    # each topic prefers its own slice of the vocabulary
+    topic_of = rng.integers(0, topics, num_blocks)
+    word_ids = numpy.where(
+        rng.random((num_blocks, words_per_block)) < 0.8,
+        topic_of[:, None] * 64 + rng.integers(0, 64, (num_blocks, words_per_block)),
+        rng.integers(0, len(words), (num_blocks, words_per_block)),
+    )
+    contents = [" ".join(words[i] for i in row) for row in word_ids]
+    block_embeddings = vectors[word_ids].sum(axis=1)
+    block_embeddings /= numpy.linalg.norm(block_embeddings, axis=1, keepdims=True)
+
+    by_topic = [numpy.flatnonzero(topic_of == topic) for topic in range(topics)]
+    relations = []
+    for from_ in range(num_blocks):
+        for _ in range(rng.poisson(degree)):
+            same_topic = by_topic[topic_of[from_]]
+            to_ = (
+                same_topic[rng.integers(0, len(same_topic))] if rng.random() < 0.8
+                else rng.integers(0, num_blocks)
+            )
+            if to_ != from_:
+                relations.append((from_ + 1, int(to_) + 1, words[rng.integers(0, len(words))]))
+
+    num_relation_embeddings = int(len(relations) * relation_embedding_ratio)
+    relation_embeddings = numpy.stack([
+        numpy.asarray(embed(content), dtype=numpy.float32)
+        for _, _, content in relations[:num_relation_embeddings]
+    ]) if num_relation_embeddings else numpy.zeros((0, DIM), dtype=numpy.float32)
+    return Graph(contents, relations, block_embeddings, relation_embeddings)
+
+
+def _copy_text(rows: typing.Iterable[typing.Iterable]) -> io.BytesIO:
+    return io.BytesIO("".join(
+        "\t".join("\\N" if value is None else str(value) for value in row) + "\n"
+        for row in rows
+    ).encode("utf-8"))
+
+
+def _copy_vectors(vectors: numpy.ndarray) -> io.BytesIO:
+    """Rows of (id, vector) with ids from 1 in binary `COPY` format.
+    """
+    num, dim = vectors.shape
+    rows = numpy.zeros(num, dtype=[
+        ("fields", ">i2"), ("id_length", ">i4"), ("id", ">i4"),
+        ("vector_length", ">i4"), ("dim", ">u2"), ("unused", ">u2"), ("vector", ">f4", (dim,)),
+    ])
+    rows["fields"], rows["id_length"], rows["vector_length"], rows["dim"] = 2, 4, 4 + 4 * dim, dim
+    rows["id"] = numpy.arange(1, num + 1)
+    rows["vector"] = vectors
+    return io.BytesIO(_PGCOPY_HEADER + rows.tobytes() + _PGCOPY_TRAILER)
+
+
+def load(dbapi_connection, graph: Graph):
+    """Copy the graph into empty tables of blocks, relations and their embeddings.
+    """
+    cursor = dbapi_connection.cursor()
+    cursor.copy_expert(
+        "COPY blocks (id, created_at, updated_at, resolver, content) FROM STDIN",
+        _copy_text((i, "now", "now", "text", content) for i, content in enumerate(graph.contents, 1)),
+    )
+    cursor.copy_expert(
+        'COPY relations (id, updated_at, "from_", "to_", content) FROM STDIN',
+        _copy_text((i, "now", *relation) for i, relation in enumerate(graph.relations, 1)),
+    )
+    for table, vectors in (
+        ("block_embeddings", graph.block_embeddings),
+        ("relation_embeddings", graph.relation_embeddings),
+    ):
+        cursor.copy_expert(
+            f"COPY {table} (id, embedding) FROM STDIN WITH (FORMAT binary)", _copy_vectors(vectors)
+        )
+    for table in ("blocks", "relations"):
+        cursor.execute(
+            f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), (SELECT max(id) FROM {table}))"
+        )
+        cursor.execute(f"ANALYZE {table}")
+    for table in ("block_embeddings", "relation_embeddings"):
+        cursor.execute(f"ANALYZE {table}")
+    dbapi_connection.commit()
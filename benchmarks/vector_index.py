@@ -0,0 +1,153 @@
+"""Recall and latency of embedding index modes on synthetic vectors.
+
+Loads clustered random unit vectors into a throwaway schema, builds the
+HNSW index of each mode of `app.business.embedding` in turn and runs
+the same queries as the app through `search_nearest`.
+
+    DATABASE_URL=postgresql+psycopg2://... python -m benchmarks.vector_index --num 1000000
+
+Prints a JSON report: index size, build seconds, recall@k against exact
+search, p50/p99 query latency.
+"""
+
+import argparse
+import io
+import json
+import os
+import struct
+import sys
+import time
+import types
+import typing
+import numpy
+import pgvector.sqlalchemy
+import sqlalchemy
+from app.business import embedding
+
+SCHEMA = "bench_vectors"
+CHUNK = 20_000
+
+
+def generate(
+    num: int, centers: numpy.ndarray, rng: numpy.random.Generator
+) -> typing.Iterator[tuple[int, numpy.ndarray]]:
+    """Yield chunks of unit vectors scattered around `centers`, like embeddings of topics.
+    """
+    for start in range(0, num, CHUNK):
+        size = min(CHUNK, num - start)
+        vectors = centers[rng.integers(0, len(centers), size)] + rng.standard_normal(
+            (size, centers.shape[1]), dtype=numpy.float32
+        )
+        yield start, vectors / numpy.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def binary_copy(start: int, vectors: numpy.ndarray) -> io.BytesIO:
+    num, dim = vectors.shape
+    rows = numpy.zeros(num, dtype=[
+        ("fields", ">i2"), ("id_length", ">i4"), ("id", ">i4"),
+        ("vector_length", ">i4"), ("dim", ">u2"), ("unused", ">u2"), ("vector", ">f4", (dim,)),
+    ])
+    rows["fields"], rows["id_length"], rows["vector_length"], rows["dim"] = 2, 4, 4 + 4 * dim, dim
+    rows["id"] = numpy.arange(start + 1, start + num + 1)
+    rows["vector"] = vectors
+    header = b"PGCOPY\n\xff\r\n\x00" + struct.pack(">ii", 0, 0)
+    return io.BytesIO(header + rows.tobytes() + struct.pack(">h", -1))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--database-url", default=None, help="defaults to env DATABASE_URL")
+    parser.add_argument("--num", type=int, default=1_000_000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--clusters", type=int, default=256)
+    parser.add_argument("--modes", default="full,halfvec,binary")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--rerank-factor", type=int, default=embedding.RERANK_FACTOR)
+    args = parser.parse_args()
+    embedding.RERANK_FACTOR = args.rerank_factor
+
+    engine = sqlalchemy.create_engine(args.database_url or os.environ["DATABASE_URL"])
+    dim = embedding.DIM
+    metadata = sqlalchemy.MetaData(schema=SCHEMA)
+    table = sqlalchemy.Table(
+        "embeddings", metadata,
+        sqlalchemy.Column("id", sqlalchemy.Integer, primary_key=True),
+        sqlalchemy.Column("embedding", pgvector.sqlalchemy.VECTOR(dim), nullable=False),
+    )
+    model = types.SimpleNamespace(id=table.c.id, embedding=table.c.embedding, __tablename__="embeddings")
+
+    rng = numpy.random.default_rng(args.seed)
+    centers = rng.standard_normal((args.clusters, dim), dtype=numpy.float32)
+    queries = next(generate(args.queries, centers, rng))[1]
+    truth_scores = numpy.full((args.queries, args.k), -numpy.inf, dtype=numpy.float32)
+    truth_ids = numpy.zeros((args.queries, args.k), dtype=numpy.int64)
+
+    with engine.connect() as conn:
+        conn = conn.execution_options(isolation_level="AUTOCOMMIT")
+        conn.execute(sqlalchemy.text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+        conn.execute(sqlalchemy.text(f"CREATE SCHEMA {SCHEMA}"))
+        metadata.create_all(conn)
+
+        started_at = time.perf_counter()
+        cursor = conn.connection.cursor()
+        for start, vectors in generate(args.num, centers, rng):
+            cursor.copy_expert(
+                f"COPY {SCHEMA}.embeddings (id, embedding) FROM STDIN WITH (FORMAT binary)",
+                binary_copy(start, vectors),
+            )
+            # exact top k, merged chunk by chunk
+            scores = numpy.concatenate((truth_scores, queries @ vectors.T), axis=1)
+            chunk_ids = numpy.arange(start + 1, start + len(vectors) + 1)
+            ids = numpy.concatenate(
+                (truth_ids, numpy.broadcast_to(chunk_ids, (args.queries, len(vectors)))), axis=1
+            )
+            top = numpy.argpartition(-scores, args.k - 1, axis=1)[:, :args.k]
+            truth_scores = numpy.take_along_axis(scores, top, axis=1)
+            truth_ids = numpy.take_along_axis(ids, top, axis=1)
+        report: dict = {
+            "num": args.num, "dim": dim, "k": args.k, "queries": args.queries,
+            "rerank_factor": args.rerank_factor,
+            "load_seconds": time.perf_counter() - started_at, "modes": {},
+        }
+        conn.execute(sqlalchemy.text(f"ANALYZE {SCHEMA}.embeddings"))
+        conn.execute(sqlalchemy.text("SET maintenance_work_mem = '2GB'"))
+        query_conn = engine.connect()
+
+        for mode in args.modes.split(","):
+            name = embedding._index_name("embeddings", mode)  # type: ignore[arg-type]
+            started_at = time.perf_counter()
+            conn.execute(sqlalchemy.text(
+                f"CREATE INDEX {name} ON {SCHEMA}.embeddings USING hnsw ({embedding._INDEX_EXPRESSIONS[mode]})"  # type: ignore[index]
+            ))
+            build_seconds = time.perf_counter() - started_at
+            size = conn.execute(sqlalchemy.text(f"SELECT pg_relation_size('{SCHEMA}.{name}')")).scalar()
+
+            latencies, recalls = [], []
+            for query, truth in zip(queries, truth_ids):
+                # SET LOCAL of ef_search needs a transaction
+                with query_conn.begin():
+                    started_at = time.perf_counter()
+                    found = embedding.search_nearest(query_conn, model, query.tolist(), args.k, mode=mode)  # type: ignore[arg-type]
+                    latencies.append(time.perf_counter() - started_at)
+                recalls.append(len({id_ for id_, _ in found} & set(truth.tolist())) / args.k)
+
+            conn.execute(sqlalchemy.text(f"DROP INDEX {SCHEMA}.{name}"))
+            report["modes"][mode] = {
+                "index_bytes": size,
+                "build_seconds": build_seconds,
+                "recall": float(numpy.mean(recalls)),
+                "p50_ms": float(numpy.percentile(latencies, 50) * 1000),
+                "p99_ms": float(numpy.percentile(latencies, 99) * 1000),
+            }
+            print(json.dumps({mode: report["modes"][mode]}), file=sys.stderr)
+
+        query_conn.close()
+        conn.execute(sqlalchemy.text(f"DROP SCHEMA {SCHEMA} CASCADE"))
+
+    json.dump(report, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -16,11 +16,32 @@ import urllib.parse
 from typing import Optional as Opt
 from dd import dd
 from app.utils.base import AIOHTTP_CONNECTOR_GETTER
+from app.utils.breaker import CircuitBreaker
+from app.utils.tracing import AIOHTTP_TRACE_CONFIGS
 from app.utils.datetime_ import get_timestamp
 from .schema import Tweet, TweetPhoto, TweetVideo, VideoVariant
 from . import Extension
 
 
+# configs
+API_BASE_URL = os.getenv("TWITTER_API_BASE_URL", "https://api.x.com/2")
+MAX_RATE_LIMITED_RETRIES = 3
+
+
+def _is_provider_failure(e: Exception) -> bool:
+    if isinstance(e, aiohttp.ClientResponseError):
+        return e.status >= 500
+    return isinstance(e, (aiohttp.ClientError, asyncio.TimeoutError))
+
+
+X_BREAKER = CircuitBreaker("x", _is_provider_failure)
+
+
+class TooManyRequests(Exception):
+    """Still rate limited after waiting for resets.
+    """
+
+
 class TwitterAPIResult(sqlmodel.SQLModel):
     next_page: Opt[str] = None
     previous_page: Opt[str] = None
@@ -141,7 +162,6 @@ class OfficialAPI(TwitterAPI):
         method: str, endpoint: str, 
         path_params: Opt[dict] = None,
         query: Opt[dict] = None, body: Opt[dict] = None,
-        retried: int = 0
     ) -> dict:
         """Make a request to the Twitter API.
 
@@ -170,11 +190,6 @@ class OfficialAPI(TwitterAPI):
             "Authorization": f"Bearer {self.__access_token}",
         }
 
-        rate_limit_reset_at = self.rate_limit_reset.get(endpoint)
-        if rate_limit_reset_at:
-            await asyncio.sleep((rate_limit_reset_at - get_timestamp()) + 5)
-            del self.request_records[endpoint]
-
         # request_record = cls.request_records.get(endpoint)
         # if request_record:
         #     last_request_count, last_15m_start_at = request_record
@@ -192,31 +207,35 @@ class OfficialAPI(TwitterAPI):
         # else:
         #     last_request_count, last_15m_start_at = 0, datetime.datetime.now()
 
-        async with aiohttp.ClientSession(connector=AIOHTTP_CONNECTOR_GETTER()) as session:
-            async with session.request(
-                method, f"https://api.x.com/2{endpoint_with_params}", params=query, headers=headers, 
-            ) as resp:
-                if resp.status == 429:
-                    x_rate_limit_reset = resp.headers.get("x-rate-limit-reset")
-                    if x_rate_limit_reset:
-                        self.rate_limit_reset[endpoint] = int(x_rate_limit_reset)
-                    
-                    # # Rate limit exceeded but not expected, set request count to max
-                    # # and request again when rate limit reset
-                    # cls.request_records[endpoint] = (
-                    #     Extension.config.api_rate_limit", {}).get(endpoint, 1),
-                    #     datetime.datetime.now()
-                    # )
-
-                    if retried < 3:
-                        return await self._request(
-                            method, endpoint, path_params, query, body, retried + 1
-                        )
-                    else:
-                        raise TooManyRequests  # TODO
-
-                resp.raise_for_status()
-                return await resp.json()
+        for _ in range(MAX_RATE_LIMITED_RETRIES + 1):
+            rate_limit_reset_at = self.rate_limit_reset.pop(endpoint, None)
+            if rate_limit_reset_at:
+                await asyncio.sleep((rate_limit_reset_at - get_timestamp()) + 5)
+
+            with X_BREAKER.call():
+                async with aiohttp.ClientSession(
+                    connector=AIOHTTP_CONNECTOR_GETTER(), trace_configs=AIOHTTP_TRACE_CONFIGS
+                ) as session:
+                    async with session.request(
+                        method, f"{API_BASE_URL}{endpoint_with_params}", params=query, headers=headers, 
+                    ) as resp:
+                        if resp.status == 429:
+                            x_rate_limit_reset = resp.headers.get("x-rate-limit-reset")
+                            if x_rate_limit_reset:
+                                self.rate_limit_reset[endpoint] = int(x_rate_limit_reset)
+
+                            # # Rate limit exceeded but not expected, set request count to max
+                            # # and request again when rate limit reset
+                            # cls.request_records[endpoint] = (
+                            #     Extension.config.api_rate_limit", {}).get(endpoint, 1),
+                            #     datetime.datetime.now()
+                            # )
+                            continue
+
+                        resp.raise_for_status()
+                        return await resp.json()
+
+        raise TooManyRequests(endpoint)
 
     async def get_user(self) -> tuple[str, str]:
         """Get the user info the token represents and store to state.
@@ -402,7 +421,7 @@ class OfficialAPI(TwitterAPI):
         if state != self.state:
             raise ValueError("Invalid state parameter")
 
-        TOKEN_URL = "https://api.x.com/2/oauth2/token"
+        TOKEN_URL = f"{API_BASE_URL}/oauth2/token"
         CLIENT_ID = self.__client_id
         CLIENT_SECRET = self.__client_secret
 
@@ -421,7 +440,9 @@ class OfficialAPI(TwitterAPI):
             }"
         }
 
-        async with aiohttp.ClientSession(connector=AIOHTTP_CONNECTOR_GETTER()) as session:
+        async with aiohttp.ClientSession(
+            connector=AIOHTTP_CONNECTOR_GETTER(), trace_configs=AIOHTTP_TRACE_CONFIGS
+        ) as session:
             async with session.post(TOKEN_URL, data=data, headers=headers) as resp:
                 resp.raise_for_status()
                 resp_body = await resp.json()
@@ -447,7 +468,7 @@ class OfficialAPI(TwitterAPI):
 
         Docs https://docs.x.com/fundamentals/authentication/oauth-2-0/authorization-code#refresh-tokens
         """
-        TOKEN_URL = "https://api.x.com/2/oauth2/token"
+        TOKEN_URL = f"{API_BASE_URL}/oauth2/token"
         CLIENT_ID = self.__client_id
 
         data = {
@@ -460,7 +481,9 @@ class OfficialAPI(TwitterAPI):
             "Content-Type": "application/x-www-form-urlencoded",
         }
 
-        async with aiohttp.ClientSession(connector=AIOHTTP_CONNECTOR_GETTER()) as session:
+        async with aiohttp.ClientSession(
+            connector=AIOHTTP_CONNECTOR_GETTER(), trace_configs=AIOHTTP_TRACE_CONFIGS
+        ) as session:
             async with session.post(TOKEN_URL, data=data, headers=headers) as resp:
                 resp.raise_for_status()
                 token_response = await resp.json()
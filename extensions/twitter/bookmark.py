@@ -9,7 +9,7 @@ from app.business.block import _create_block, _get_recent_blocks, _get_block
 from app.business.relation import RelationManager
 from app.business.source import SourceBase, CollectGeneratedTV
 from app.schemas.block import BlockID, BlockModel
-from .api import TwitterAPI
+from .api import API_BASE_URL, TwitterAPI
 from .schema import Tweet, TweetID
 
 
@@ -18,7 +18,7 @@ class Source(SourceBase):
     """Twitter Bookmark as Source
     """
 
-    API_BASE_URL = "https://api.x.com/2"
+    API_BASE_URL = API_BASE_URL
     
     async def _collect(  # type: ignore[override]  seems to be a bug of pyright
         self, full: bool = False, page: Opt[str] = None
@@ -41,6 +41,7 @@ class Source(SourceBase):
         RESULT_LIMIT = 40
         api_client = TwitterAPI.new()
         bookmarks_res = await api_client.get_bookmarks(page=page, max_results=RESULT_LIMIT)
+        self._count_api_call()
 
         # find new tweets start point
         old_start_at = len(bookmarks_res.tweets)
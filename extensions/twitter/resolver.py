@@ -1,10 +1,14 @@
-
-
-from app.business.resolver import Resolver
+from app.business.resolver import Resolver, ResolverCost, SubGraph
 
 
 class TweetResolver(Resolver):
     __rsotype__ = "tweet"
+    __rsocost__ = ResolverCost.IO
+
+    async def extract_blocks_and_relations(self) -> SubGraph:
+        # TODO extract photos, videos and urls
+        return SubGraph()
 
-    # TODO
-    ...
+    async def to_text(self) -> str:
+        from .schema import Tweet
+        return Tweet.model_validate_json(self._block.content).text
@@ -0,0 +1,39 @@
+"""add source_runs
+
+Revision ID: 3a9d27c5b6e4
+Revises: 8c1f0e6a4d21
+Create Date: 2026-10-18 11:02:47.918336
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3a9d27c5b6e4'
+down_revision: Union[str, Sequence[str], None] = '8c1f0e6a4d21'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('source_runs',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('source_id', sa.Integer(), nullable=False),
+    sa.Column('started_at', sa.TIMESTAMP(timezone=True), nullable=False),
+    sa.Column('finished_at', sa.TIMESTAMP(timezone=True), nullable=True),
+    sa.Column('collected', sa.Integer(), nullable=False),
+    sa.Column('next_interval', sa.Float(), nullable=True),
+    sa.ForeignKeyConstraint(['source_id'], ['sources.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_source_runs_source_id'), 'source_runs', ['source_id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_source_runs_source_id'), table_name='source_runs')
+    op.drop_table('source_runs')
@@ -0,0 +1,32 @@
+"""add block content hash index
+
+Revision ID: 4f8a2c6e1d93
+Revises: 7c2d9f4b0e61
+Create Date: 2026-10-19 15:02:11.280417
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '4f8a2c6e1d93'
+down_revision: Union[str, Sequence[str], None] = '7c2d9f4b0e61'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # not unique, organize stores the same content many times, see `_insert_blocks`
+    op.create_index(
+        'ix_blocks_resolver_content_md5', 'blocks',
+        ['resolver', sa.text('md5(content)')],
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_blocks_resolver_content_md5', table_name='blocks')
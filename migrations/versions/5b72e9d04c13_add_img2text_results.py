@@ -0,0 +1,36 @@
+"""add img2text_results
+
+Revision ID: 5b72e9d04c13
+Revises: e07b3d5a91c8
+Create Date: 2026-10-18 15:08:39.551702
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5b72e9d04c13'
+down_revision: Union[str, Sequence[str], None] = 'e07b3d5a91c8'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('img2text_results',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('phash', sa.BigInteger(), nullable=False),
+    sa.Column('result', sa.JSON(), nullable=False),
+    sa.Column('created_at', sa.TIMESTAMP(timezone=True), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_img2text_results_phash'), 'img2text_results', ['phash'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_img2text_results_phash'), table_name='img2text_results')
+    op.drop_table('img2text_results')
@@ -0,0 +1,31 @@
+"""add relation_embeddings index
+
+Revision ID: 7c2d9f4b0e61
+Revises: 6a0c8e3f91b2
+Create Date: 2026-10-19 09:12:40.655318
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7c2d9f4b0e61'
+down_revision: Union[str, Sequence[str], None] = '6a0c8e3f91b2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # the `full` mode index, see `app.business.embedding` to switch to compact ones
+    op.create_index(
+        'ix_relation_embeddings_embedding', 'relation_embeddings', ['embedding'],
+        postgresql_using='hnsw', postgresql_ops={'embedding': 'vector_cosine_ops'},
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_relation_embeddings_embedding', table_name='relation_embeddings')
@@ -0,0 +1,28 @@
+"""add source.ingest_token
+
+Revision ID: 8c1f0e6a4d21
+Revises: 23257a559f94
+Create Date: 2026-10-18 10:12:31.204518
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8c1f0e6a4d21'
+down_revision: Union[str, Sequence[str], None] = '23257a559f94'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('sources', sa.Column('ingest_token', sa.Text(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('sources', 'ingest_token')
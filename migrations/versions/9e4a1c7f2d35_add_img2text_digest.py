@@ -0,0 +1,39 @@
+"""add img2text_results digest and workflow_id
+
+Revision ID: 9e4a1c7f2d35
+Revises: 5b72e9d04c13
+Create Date: 2026-10-18 15:52:11.204318
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9e4a1c7f2d35'
+down_revision: Union[str, Sequence[str], None] = '5b72e9d04c13'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # results stored before can not be found by digest, only by phash
+    op.add_column('img2text_results', sa.Column('digest', sa.String(length=64), nullable=True))
+    op.execute("UPDATE img2text_results SET digest = 'legacy:' || id")
+    op.alter_column('img2text_results', 'digest', nullable=False)
+    op.add_column('img2text_results', sa.Column('workflow_id', sa.Text(), server_default='1948959057036216384', nullable=False))
+    op.alter_column('img2text_results', 'workflow_id', server_default=None)
+    op.alter_column('img2text_results', 'phash', existing_type=sa.BigInteger(), nullable=True)
+    op.create_unique_constraint('img2text_results_digest_workflow_id_key', 'img2text_results', ['digest', 'workflow_id'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_constraint('img2text_results_digest_workflow_id_key', 'img2text_results', type_='unique')
+    op.execute("DELETE FROM img2text_results WHERE phash IS NULL")
+    op.alter_column('img2text_results', 'phash', existing_type=sa.BigInteger(), nullable=False)
+    op.drop_column('img2text_results', 'workflow_id')
+    op.drop_column('img2text_results', 'digest')
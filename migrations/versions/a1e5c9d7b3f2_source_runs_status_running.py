@@ -0,0 +1,29 @@
+"""default status of source_runs to running
+
+Revision ID: a1e5c9d7b3f2
+Revises: 4f8a2c6e1d93
+Create Date: 2026-10-19 18:40:26.511902
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a1e5c9d7b3f2'
+down_revision: Union[str, Sequence[str], None] = '4f8a2c6e1d93'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # runs are recorded when they start, and updated when they finish
+    op.alter_column('source_runs', 'status', existing_type=sa.Text(), server_default='running')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.alter_column('source_runs', 'status', existing_type=sa.Text(), server_default='succeeded')
@@ -0,0 +1,42 @@
+"""add source_runs ledger columns
+
+Revision ID: c4e81b02f9a7
+Revises: 3a9d27c5b6e4
+Create Date: 2026-10-18 12:20:05.337180
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c4e81b02f9a7'
+down_revision: Union[str, Sequence[str], None] = '3a9d27c5b6e4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('source_runs', sa.Column('trigger', sa.Text(), server_default='scheduled', nullable=False))
+    op.add_column('source_runs', sa.Column('status', sa.Text(), server_default='succeeded', nullable=False))
+    op.add_column('source_runs', sa.Column('api_calls', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('source_runs', sa.Column('fetch_seconds', sa.Float(), server_default='0', nullable=False))
+    op.add_column('source_runs', sa.Column('persist_seconds', sa.Float(), server_default='0', nullable=False))
+    op.add_column('source_runs', sa.Column('schedule_seconds', sa.Float(), server_default='0', nullable=False))
+    op.add_column('source_runs', sa.Column('error', sa.Text(), nullable=True))
+    op.create_index('ix_source_runs_source_id_started_at', 'source_runs', ['source_id', sa.text('started_at DESC')], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_source_runs_source_id_started_at', table_name='source_runs')
+    op.drop_column('source_runs', 'error')
+    op.drop_column('source_runs', 'schedule_seconds')
+    op.drop_column('source_runs', 'persist_seconds')
+    op.drop_column('source_runs', 'fetch_seconds')
+    op.drop_column('source_runs', 'api_calls')
+    op.drop_column('source_runs', 'status')
+    op.drop_column('source_runs', 'trigger')
@@ -0,0 +1,45 @@
+"""add block search indexes
+
+Revision ID: d3f6b1a8e2c7
+Revises: 9e4a1c7f2d35
+Create Date: 2026-10-18 16:30:47.918254
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd3f6b1a8e2c7'
+down_revision: Union[str, Sequence[str], None] = '9e4a1c7f2d35'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    # words separated by spaces, must match `_TS_CONFIG` used by `_search_by_keywords`
+    op.create_index(
+        'ix_blocks_content_fts', 'blocks',
+        [sa.text("to_tsvector('simple'::regconfig, content)")],
+        postgresql_using='gin',
+    )
+    # Chinese is not separated by spaces, so substrings are matched by trigrams
+    op.create_index(
+        'ix_blocks_content_trgm', 'blocks', ['content'],
+        postgresql_using='gin', postgresql_ops={'content': 'gin_trgm_ops'},
+    )
+    op.create_index(
+        'ix_block_embeddings_embedding', 'block_embeddings', ['embedding'],
+        postgresql_using='hnsw', postgresql_ops={'embedding': 'vector_cosine_ops'},
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_block_embeddings_embedding', table_name='block_embeddings')
+    op.drop_index('ix_blocks_content_trgm', table_name='blocks')
+    op.drop_index('ix_blocks_content_fts', table_name='blocks')
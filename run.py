@@ -2,34 +2,71 @@
 """
 
 import contextlib
-import fastapi
-import uvicorn
+from app.utils.profile import STARTUP_PROFILE
+STARTUP_PROFILE.install()
+
+import fastapi  # noqa: E402
+import uvicorn  # noqa: E402
 
 
 @contextlib.asynccontextmanager
 async def lifespan(app: fastapi.FastAPI):
-    from app.task import scheduler
-    scheduler.start()
+    from app.task import scheduler, start_scheduler, stop_scheduler
+    from app.business.organize import OrganizeManager
+    from app.llm import prune_llm_cache
+    from app.utils.loop_lag import LOOP_LAG_MONITOR, LoopLagMonitor
+    if LOOP_LAG_MONITOR:
+        LoopLagMonitor.start()
+    with STARTUP_PROFILE.span("start scheduler"):
+        await start_scheduler()
+    scheduler.add_job(
+        prune_llm_cache, "interval", hours=1, id="llm.prune_cache", replace_existing=True
+    )
+    with STARTUP_PROFILE.span("start sources"):
+        await SourceManager.start_all()
+    OrganizeManager.start_worker()
+    STARTUP_PROFILE.report()
     yield
-    scheduler.shutdown(wait=True)
+    await OrganizeManager.stop_worker()
+    await LoopLagMonitor.stop()
+    await SourceManager.close_all()
+    await stop_scheduler()
     await ExtensionManager.close_all()
+    from app.business.resolver import Resolver
+    Resolver.close_pools()
 
 
 api_app = fastapi.FastAPI(title="InKCre", lifespan=lifespan)
 
+from app.engine import SQLDB_REPLICA_ENGINES, ReadYourWritesMiddleware  # noqa: E402
+if SQLDB_REPLICA_ENGINES:
+    api_app.add_middleware(ReadYourWritesMiddleware)
+
+from app.utils import tracing  # noqa: E402
+if tracing.ENABLED:
+    api_app.add_middleware(tracing.TracingMiddleware)
+
 api_app.get("/heartbeat")(lambda: {"status": "ok"})
 
-from app.business.block import BLOCK_ROUTER  # noqa: E402
+from app.utils.metrics import render as render_metrics  # noqa: E402
+api_app.get("/metrics", response_class=fastapi.responses.PlainTextResponse)(render_metrics)
+
+with STARTUP_PROFILE.span("import blocks"):
+    from app.business.block import BLOCK_ROUTER  # noqa: E402
 api_app.include_router(BLOCK_ROUTER)  # TODO register routes here
+from app.business.admin import ADMIN_ROUTER  # noqa: E402
+api_app.include_router(ADMIN_ROUTER)
 
 from app.business.extension import ExtensionManager  # noqa: E402
-ExtensionManager.start_all(api_app)
+with STARTUP_PROFILE.span("start extensions"):
+    ExtensionManager.start_all(api_app)
 
 from app.business.source import SourceManager  # noqa: E402
 source_router = fastapi.APIRouter(prefix="/source", tags=["sources"])
-source_router.get("/{source_id}/collect")(SourceManager.run_a_collect)
+SourceManager.register_apis(source_router)
 api_app.include_router(source_router)
-SourceManager.set_up_collect_jobs()
+with STARTUP_PROFILE.span("set up collect jobs"):
+    SourceManager.set_up_collect_jobs()
 
 
 if __name__ == "__main__":
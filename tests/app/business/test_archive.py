@@ -0,0 +1,51 @@
+import io
+import struct
+import numpy
+import pytest
+
+pa = pytest.importorskip("pyarrow")
+
+from app.business import archive  # noqa: E402
+from app.schemas.block import BlockEmbeddingModel  # noqa: E402
+
+
+def _embedding_batch(num: int):
+    vectors = numpy.random.default_rng(0).random((num, 1024), dtype=numpy.float32)
+    rows = [(i + 1, vector) for i, vector in enumerate(vectors)]
+    return archive._to_batch(BlockEmbeddingModel.__table__, rows), vectors
+
+
+def test_frames_round_trip():
+    batch, vectors = _embedding_batch(3)
+    stream = io.BytesIO(b"".join((
+        archive.MAGIC,
+        archive._encode_frame("block_embeddings", batch),
+        archive._NAME_LENGTH.pack(0),
+    )))
+
+    [(name, decoded)] = list(archive._decode_frames(stream))
+    assert name == "block_embeddings"
+    assert decoded.column("id").to_pylist() == [1, 2, 3]
+    assert numpy.array_equal(decoded.column("embedding").values.to_numpy().reshape(3, -1), vectors)
+
+
+def test_binary_copy_layout():
+    batch, vectors = _embedding_batch(2)
+    data = archive._encode_binary_copy(batch)
+
+    assert data.startswith(archive._PGCOPY_HEADER)
+    assert data.endswith(archive._PGCOPY_TRAILER)
+    row_size = 2 + 8 + 4 + 4 + 4 * 1024
+    assert len(data) == len(archive._PGCOPY_HEADER) + 2 * row_size + len(archive._PGCOPY_TRAILER)
+    row = data[len(archive._PGCOPY_HEADER):][:row_size]
+    assert struct.unpack(">hiiiHH1024f", row) == (2, 4, 1, 4 + 4 * 1024, 1024, 0, *vectors[0].tolist())
+
+
+def test_copy_columns_are_of_the_table():
+    table = BlockEmbeddingModel.__table__
+    batch, _ = _embedding_batch(1)
+    assert archive._copy_columns(table, batch) == '"id", "embedding"'
+
+    forged = pa.RecordBatch.from_pydict({'id") FROM STDIN; --': [1]})
+    with pytest.raises(ValueError):
+        archive._copy_columns(table, forged)
@@ -0,0 +1,137 @@
+import asyncio
+import pytest
+from app.business.block import _reciprocal_rank_fusion
+
+
+def test_rrf_prefers_blocks_ranked_by_many():
+    fused = _reciprocal_rank_fusion({
+        "fts": [1, 2, 3],
+        "trigram": [3, 1],
+        "vector": [4, 3],
+    }, k=60)
+
+    assert [block_id for block_id, _ in fused] == [3, 1, 4, 2]
+    assert fused[0][1] == pytest.approx(1 / 63 + 1 / 61 + 1 / 62)
+
+
+def test_rrf_breaks_ties_by_id():
+    fused = _reciprocal_rank_fusion({"fts": [7], "vector": [5]})
+    assert [block_id for block_id, _ in fused] == [5, 7]
+
+
+def test_beam_search_respects_hop_budget(monkeypatch):
+    from app.business import block
+
+    # a chain 1 -> 2 -> 3 -> 4, query block is 9
+    graph = {1: {2: 0.5}, 2: {1: 0.2, 3: 0.6}, 3: {2: 0.1, 4: 0.9}, 4: {3: 0.1}}
+    monkeypatch.setattr(block, "get_embeddings", lambda text: [0.0])
+    monkeypatch.setattr(block, "_nearest_blocks", lambda embedding, num: {9: 1.0, 1: 0.8})
+    monkeypatch.setattr(block, "_score_neighbours", lambda block_ids, embedding: {
+        neighbour: score for block_id in block_ids for neighbour, score in graph[block_id].items()
+    })
+
+    result = asyncio.run(block._beam_search_query(9, "q", max_hops=2, max_llm_calls=0, beam_width=2))
+
+    assert result.hops == 2
+    assert result.llm_calls == 0
+    assert result.blocks == [1, 3, 2]
+
+
+def test_chunk_by_tokens_keeps_budget():
+    from app.business.block import _chunk_by_tokens
+
+    lines = {1: "a" * 40, 2: "b" * 40, 3: "c" * 400, 4: "d" * 4}
+    assert _chunk_by_tokens([1, 2, 3, 4], lines, max_tokens=20) == [[1, 2], [3], [4]]
+
+
+def test_pick_keeps_all_finalists_once_not_narrowed(monkeypatch):
+    from app.business import block
+
+    picks = []
+
+    async def pick_from_chunk(chunk, lines, relations, requirements):
+        picks.append(chunk)
+        return chunk  # never narrows
+
+    monkeypatch.setattr(block, "_pick_from_chunk", pick_from_chunk)
+    monkeypatch.setattr(block, "PICK_CHUNK_TOKENS", 20)
+    lines = {block_id: "a" * 40 for block_id in range(1, 6)}
+
+    picked = asyncio.run(block._pick_by_chunks(lines, [], ["r"]))
+
+    assert picks == [[1, 2], [3, 4], [5]]
+    assert picked == [1, 2, 3, 4, 5]
+
+
+def test_read_bulk_blocks_splits_ndjson_across_chunks():
+    from app.business.block import _read_bulk_blocks
+
+    class Request:
+        headers = {"content-type": "application/x-ndjson"}
+
+        async def stream(self):
+            yield b'{"resolver": "text", "con'
+            yield b'tent": "a"}\n\nnot json\n{"resolver": "text", '
+            yield b'"content": "b", "id": 3}'
+
+    async def read():
+        return [item async for item in _read_bulk_blocks(Request())]  # type: ignore[arg-type]
+
+    (i0, a), (i1, invalid), (i2, b) = asyncio.run(read())
+    assert (i0, i1, i2) == (0, 1, 2)
+    assert a.content == "a" and isinstance(invalid, str)
+    assert b.content == "b" and b.id is None
+
+
+@pytest.fixture
+def relate(postgres):
+    import sqlmodel
+    from app.schemas.block import BlockModel
+    from app.schemas.relation import RelationModel
+    from app.schemas.storage import StorageTable
+
+    sqlmodel.SQLModel.metadata.create_all(
+        postgres,
+        tables=[
+            StorageTable.__table__,
+            BlockModel.__table__,  # type: ignore[attr-defined]
+            RelationModel.__table__,  # type: ignore[attr-defined]
+        ],
+    )
+    with sqlmodel.Session(postgres) as db:
+        db.add_all(BlockModel(id=block_id, resolver="text", content=str(block_id)) for block_id in range(1, 8))
+        db.commit()
+
+    def relate(*edges: tuple[int, int]) -> list[int]:
+        with sqlmodel.Session(postgres) as db:
+            relations = [RelationModel(from_=from_, to_=to_, content="r") for from_, to_ in edges]
+            db.add_all(relations)
+            db.commit()
+            return [relation.id for relation in relations]
+
+    return relate
+
+
+def _iterate(postgres, block_id: int, **kwargs) -> dict:
+    import sqlmodel
+    from app.business.block import _iterate_from_block
+
+    with sqlmodel.Session(postgres) as db:
+        return asyncio.run(_iterate_from_block(block_id, db, **kwargs))
+
+
+def test_iteration_goes_along_relations_up_to_depth(postgres, relate):
+    ids = relate((1, 2), (2, 3), (3, 4), (4, 5), (1, 6), (6, 7))
+
+    assert _iterate(postgres, 1, max_depth=0) == {"relations": {ids[0], ids[1], ids[4], ids[5]}, "blocks": {2, 3, 6, 7}}
+    assert _iterate(postgres, 1, max_depth=1) == {"relations": set(ids[:3]) | set(ids[4:]), "blocks": {2, 3, 4, 6, 7}}
+    assert _iterate(postgres, 1, max_depth=5) == {"relations": set(ids), "blocks": {2, 3, 4, 5, 6, 7}}
+
+
+def test_iteration_ends_on_cycles(postgres, relate):
+    ids = relate((1, 2), (2, 3), (3, 1), (2, 2))
+
+    assert _iterate(postgres, 1, max_depth=100) == {"relations": set(ids), "blocks": {2, 3}}
+    assert _iterate(postgres, 1, max_depth=100, exclude_start_block=False) == {
+        "relations": set(ids), "blocks": {1, 2, 3}
+    }
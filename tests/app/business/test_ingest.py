@@ -0,0 +1,184 @@
+import asyncio
+import contextlib
+import fastapi
+import fastapi.testclient
+import sqlalchemy
+import sqlmodel
+from app import engine
+from app.business import admin
+from app.business import source as source_module
+from app.business.source import SourceBase, SourceManager
+from app.schemas.source import SourceModel, SourceRunModel
+
+
+class _PullSource(SourceBase):
+
+    async def _collect(self, full=False):
+        return
+        yield
+
+    async def _organize(self, block_id):
+        pass
+
+
+class _PushSource(_PullSource):
+
+    async def _receive(self, payload):
+        return
+        yield
+
+
+def _create_client(monkeypatch, tmp_path) -> fastapi.testclient.TestClient:
+    sqlite = sqlalchemy.create_engine(f"sqlite:///{tmp_path / 'db.sqlite'}")
+    sqlmodel.SQLModel.metadata.create_all(
+        sqlite,
+        tables=[SourceModel.__table__, SourceRunModel.__table__],  # type: ignore[attr-defined]
+    )
+    with sqlmodel.Session(sqlite) as db:
+        db.add(SourceModel(id=1, type="push"))
+        db.add(SourceModel(id=2, type="pull"))
+        db.commit()
+    monkeypatch.setattr(engine, "SQLDB_ENGINE", sqlite)
+    monkeypatch.setattr(admin, "ADMIN_TOKEN", "admin")
+    monkeypatch.setattr(SourceManager, "INGEST_QUEUE", asyncio.Queue())
+    monkeypatch.setitem(SourceManager.SOURCES, 1, _PushSource(1))
+    monkeypatch.setitem(SourceManager.SOURCES, 2, _PullSource(2))
+
+    router = fastapi.APIRouter(prefix="/source")
+    SourceManager.register_apis(router)
+    app = fastapi.FastAPI()
+    app.include_router(router)
+    return fastapi.testclient.TestClient(app)
+
+
+def test_ingest_token_is_reset_by_admin_only(monkeypatch, tmp_path):
+    client = _create_client(monkeypatch, tmp_path)
+    assert client.post("/source/1/ingest/token").status_code == 403
+    assert client.post(
+        "/source/1/ingest/token", headers={"X-Admin-Token": "wrong"}
+    ).status_code == 403
+
+    response = client.post("/source/1/ingest/token", headers={"X-Admin-Token": "admin"})
+    assert response.status_code == 200
+    assert client.post(
+        "/source/1/ingest", json={}, headers={"X-Ingest-Token": response.json()}
+    ).status_code == 202
+
+
+def test_push_with_its_token_is_queued(monkeypatch, tmp_path):
+    client = _create_client(monkeypatch, tmp_path)
+    assert client.post(
+        "/source/1/ingest", json={}, headers={"X-Ingest-Token": "any"}
+    ).status_code == 401
+
+    token = client.post("/source/1/ingest/token", headers={"X-Admin-Token": "admin"}).json()
+    assert client.post(
+        "/source/1/ingest", json={}, headers={"X-Ingest-Token": token + "x"}
+    ).status_code == 401
+    assert client.post(
+        "/source/1/ingest", content=b"{not json", headers={"X-Ingest-Token": token}
+    ).status_code == 400
+    response = client.post(
+        "/source/1/ingest", json={"text": "hi"}, headers={"X-Ingest-Token": token}
+    )
+    assert response.status_code == 202
+    assert response.json() == {"status": "queued"}
+    assert SourceManager.INGEST_QUEUE.get_nowait() == (1, {"text": "hi"})
+    assert SourceManager.INGEST_QUEUE.empty()
+
+
+def test_push_to_source_not_accepting_pushes_is_not_allowed(monkeypatch, tmp_path):
+    client = _create_client(monkeypatch, tmp_path)
+    token = client.post("/source/2/ingest/token", headers={"X-Admin-Token": "admin"}).json()
+    assert client.post(
+        "/source/2/ingest", json={}, headers={"X-Ingest-Token": token}
+    ).status_code == 405
+    assert SourceManager.INGEST_QUEUE.empty()
+
+
+class _IngestingSource:
+
+    def __init__(self):
+        self.ingested = []
+        self.done = asyncio.Event()
+
+    async def ingest(self, payload, run=None):
+        self.ingested.append(payload)
+        self.done.set()
+        return ()
+
+
+def test_push_is_retried_while_its_lock_is_held_elsewhere(monkeypatch):
+    held = [True]
+    attempts = []
+
+    @contextlib.asynccontextmanager
+    async def async_distributed_lock(name):
+        attempts.append(name)
+        yield not held[0]
+
+    async def main():
+        source = _IngestingSource()
+        monkeypatch.setattr(SourceManager, "INGEST_QUEUE", asyncio.Queue())
+        monkeypatch.setattr(SourceManager, "_get_source_ins", classmethod(lambda cls, *args: source))
+        monkeypatch.setattr(SourceManager, "_record_run", staticmethod(lambda run: None))
+        monkeypatch.setattr(source_module, "async_distributed_lock", async_distributed_lock)
+        monkeypatch.setattr(source_module, "INGEST_RETRY_INTERVAL", 0.01)
+
+        consumer = asyncio.create_task(SourceManager._consume_ingest_queue())
+        await SourceManager.INGEST_QUEUE.put((1, {"text": "hi"}))
+        await asyncio.sleep(0.05)
+        assert source.ingested == []
+
+        held[0] = False
+        await asyncio.wait_for(source.done.wait(), 1)
+        consumer.cancel()
+        return source.ingested
+
+    assert asyncio.run(main()) == [{"text": "hi"}]
+    assert len(attempts) > 1 and set(attempts) == {"inkcre.source.1.push"}
+
+
+def test_push_to_source_being_collected_does_not_hold_up_other_pushes(monkeypatch):
+    async def main():
+        sources = {1: _IngestingSource(), 2: _IngestingSource()}
+        monkeypatch.setattr(SourceManager, "INGEST_QUEUE", asyncio.Queue())
+        monkeypatch.setattr(SourceManager, "_LOCKS", {})
+        monkeypatch.setattr(
+            SourceManager, "_get_source_ins", classmethod(lambda cls, source_id, *args: sources[source_id])
+        )
+        monkeypatch.setattr(SourceManager, "_record_run", staticmethod(lambda run: None))
+        monkeypatch.setattr(source_module, "INGEST_RETRY_INTERVAL", 0.01)
+
+        collect = SourceManager._get_lock(1)
+        await collect.acquire()
+        consumer = asyncio.create_task(SourceManager._consume_ingest_queue())
+        await SourceManager.INGEST_QUEUE.put((1, {"text": "to 1"}))
+        await SourceManager.INGEST_QUEUE.put((2, {"text": "to 2"}))
+        await asyncio.wait_for(sources[2].done.wait(), 1)
+        assert sources[1].ingested == []
+
+        collect.release()
+        await asyncio.wait_for(sources[1].done.wait(), 1)
+        consumer.cancel()
+        return sources[1].ingested, sources[2].ingested
+
+    assert asyncio.run(main()) == ([{"text": "to 1"}], [{"text": "to 2"}])
+
+
+def test_run_is_recorded_as_running_until_finished(monkeypatch, tmp_path):
+    _create_client(monkeypatch, tmp_path)
+    seen = []
+
+    def get_statuses():
+        with sqlmodel.Session(engine.SQLDB_ENGINE) as db:
+            return db.exec(sqlmodel.select(SourceRunModel.status)).all()
+
+    async def ingest(source, run):
+        seen.extend(get_statuses())
+
+    run = asyncio.run(SourceManager._run(1, "push", ingest))
+
+    assert seen == ["running"]
+    assert get_statuses() == ["succeeded"]
+    assert run.finished_at is not None
@@ -0,0 +1,87 @@
+import asyncio
+import datetime
+import pytest
+import sqlalchemy
+import sqlmodel
+from app.business import organize
+from app.business.organize import OrganizeManager
+from app.schemas.block import BlockModel
+from app.schemas.organize import OrganizeJobModel
+from app.schemas.source import SourceModel
+from app.schemas.storage import StorageTable
+
+
+@pytest.fixture
+def job_id(postgres) -> int:
+    sqlmodel.SQLModel.metadata.create_all(
+        postgres,
+        tables=[
+            StorageTable.__table__,
+            BlockModel.__table__,  # type: ignore[attr-defined]
+            SourceModel.__table__,  # type: ignore[attr-defined]
+            OrganizeJobModel.__table__,  # type: ignore[attr-defined]
+        ],
+    )
+    with sqlmodel.Session(postgres) as db:
+        block = BlockModel(resolver="text", content="a")
+        db.add(block)
+        db.flush()
+        OrganizeManager.enqueue(db, "block", [block.id])
+        db.commit()
+        return db.exec(sqlmodel.select(OrganizeJobModel.id)).one()
+
+
+def _get_job(postgres, job_id: int) -> OrganizeJobModel:
+    with sqlmodel.Session(postgres) as db:
+        return db.exec(sqlmodel.select(OrganizeJobModel).where(OrganizeJobModel.id == job_id)).one()
+
+
+def _update_job(postgres, job_id: int, **values):
+    with postgres.begin() as conn:
+        conn.execute(
+            sqlalchemy.update(OrganizeJobModel).where(OrganizeJobModel.id == job_id).values(**values)
+        )
+
+
+def test_failed_job_is_retried_with_backoff_until_attempts_run_out(monkeypatch, postgres, job_id):
+    async def execute(job):
+        raise RuntimeError("down")
+
+    monkeypatch.setattr(OrganizeManager, "_execute", execute)
+    monkeypatch.setattr(organize, "MAX_ATTEMPTS", 3)
+
+    for attempts in (1, 2, 3):
+        (job,) = OrganizeManager.claim(8)
+        assert (job.id, job.status, job.attempts) == (job_id, "running", attempts)
+        assert OrganizeManager.claim(8) == ()
+
+        asyncio.run(OrganizeManager._run(job))
+        job = _get_job(postgres, job_id)
+        assert job.error == "RuntimeError('down')"
+        if attempts == 3:
+            break
+        assert (job.status, job.claimed_by) == ("pending", None)
+        backoff = (job.run_after - datetime.datetime.now(datetime.timezone.utc)).total_seconds()
+        assert 30 * 2 ** attempts - 5 < backoff <= 30 * 2 ** attempts
+        assert OrganizeManager.claim(8) == ()
+        _update_job(postgres, job_id, run_after=sqlalchemy.func.now())
+
+    assert job.status == "failed"
+    assert OrganizeManager.claim(8) == ()
+
+
+def test_job_abandoned_by_its_worker_is_reclaimed(postgres, job_id):
+    (job,) = OrganizeManager.claim(8)
+    assert job.attempts == 1
+    _update_job(
+        postgres, job_id,
+        claimed_at=sqlalchemy.func.now() - datetime.timedelta(seconds=organize.CLAIM_TIMEOUT - 5),
+    )
+    assert OrganizeManager.claim(8) == ()
+
+    _update_job(
+        postgres, job_id,
+        claimed_at=sqlalchemy.func.now() - datetime.timedelta(seconds=organize.CLAIM_TIMEOUT + 5),
+    )
+    (job,) = OrganizeManager.claim(8)
+    assert (job.id, job.status, job.attempts) == (job_id, "running", 2)
@@ -0,0 +1,104 @@
+import asyncio
+import time
+import pytest
+import sqlalchemy
+import sqlmodel
+from app.business.resolver import (
+    ImageResolver, Resolver, ResolverLimiter, SubGraph, TextResolver
+)
+from app.schemas.block import BlockModel
+from app.schemas.relation import RelationModel
+from app.schemas.storage import StorageTable
+
+
+def _create_session() -> sqlmodel.Session:
+    engine = sqlalchemy.create_engine("sqlite://")
+    sqlmodel.SQLModel.metadata.create_all(
+        engine,
+        tables=[
+            StorageTable.__table__,
+            BlockModel.__table__,  # type: ignore[attr-defined]
+            RelationModel.__table__,  # type: ignore[attr-defined]
+        ],
+    )
+    return sqlmodel.Session(engine)
+
+
+def test_subgraph_save_maps_temporary_ids():
+    with _create_session() as db:
+        image = BlockModel(resolver="image", content="https://example.com/a.png")
+        db.add(image)
+        db.commit()
+        db.refresh(image)
+
+        subgraph = SubGraph()
+        summary = subgraph.add_block(BlockModel(resolver="text", content="a cat"))
+        detail = subgraph.add_block(BlockModel(resolver="text", content="whiskers"))
+        subgraph.add_relation(image.id, summary, "alt:text")
+        subgraph.add_relation(summary, detail, "has content")
+        relations = subgraph.save(db)
+        db.commit()
+
+        summary_id, detail_id = (block.id for block in subgraph.blocks)
+        assert [(r.from_, r.to_, r.content) for r in relations] == [
+            (image.id, summary_id, "alt:text"),
+            (summary_id, detail_id, "has content"),
+        ]
+        assert db.exec(
+            sqlmodel.select(BlockModel.content).where(BlockModel.id == detail_id)
+        ).one() == "whiskers"
+        assert len(db.exec(sqlmodel.select(RelationModel)).all()) == 2
+
+
+def test_empty_subgraph_saves_nothing():
+    with _create_session() as db:
+        assert SubGraph().save(db) == ()
+
+
+def test_new_dispatches_by_registered_type():
+    assert isinstance(Resolver.new(BlockModel(resolver="text", content="")), TextResolver)
+    assert isinstance(Resolver.new(BlockModel(resolver="image", content="")), ImageResolver)
+    with pytest.raises(NotImplementedError):
+        Resolver.new(BlockModel(resolver="unknown", content=""))
+
+
+def test_limiter_spaces_starts_by_rate():
+    async def run():
+        limiter = ResolverLimiter(concurrency=10, rate=20)
+
+        async def one():
+            async with limiter:
+                pass
+
+        started_at = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(5)))
+        return time.perf_counter() - started_at
+
+    assert asyncio.run(run()) >= 4 / 20
+
+
+def test_img2text_single_flight(monkeypatch):
+    runs = []
+
+    async def load(self):
+        return "digest", None
+
+    async def run_lke_workflow(self, workflow_id, **kwargs):
+        runs.append(workflow_id)
+        await asyncio.sleep(0.05)
+        return {"result": {"summary": "a cat", "details": []}}
+
+    monkeypatch.setattr(ImageResolver, "_ImageResolver__load", load)
+    monkeypatch.setattr(ImageResolver, "_ImageResolver__run_lke_workflow", run_lke_workflow)
+    monkeypatch.setattr(ImageResolver, "_ImageResolver__find_img2text_result", lambda *_: None)
+    monkeypatch.setattr(ImageResolver, "_ImageResolver__save_img2text_result", lambda *_: None)
+    monkeypatch.setattr(ImageResolver, "_ImageResolver__get_custom_variables", lambda self: {})
+
+    async def run():
+        resolvers = [ImageResolver(BlockModel(id=i, resolver="image", content="")) for i in (1, 2)]
+        return await asyncio.gather(*(r._ImageResolver__img2text() for r in resolvers))
+
+    results = asyncio.run(run())
+    assert len(runs) == 1
+    assert results[0] == results[1] == {"summary": "a cat", "details": []}
+    assert not ImageResolver._img2text_flights
@@ -0,0 +1,30 @@
+import uuid
+import pytest
+import sqlalchemy
+import sqlmodel
+from app import engine
+
+
+@pytest.fixture
+def postgres(monkeypatch) -> sqlalchemy.Engine:
+    """An engine on a schema of its own in the database of `DB_*` configs, as `SQLDB_ENGINE`.
+
+    Skips the test if the database is unreachable.
+    """
+    schema = f"test_{uuid.uuid4().hex[:12]}"
+    pg = sqlalchemy.create_engine(
+        engine.SQLDB_ENGINE.url, connect_args={"options": f"-csearch_path={schema}"}
+    )
+    try:
+        with pg.begin() as conn:
+            conn.execute(sqlalchemy.text(f'CREATE SCHEMA "{schema}"'))
+    except sqlalchemy.exc.OperationalError:
+        pg.dispose()
+        pytest.skip("Postgres is unreachable")
+
+    monkeypatch.setattr(engine, "SQLDB_ENGINE", pg)
+    yield pg
+    pg.dispose()
+    with pg.begin() as conn:
+        conn.execute(sqlalchemy.text(f'DROP SCHEMA "{schema}" CASCADE'))
+    pg.dispose()
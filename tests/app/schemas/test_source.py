@@ -0,0 +1,37 @@
+import apscheduler.triggers.cron
+import apscheduler.triggers.interval
+import pydantic
+import pytest
+from app.schemas.source import AdaptiveCollect, CollectAt
+
+
+def test_adaptive_interval_backs_off_when_nothing_collected():
+    adaptive = AdaptiveCollect(min_interval=10, max_interval=60, target=3)
+    assert adaptive.next_interval(20, collected=0) == 40
+    assert adaptive.next_interval(40, collected=0) == 60
+
+
+def test_adaptive_interval_shortens_on_high_yield():
+    adaptive = AdaptiveCollect(min_interval=10, max_interval=60, target=3)
+    assert adaptive.next_interval(40, collected=3) == 20
+    assert adaptive.next_interval(15, collected=5) == 10
+    assert adaptive.next_interval(40, collected=1) == 40
+
+
+def test_adaptive_bounds_must_be_ordered():
+    AdaptiveCollect(min_interval=10, max_interval=10)
+    with pytest.raises(pydantic.ValidationError):
+        AdaptiveCollect(min_interval=60, max_interval=10)
+    with pytest.raises(pydantic.ValidationError):
+        CollectAt.model_validate({"adaptive": {"min_interval": 60 * 25}})
+
+
+def test_collect_at_to_trigger():
+    assert isinstance(
+        CollectAt(hour=3).to_trigger(), apscheduler.triggers.cron.CronTrigger
+    )
+    trigger = CollectAt.model_validate(
+        {"adaptive": {"min_interval": 10, "max_interval": 60}}
+    ).to_trigger(30)
+    assert isinstance(trigger, apscheduler.triggers.interval.IntervalTrigger)
+    assert trigger.interval.total_seconds() == 30 * 60
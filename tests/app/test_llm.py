@@ -0,0 +1,123 @@
+import asyncio
+import concurrent.futures
+import json
+import threading
+import time
+import types
+import pytest
+from app import llm
+
+
+def test_lru_cache_evicts_least_recently_used():
+    cache = llm._LRUCache(maxsize=2, ttl=60)
+    cache.set("a", "1")
+    cache.set("b", "2")
+    cache.get("a")
+    cache.set("c", "3")
+
+    assert cache.get("a") == "1"
+    assert cache.get("b") is None
+    assert cache.get("c") == "3"
+
+
+def test_lru_cache_expires():
+    cache = llm._LRUCache(maxsize=2, ttl=60)
+    cache.set("a", "1", ttl=0)
+    assert cache.get("a") is None
+
+
+def test_cacheable_chat_is_answered_once(monkeypatch):
+    calls = []
+
+    def create(**kwargs):
+        calls.append(kwargs)
+        message = types.SimpleNamespace(content=f"answer {len(calls)}")
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=message)])
+
+    client = types.SimpleNamespace(chat=types.SimpleNamespace(completions=types.SimpleNamespace(create=create)))
+    monkeypatch.setattr(llm, "get_openai_client", lambda: client)
+    monkeypatch.setattr(llm, "LLM_CACHE_PERSIST", False)
+    monkeypatch.setattr(llm, "_chat_cache", llm._LRUCache(maxsize=8, ttl=60))
+
+    assert llm.one_chat("pick blocks", cacheable=True) == "answer 1"
+    assert llm.one_chat("  pick blocks\n", cacheable=True) == "answer 1"
+    assert llm.one_chat("pick blocks") == "answer 2"
+    assert llm.one_chat("pick blocks", model="other", cacheable=True) == "answer 3"
+    assert len(calls) == 3
+
+
+def test_reply_failing_validation_is_not_cached(monkeypatch):
+    replies = iter(["not json", '{"blocks": [1]}'])
+
+    def create(**kwargs):
+        message = types.SimpleNamespace(content=next(replies))
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=message)])
+
+    client = types.SimpleNamespace(chat=types.SimpleNamespace(completions=types.SimpleNamespace(create=create)))
+    monkeypatch.setattr(llm, "get_openai_client", lambda: client)
+    monkeypatch.setattr(llm, "LLM_CACHE_PERSIST", False)
+    monkeypatch.setattr(llm, "_chat_cache", llm._LRUCache(maxsize=8, ttl=60))
+
+    def validate(reply):
+        json.loads(reply)
+
+    with pytest.raises(ValueError):
+        llm.one_chat("pick blocks", cacheable=True, validate=validate)
+    assert llm.one_chat("pick blocks", cacheable=True, validate=validate) == '{"blocks": [1]}'
+    assert llm.one_chat("pick blocks", cacheable=True, validate=validate) == '{"blocks": [1]}'
+
+
+def test_interactive_calls_go_first_and_excess_is_shed(monkeypatch):
+    monkeypatch.setattr(llm, "LLM_CONCURRENCY", 1)
+    monkeypatch.setattr(llm, "LLM_MAX_QUEUE_INTERACTIVE", 1)
+    admission = llm._Admission()
+    order = []
+
+    def call(priority, name):
+        llm._priority.set(priority)
+        with admission.slot():
+            order.append(name)
+
+    with admission.slot():
+        background = threading.Thread(target=call, args=("background", "background"))
+        background.start()
+        time.sleep(0.05)
+        interactive = threading.Thread(target=call, args=("interactive", "interactive"))
+        interactive.start()
+        time.sleep(0.05)
+
+        token = llm._priority.set("interactive")
+        with pytest.raises(llm.LLMOverloaded) as excinfo:
+            with admission.slot():
+                pass
+        llm._priority.reset(token)
+        assert excinfo.value.headers == {"Retry-After": str(llm.LLM_RETRY_AFTER)}
+    background.join()
+    interactive.join()
+
+    assert order == ["interactive", "background"]
+
+
+def test_calls_waiting_in_the_loop_hold_no_thread(monkeypatch):
+    monkeypatch.setattr(llm, "LLM_CONCURRENCY", 1)
+    monkeypatch.setattr(llm, "LLM_MAX_QUEUE_INTERACTIVE", 2)
+    monkeypatch.setattr(llm, "_admission", llm._Admission())
+    release = threading.Event()
+
+    async def main():
+        # a default executor of one thread, which waiting calls would take
+        asyncio.get_running_loop().set_default_executor(concurrent.futures.ThreadPoolExecutor(1))
+        llm._priority.set("interactive")
+        running = asyncio.create_task(llm.call_in_slot(release.wait))
+        waiting = [asyncio.create_task(llm.call_in_slot(lambda i=i: i)) for i in range(2)]
+        await asyncio.sleep(0.05)
+
+        assert await asyncio.to_thread(lambda: "free") == "free"
+        with pytest.raises(llm.LLMOverloaded):
+            await llm.call_in_slot(lambda: None)
+
+        release.set()
+        assert await running
+        return await asyncio.gather(*waiting)
+
+    assert asyncio.run(main()) == [0, 1]
@@ -0,0 +1,57 @@
+import asyncio
+import types
+from app import task
+
+
+def test_distributed_lock_is_not_acquired_while_held_elsewhere(monkeypatch, postgres):
+    monkeypatch.setattr(task, "TASK_COORDINATION", "postgres")
+    monkeypatch.setattr(task, "SQLDB_DIRECT_ENGINE", postgres)
+
+    with task.distributed_lock("inkcre.test") as acquired:
+        assert acquired
+        with task.distributed_lock("inkcre.test") as acquired_elsewhere:
+            assert not acquired_elsewhere
+        with task.distributed_lock("inkcre.test.other") as acquired_other:
+            assert acquired_other
+    with task.distributed_lock("inkcre.test") as acquired:
+        assert acquired
+
+    async def hold_in_loop():
+        async with task.async_distributed_lock("inkcre.test") as acquired:
+            with task.distributed_lock("inkcre.test") as acquired_elsewhere:
+                return acquired, acquired_elsewhere
+
+    assert asyncio.run(hold_in_loop()) == (True, False)
+    with task.distributed_lock("inkcre.test") as acquired:
+        assert acquired
+
+
+def test_leader_funcs_run_once_leading(monkeypatch):
+    monkeypatch.setattr(task, "TASK_COORDINATION", "postgres")
+    monkeypatch.setattr(task, "LEADER_CHECK_INTERVAL", 0.01)
+    monkeypatch.setattr(task, "scheduler", types.SimpleNamespace(resume=lambda: None, pause=lambda: None))
+    monkeypatch.setattr(task, "_leader_funcs", [])
+    monkeypatch.setattr(task, "_leader_conn", None)
+    leading = [False]
+    monkeypatch.setattr(
+        task, "_try_advisory_lock",
+        lambda name: types.SimpleNamespace(execute=lambda *args: None) if leading[0] else None,
+    )
+    started = []
+
+    async def start():
+        started.append(1)
+
+    async def main():
+        await task.run_as_leader(start)
+        assert started == []
+
+        campaign = asyncio.create_task(task._campaign())
+        await asyncio.sleep(0.05)
+        assert started == []
+        leading[0] = True
+        await asyncio.sleep(0.05)
+        campaign.cancel()
+
+    asyncio.run(main())
+    assert started == [1]
@@ -0,0 +1,43 @@
+import pytest
+from app.utils import breaker
+from app.utils.breaker import CircuitBreaker, CircuitOpen
+
+
+def fail(circuit: CircuitBreaker):
+    with pytest.raises(ConnectionError):
+        with circuit.call():
+            raise ConnectionError
+
+
+def test_breaker_opens_on_failure_rate_and_probes(monkeypatch):
+    monkeypatch.setattr(breaker, "MIN_CALLS", 4)
+    monkeypatch.setattr(breaker, "OPEN_SECONDS", 60)
+    circuit = CircuitBreaker("test", is_failure=lambda e: isinstance(e, ConnectionError))
+
+    with circuit.call():
+        pass
+    with pytest.raises(ValueError):
+        with circuit.call():
+            raise ValueError  # not of the provider
+    fail(circuit)
+    assert circuit.state == "closed"
+    fail(circuit)
+    assert circuit.state == "open"
+
+    with pytest.raises(CircuitOpen) as excinfo:
+        with circuit.call():
+            pass
+    assert excinfo.value.status_code == 503 and 0 < excinfo.value.retry_in <= 60
+
+    monkeypatch.setattr(breaker, "OPEN_SECONDS", 0)
+    assert circuit.state == "half_open"
+    monkeypatch.setattr(breaker, "OPEN_SECONDS", 60)
+    fail(circuit)
+    assert circuit.state == "open"
+
+    monkeypatch.setattr(breaker, "OPEN_SECONDS", 0)
+    with circuit.call():
+        with pytest.raises(CircuitOpen):
+            with circuit.call():
+                pass  # only one probe at a time
+    assert circuit.state == "closed"
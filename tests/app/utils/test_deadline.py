@@ -0,0 +1,58 @@
+import asyncio
+import time
+import fastapi
+import fastapi.testclient
+from app.utils import deadline
+
+
+def _create_app(seconds: float, steps: list) -> fastapi.FastAPI:
+    app = fastapi.FastAPI()
+
+    @app.get("/slow", dependencies=[fastapi.Depends(deadline.deadline(seconds))])
+    async def slow():
+        for step in range(10):
+            deadline.check()
+            steps.append(step)
+            await asyncio.sleep(0.1)
+
+    return app
+
+
+def test_request_past_its_deadline_is_answered_with_504():
+    steps: list[int] = []
+    response = fastapi.testclient.TestClient(_create_app(0.25, steps)).get("/slow")
+    assert response.status_code == 504
+    assert len(steps) < 10
+
+
+def test_request_of_disconnected_client_is_cancelled(monkeypatch):
+    monkeypatch.setattr(deadline, "DISCONNECT_POLL_INTERVAL", 0.05)
+    steps: list[int] = []
+    app = _create_app(10, steps)
+    sent = []
+
+    async def main():
+        messages = [{"type": "http.request", "body": b"", "more_body": False}]
+        disconnect_at = time.monotonic() + 0.15
+
+        async def receive():
+            if messages:
+                return messages.pop()
+            if time.monotonic() < disconnect_at:
+                await asyncio.sleep(disconnect_at - time.monotonic())
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+            "method": "GET", "scheme": "http", "path": "/slow", "raw_path": b"/slow",
+            "root_path": "", "query_string": b"", "headers": [],
+            "client": ("testclient", 1), "server": ("testserver", 80),
+        }
+        await app(scope, receive, send)
+
+    asyncio.run(main())
+    assert len(steps) < 4
+    assert sent[0]["status"] == 499
@@ -0,0 +1,27 @@
+import io
+import numpy
+from PIL import Image
+from app.utils.image import preprocess_image
+
+
+def _image_bytes(size: tuple[int, int], format: str = "PNG") -> bytes:
+    pixels = numpy.random.default_rng(0).integers(0, 256, (12, 16, 3), dtype=numpy.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).resize(size, Image.Resampling.BICUBIC).save(buffer, format=format)
+    return buffer.getvalue()
+
+
+def test_preprocess_downscales_and_reencodes():
+    image = preprocess_image(_image_bytes((3000, 2000)), max_edge=1024)
+
+    assert (image.width, image.height) == (1024, 683)
+    assert image.mime_type == "image/jpeg"
+    assert Image.open(io.BytesIO(image.data)).format == "JPEG"
+
+
+def test_phash_stable_across_resizing():
+    original = preprocess_image(_image_bytes((1600, 1200)))
+    resized = preprocess_image(_image_bytes((400, 300), format="JPEG"))
+
+    distance = bin(int(original.phash, 16) ^ int(resized.phash, 16)).count("1")
+    assert distance <= 4
@@ -0,0 +1,51 @@
+import asyncio
+import time
+from app.utils import loop_lag
+from app.utils.loop_lag import LoopLagMonitor
+
+
+def block_the_loop():
+    time.sleep(0.3)
+
+
+def test_blocking_call_is_recorded_with_its_stack(monkeypatch):
+    monkeypatch.setattr(loop_lag, "INTERVAL", 0.02)
+    monkeypatch.setattr(loop_lag, "THRESHOLD", 0.05)
+    LoopLagMonitor.blocks.clear()
+
+    async def main():
+        LoopLagMonitor.start()
+        await asyncio.sleep(0.1)
+        block_the_loop()
+        await asyncio.sleep(0.1)
+        await LoopLagMonitor.stop()
+
+    asyncio.run(main())
+
+    report = LoopLagMonitor.report()
+    (block,) = report["blocks"]
+    assert block.released and block.seconds >= 0.25
+    assert any("block_the_loop" in line for line in block.stack)
+    assert report["lag"]["max"] >= 0.25
+
+
+def test_each_blocking_call_is_one_block(monkeypatch):
+    monkeypatch.setattr(loop_lag, "INTERVAL", 0.02)
+    monkeypatch.setattr(loop_lag, "THRESHOLD", 0.05)
+    # widen the time the heartbeat takes to let a block go
+    monkeypatch.setattr(loop_lag.logger, "warning", lambda *args: time.sleep(0.04))
+    LoopLagMonitor.blocks.clear()
+
+    async def main():
+        LoopLagMonitor.start()
+        for _ in range(5):
+            await asyncio.sleep(0.1)
+            block_the_loop()
+        await asyncio.sleep(0.1)
+        await LoopLagMonitor.stop()
+
+    asyncio.run(main())
+
+    blocks = LoopLagMonitor.report()["blocks"]
+    assert len(blocks) == 5
+    assert all(any("block_the_loop" in line for line in block.stack) for block in blocks)
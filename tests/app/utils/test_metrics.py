@@ -0,0 +1,26 @@
+from app.utils.metrics import Counter, Histogram, render
+
+
+def test_counter_renders_labelled_samples():
+    counter = Counter("test_requests_total", "Requests.")
+    counter.inc(path="/a")
+    counter.inc(2, path="/a")
+    counter.inc(path='/"b"')
+
+    rendered = render()
+    assert "# TYPE test_requests_total counter" in rendered
+    assert 'test_requests_total{path="/a"} 3' in rendered
+    assert 'test_requests_total{path="/\\"b\\""} 1' in rendered
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram("test_latency_seconds", "Latency.", buckets=(0.1, 1))
+    histogram.observe(0.05)
+    histogram.observe(0.5)
+    histogram.observe(5)
+
+    rendered = render()
+    assert 'test_latency_seconds_bucket{le="0.1"} 1' in rendered
+    assert 'test_latency_seconds_bucket{le="1"} 2' in rendered
+    assert 'test_latency_seconds_bucket{le="+Inf"} 3' in rendered
+    assert "test_latency_seconds_count 3" in rendered
@@ -0,0 +1,55 @@
+import json
+import fastapi
+import fastapi.testclient
+from app.utils import tracing
+
+
+def test_disabled_tracing_is_noop(monkeypatch):
+    monkeypatch.setattr(tracing, "ENABLED", False)
+
+    def func():
+        pass
+
+    assert tracing.traced("func")(func) is func
+    with tracing.span("noop", "db") as span:
+        span.set(key="value")
+    assert not isinstance(span, tracing.Span)
+
+
+def test_middleware_reports_breakdown_and_exports_spans(monkeypatch, tmp_path):
+    monkeypatch.setattr(tracing, "ENABLED", True)
+    exporter = tracing._Exporter(str(tmp_path / "traces.jsonl"))
+    monkeypatch.setattr(tracing, "_EXPORTER", exporter)
+
+    app = fastapi.FastAPI()
+    app.add_middleware(tracing.TracingMiddleware)
+
+    @app.get("/items/{item_id}")
+    def get_item(item_id: int):
+        with tracing.span("query", "db"):
+            pass
+        with tracing.span("query", "db"):
+            pass
+        return {"id": item_id}
+
+    trace_id = "0af7651916cd43dd8448eb211c80319c"
+    response = fastapi.testclient.TestClient(app).get(
+        "/items/1", headers={"traceparent": f"00-{trace_id}-b7ad6b7169203331-01"}
+    )
+    assert response.status_code == 200
+    server_timing = response.headers["server-timing"]
+    assert 'db;dur=' in server_timing and 'desc="2 spans"' in server_timing
+    assert f'trace;desc="{trace_id}"' in server_timing
+
+    exporter.flush()
+    (line,) = (tmp_path / "traces.jsonl").read_text().splitlines()
+    spans = json.loads(line)["resourceSpans"][0]["scopeSpans"][0]["spans"]
+    root = next(span for span in spans if span["kind"] == 2)
+    assert root["name"] == "GET /items/{item_id}"
+    assert root["parentSpanId"] == "b7ad6b7169203331"
+    children = [span for span in spans if span["name"] == "query"]
+    assert len(children) == 2
+    assert all(
+        span["traceId"] == trace_id and span["parentSpanId"] == root["spanId"]
+        for span in children
+    )